@@ -1,5 +1,8 @@
 from django_filters import rest_framework as filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Favorite, Ingredient, Purchase, Recipe, Tag
+from recipes.scores import ORDERINGS, order_by_score
+from recipes.search import search_recipes
+from recipes.tags import filter_by_tags
 
 
 class IngredientFilter(filters.FilterSet):
@@ -13,10 +16,47 @@ class IngredientFilter(filters.FilterSet):
 class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
                                              to_field_name='slug',
-                                             queryset=Tag.objects.all())
-    is_favorited = filters.BooleanFilter()
-    is_in_shopping_cart = filters.BooleanFilter()
+                                             queryset=Tag.objects.all(),
+                                             method='filter_tags')
+    is_favorited = filters.BooleanFilter(method='filter_user_recipes')
+    is_in_shopping_cart = filters.BooleanFilter(method='filter_user_recipes')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in ORDERINGS],
+        method='filter_ordering'
+    )
+
+    user_recipes_models = {
+        'is_favorited': Favorite,
+        'is_in_shopping_cart': Purchase,
+    }
 
     class Meta:
         model = Recipe
         fields = ['author', 'tags']
+
+    def filter_user_recipes(self, queryset, name, value):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none() if value else queryset
+        user_recipes = (self.user_recipes_models[name]
+                        .objects
+                        .filter(user=user)
+                        .values('recipe'))
+        if value:
+            return queryset.filter(pk__in=user_recipes)
+        return queryset.exclude(pk__in=user_recipes)
+
+    def filter_tags(self, queryset, name, value):
+        # Без параметра значение - пустой queryset тегов.
+        if not value:
+            return queryset
+        return filter_by_tags(queryset, value)
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return order_by_score(queryset, value)
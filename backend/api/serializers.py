@@ -1,12 +1,16 @@
-import base64
+import binascii
 
+from core.bulk import duplicates, unique
+from core.profiling import ProfiledSerializerMixin
+from core.relations import get_context_relations
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.base import ContentFile
-from recipes import services
+from django.core.files.storage import default_storage
+from recipes import images, services
 from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
                             RecipeIngredient, Tag)
 from rest_framework import serializers
+from users import services as user_services
 from users.models import Subscription
 from users.serializers import UserSerializer
 
@@ -14,15 +18,71 @@ User = get_user_model()
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'too_large': 'Размер картинки превышает {max_size} байт.',
+        'too_many_pixels': 'Картинка содержит больше {max_pixels} пикселей.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             img_format, img_str = data.split(';base64,')
             ext = img_format.split('/')[-1]
-            data = ContentFile(base64.b64decode(img_str), name='img.' + ext)
-        return super().to_internal_value(data)
+            try:
+                data = images.decode_base64_file(img_str, name='img.' + ext)
+            except images.ImageTooLargeError:
+                self.fail('too_large',
+                          max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+            except binascii.Error:
+                self.fail('invalid_image')
+        file = super().to_internal_value(data)
+        image = getattr(file, 'image', None)
+        if (image is not None and image.width * image.height
+                > settings.RECIPE_IMAGE_MAX_PIXELS):
+            self.fail('too_many_pixels',
+                      max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS)
+        return file
+
+
+def file_url(name, request=None):
+    """
+    Ссылка на файл хранилища, как у FileField и ImageField DRF.
+    """
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def image_variant_urls(image_variants, variant, request=None):
+    """
+    Ссылки на уменьшенные копии картинки {формат: ссылка}
+    или None, если копий нет.
+    """
+    names = image_variants.get(variant)
+    if not names:
+        return None
+    return {extension: file_url(name, request)
+            for extension, name in names.items()}
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class ImageVariantField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии картинки рецепта в форматах JPEG и WebP.
+    Пока копии не созданы, возвращается None.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['source'] = 'image_variants'
+        super().__init__(**kwargs)
+
+    def to_representation(self, image_variants):
+        return image_variant_urls(image_variants, self.variant,
+                                  self.context.get('request'))
+
+
+class IngredientSerializer(ProfiledSerializerMixin,
+                           serializers.ModelSerializer):
     """
     Сериализатор ингредиентов.
     """
@@ -33,7 +93,8 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ProfiledSerializerMixin,
+                    serializers.ModelSerializer):
     """
     Сериализатор тегов.
     """
@@ -44,11 +105,37 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class PrimaryKeyField(serializers.RelatedField):
+    """
+    Поле связанного объекта по первичному ключу. В отличие от
+    PrimaryKeyRelatedField возвращает ключ без запроса к базе данных:
+    объекты для всех ключей загружает сериализатор одним запросом.
+    """
+    default_error_messages = {
+        'incorrect_type': ('Некорректный тип. Ожидалось значение первичного '
+                           'ключа, получен {data_type}.'),
+    }
+
+    def use_pk_only_optimization(self):
+        return True
+
+    def to_representation(self, value):
+        return value.pk
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     """
     Сериализатор ингредиентов рецепта.
     """
-    id = serializers.PrimaryKeyRelatedField(
+    id = PrimaryKeyField(
         source='ingredient',
         queryset=Ingredient.objects.all()
     )
@@ -68,7 +155,10 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
 
-class TagField(serializers.RelatedField):
+class TagField(PrimaryKeyField):
+
+    def use_pk_only_optimization(self):
+        return False
 
     def to_representation(self, value):
         return {
@@ -78,16 +168,20 @@ class TagField(serializers.RelatedField):
             'slug': value.slug,
         }
 
-    def to_internal_value(self, data):
-        try:
-            return self.queryset.get(pk=int(data))
-        except (ObjectDoesNotExist, ValueError):
-            raise serializers.ValidationError(
-                f'Недопустимый первичный ключ "{data}" - тег не найден.'
-            )
+
+def load_objects(queryset, ids, message):
+    """
+    Загружает объекты queryset по списку первичных ключей ids одним
+    запросом in_bulk. Возвращает словарь {id: объект} и ошибки message
+    для всех ключей, которых нет в queryset.
+    """
+    objects = queryset.in_bulk(set(ids))
+    return objects, [message.format(pk=pk) for pk in unique(ids)
+                     if pk not in objects]
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(ProfiledSerializerMixin,
+                       serializers.ModelSerializer):
     """
     Сериализатор рецептов.
     """
@@ -95,10 +189,10 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(many=True,
                                              source='ingredients_in_recipe')
     image = Base64ImageField()
+    thumbnail = ImageVariantField('thumbnail')
     author = UserSerializer(read_only=True)
-    is_favorited = serializers.BooleanField(read_only=True, default=False)
-    is_in_shopping_cart = serializers.BooleanField(read_only=True,
-                                                   default=False)
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -110,12 +204,21 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'thumbnail',
                   'text',
-                  'cooking_time']
+                  'cooking_time',
+                  'favorites_count']
         read_only_fields = ['id',
                             'author',
                             'is_favorited',
-                            'is_in_shopping_cart']
+                            'is_in_shopping_cart',
+                            'favorites_count']
+
+    def get_is_favorited(self, recipe):
+        return recipe.pk in get_context_relations(self.context).favorites
+
+    def get_is_in_shopping_cart(self, recipe):
+        return recipe.pk in get_context_relations(self.context).purchases
 
     def create(self, validated_data):
         return services.create_recipe(validated_data)
@@ -124,28 +227,85 @@ class RecipeSerializer(serializers.ModelSerializer):
         return services.update_recipe(instance, validated_data)
 
     def validate(self, data):
-        recipe_ingredients = data.get('ingredients_in_recipe')
-        unique_ingredients = []
-        for recipe_ingredient in recipe_ingredients:
-            ingredient = recipe_ingredient.get('ingredient')
-            if ingredient in unique_ingredients:
-                raise serializers.ValidationError(
-                    'Каждый ингредиент может быть выбран только один раз.')
-            unique_ingredients.append(ingredient)
+        """
+        Загружает теги и ингредиенты рецепта двумя запросами in_bulk
+        и сообщает обо всех ненайденных и повторяющихся ключах сразу.
+        """
+        errors = {}
+        if 'tags' in data:
+            tags, errors['tags'] = load_objects(
+                Tag.objects.all(), data['tags'],
+                'Недопустимый первичный ключ "{pk}" - тег не найден.')
+            data['tags'] = [tags[pk] for pk in unique(data['tags'])
+                            if pk in tags]
+        if 'ingredients_in_recipe' in data:
+            recipe_ingredients = data['ingredients_in_recipe']
+            ids = [item['ingredient'] for item in recipe_ingredients]
+            ingredients, errors['ingredients'] = load_objects(
+                Ingredient.objects.all(), ids,
+                'Недопустимый первичный ключ "{pk}" - ингредиент не найден.')
+            errors['ingredients'] += [
+                f'Каждый ингредиент может быть выбран только один раз: '
+                f'"{pk}".' for pk in duplicates(ids)
+            ]
+            for item in recipe_ingredients:
+                item['ingredient'] = ingredients.get(item['ingredient'])
+        errors = {field: error for field, error in errors.items() if error}
+        if errors:
+            raise serializers.ValidationError(errors)
         return data
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class RecipeRowSerializer(ProfiledSerializerMixin,
+                          serializers.BaseSerializer):
+    """
+    Сериализатор рецептов только для чтения: словари рецептов
+    services.get_recipe_rows преобразуются без полей DRF.
+    Результат побайтно совпадает с RecipeSerializer (проверяется
+    в api.tests.RecipeRowsTests).
+    """
+
+    def to_representation(self, row):
+        relations = get_context_relations(self.context)
+        request = self.context.get('request')
+        return {
+            'id': row['id'],
+            'tags': row['tags'],
+            'author': {
+                'email': row['author__email'],
+                'id': row['author_id'],
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+                'is_subscribed': row['author_id'] in relations.subscriptions,
+            },
+            'ingredients': row['ingredients'],
+            'is_favorited': row['id'] in relations.favorites,
+            'is_in_shopping_cart': row['id'] in relations.purchases,
+            'name': row['name'],
+            'image': file_url(row['image'], request),
+            'thumbnail': image_variant_urls(row['image_variants'],
+                                            'thumbnail', request),
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+            'favorites_count': row['favorites_count'],
+        }
+
+
+class ShortRecipeSerializer(ProfiledSerializerMixin,
+                            serializers.ModelSerializer):
     """
     Сериализатор рецептов для сокращенного представления.
     """
+    thumbnail = ImageVariantField('thumbnail')
 
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'thumbnail', 'cooking_time']
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ProfiledSerializerMixin,
+                         serializers.ModelSerializer):
     """
     Сериализатор избранных рецептов.
     """
@@ -161,8 +321,12 @@ class FavoriteSerializer(serializers.ModelSerializer):
             )
         ]
 
+    def create(self, validated_data):
+        return services.create_favorite(validated_data)
+
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(ProfiledSerializerMixin,
+                          serializers.ModelSerializer):
     """
     Сериализатор для создания подписки на автора.
     """
@@ -184,14 +348,17 @@ class SubscribeSerializer(serializers.ModelSerializer):
                 'Подписка на самого себя запрещена!')
         return attrs
 
+    def create(self, validated_data):
+        return user_services.create_subscription(validated_data)
+
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(ProfiledSerializerMixin,
+                             serializers.ModelSerializer):
     """
     Сериализатор для чтения подписок.
     """
-    is_subscribed = serializers.BooleanField(default=False)
+    is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -204,18 +371,33 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'is_subscribed',
             'recipes',
             'recipes_count',
+            'subscribers_count',
         ]
-        read_only_fields = ['id', 'is_subscribed']
+        read_only_fields = ['id', 'is_subscribed', 'recipes_count',
+                            'subscribers_count']
 
-    def get_recipes(self, author):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        recipes = services.get_author_recipes(author=author,
-                                              recipes_limit=recipes_limit)
-        return ShortRecipeSerializer(recipes, many=True).data
+    def get_is_subscribed(self, author):
+        return author.pk in get_context_relations(self.context).subscriptions
+
+    @staticmethod
+    def get_recipes(author):
+        return ShortRecipeSerializer(author.recipes.all(), many=True).data
 
 
-class PurchaseSerializer(serializers.ModelSerializer):
+class BulkIdsSerializer(ProfiledSerializerMixin,
+                        serializers.Serializer):
+    """
+    Сериализатор списка id для пакетного добавления и удаления.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_ITEMS
+    )
+
+
+class PurchaseSerializer(ProfiledSerializerMixin,
+                         serializers.ModelSerializer):
     """
     Сериализатор для добавления рецепта в корзину покупок.
     """
@@ -230,3 +412,6 @@ class PurchaseSerializer(serializers.ModelSerializer):
                 message='Это рецепт уже есть в корзине покупок.'
             )
         ]
+
+    def create(self, validated_data):
+        return services.create_purchase(validated_data)
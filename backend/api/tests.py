@@ -0,0 +1,464 @@
+from api.serializers import (RecipeRowSerializer, RecipeSerializer,
+                             TagSerializer)
+from asgiref.sync import async_to_sync
+from core.profiling import ProfiledListSerializer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipes import services
+from recipes.exporters import RENDERERS
+from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
+                            RecipeIngredient, RecipeScore, Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import Subscription
+
+User = get_user_model()
+
+SHOPPING_CART_URL = '/api/recipes/download_shopping_cart/'
+RECIPES_URL = '/api/recipes/'
+SHOPPING_LIST = 'recipes_shoppinglistitem'
+
+
+async def asgi_get(path, query_string, headers):
+    """
+    Выполняет GET запрос через ASGIHandler, как сервер ASGI: ответ
+    перебирается в цикле событий. Возвращает код ответа и тело.
+    """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'localhost'),
+                    *[(name.encode(), value.encode())
+                      for name, value in headers.items()]],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await ASGIHandler()(scope, receive, send)
+    status = next(message['status'] for message in messages
+                  if message['type'] == 'http.response.start')
+    body = b''.join(message.get('body', b'') for message in messages
+                    if message['type'] == 'http.response.body')
+    return status, body
+
+
+class ShoppingCartDownloadTests(TestCase):
+    """
+    Скачивание списка покупок под WSGI и ASGI.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@foodgram.local',
+            first_name='Buyer', last_name='Buyer', password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/test.png', author=cls.user)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=number)
+            for number, ingredient in enumerate(
+                Ingredient.objects.order_by('pk')[:3], start=1)
+        )
+        Purchase.objects.create(user=cls.user, recipe=recipe)
+        services.rebuild_shopping_list(cls.user)
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        # Как тестовый клиент: закрытие соединения в конце запроса
+        # прервало бы транзакцию теста.
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def test_asgi_download_matches_wsgi(self):
+        headers = {'authorization': f'Token {self.token.key}'}
+        for file_format in RENDERERS:
+            with self.subTest(format=file_format):
+                response = self.client.get(SHOPPING_CART_URL,
+                                           {'format': file_format})
+                self.assertEqual(response.status_code, 200)
+                wsgi_body = b''.join(response.streaming_content)
+                status, asgi_body = async_to_sync(asgi_get)(
+                    SHOPPING_CART_URL, f'format={file_format}', headers)
+                self.assertEqual(status, 200)
+                self.assertEqual(asgi_body, wsgi_body)
+
+    def test_wsgi_download_streams_rows(self):
+        # Под WSGI строки списка покупок читаются при переборе ответа.
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(SHOPPING_CART_URL, {'format': 'txt'})
+        self.assertTrue(response.streaming)
+        self.assertFalse(any(SHOPPING_LIST in query['sql']
+                             for query in context.captured_queries))
+        with CaptureQueriesContext(connection) as context:
+            b''.join(response.streaming_content)
+        self.assertTrue(any(SHOPPING_LIST in query['sql']
+                            for query in context.captured_queries))
+
+    def test_text_download_contains_items(self):
+        response = self.client.get(SHOPPING_CART_URL, {'format': 'txt'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+
+class IngredientAutocompleteTests(TestCase):
+    """
+    Ограничение количества подсказок ингредиентов параметром limit.
+    """
+    url = '/api/ingredients/autocomplete/'
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def get_count(self, **params):
+        response = self.client.get(self.url, {'name': 'а', **params})
+        self.assertEqual(response.status_code, 200)
+        return len(response.data)
+
+    def test_limit(self):
+        self.assertEqual(self.get_count(),
+                         settings.INGREDIENT_AUTOCOMPLETE_LIMIT)
+        self.assertEqual(self.get_count(limit='abc'),
+                         settings.INGREDIENT_AUTOCOMPLETE_LIMIT)
+        self.assertEqual(self.get_count(limit=3), 3)
+        for limit in (0, -1, -1000):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.get_count(limit=limit), 1)
+        self.assertEqual(self.get_count(limit=10 ** 6),
+                         settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT)
+
+
+class CursorPaginationTests(TestCase):
+    """
+    Курсорная пагинация ленты при одинаковом времени публикации
+    и одинаковых рейтингах.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.local',
+            first_name='Author', last_name='Author', password='password')
+        Recipe.objects.bulk_create(
+            Recipe(name=f'Рецепт {number}', text='Описание',
+                   cooking_time=10, image='recipes/test.png', author=author)
+            for number in range(8)
+        )
+        Recipe.objects.update(published_at=timezone.now())
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe=recipe, popular=1.0, trending=1.0, stale=False)
+            for recipe in Recipe.objects.all()
+        )
+        cls.recipe_ids = list(Recipe.objects
+                              .order_by('-id')
+                              .values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        # Ответы из кэша не выполняют запросов.
+        cache.clear()
+
+    def get_pages(self, url, link):
+        """
+        Проходит страницы по ссылкам link (next или previous).
+        Возвращает id рецептов страниц и SQL запросов лент.
+        """
+        pages, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id']
+                          for recipe in response.data['results']])
+            queries += [query['sql'] for query in context.captured_queries
+                        if 'recipes_recipe' in query['sql']]
+            url = response.data[link]
+        return pages, queries
+
+    def test_ties_without_offset(self):
+        pages, queries = self.get_pages(
+            f'{RECIPES_URL}?pagination=cursor&limit=3', 'next')
+        self.assertEqual(pages, [self.recipe_ids[:3],
+                                 self.recipe_ids[3:6],
+                                 self.recipe_ids[6:]])
+        for sql in queries:
+            self.assertNotIn('OFFSET', sql)
+
+    def test_score_ties_without_offset(self):
+        for ordering in ('popular', 'trending'):
+            with self.subTest(ordering=ordering):
+                pages, queries = self.get_pages(
+                    f'{RECIPES_URL}?ordering={ordering}'
+                    f'&pagination=cursor&limit=3', 'next')
+                self.assertEqual(pages, [self.recipe_ids[:3],
+                                         self.recipe_ids[3:6],
+                                         self.recipe_ids[6:]])
+                for sql in queries:
+                    self.assertNotIn('OFFSET', sql)
+
+    def test_previous_pages(self):
+        url = f'{RECIPES_URL}?pagination=cursor&limit=3'
+        for _ in range(2):
+            url = self.client.get(url).data['next']
+        response = self.client.get(url)
+        pages, queries = self.get_pages(response.data['previous'],
+                                        'previous')
+        self.assertEqual(pages, [self.recipe_ids[3:6],
+                                 self.recipe_ids[:3]])
+        for sql in queries:
+            self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(RECIPES_URL, {'cursor': 'cD1hYmM='})
+        self.assertEqual(response.status_code, 404)
+
+
+class SubscriptionsTests(TestCase):
+    """
+    Количество запросов списка подписок не зависит от размера страницы
+    и recipes_limit.
+    """
+    url = '/api/users/subscriptions/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@foodgram.local',
+            first_name='User', last_name='User', password='password')
+        for number in range(12):
+            author = User.objects.create_user(
+                username=f'author{number:02}',
+                email=f'author{number}@foodgram.local',
+                first_name='Author', last_name='Author', password='password')
+            Subscription.objects.create(user=cls.user, author=author)
+            # Рецепты создаются по одному: счетчик рецептов автора
+            # обновляется сигналом.
+            for recipe in range(number % 4 + 1):
+                Recipe.objects.create(
+                    name=f'Рецепт {recipe}', text='Описание',
+                    cooking_time=10, image='recipes/test.png',
+                    author=author)
+        User.objects.create_user(
+            username='other', email='other@foodgram.local',
+            first_name='Other', last_name='Other', password='password')
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def get(self, **params):
+        # Кэш очищается перед запросом: бюджет холодного кэша.
+        cache.clear()
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_queries_do_not_grow(self):
+        # Количество подписок, авторы страницы, их последние рецепты
+        # и связи пользователя для флагов is_favorited и других.
+        for limit in (1, 3, 10):
+            for recipes_limit in (None, 1, 3, 10):
+                params = {'limit': limit}
+                if recipes_limit is not None:
+                    params['recipes_limit'] = recipes_limit
+                with self.subTest(**params):
+                    with self.assertNumQueries(4):
+                        authors = self.get(**params)
+                    self.assertEqual(len(authors), limit)
+                    for author in authors:
+                        self.assertEqual(len(author['recipes']),
+                                         min(author['recipes_count'],
+                                             recipes_limit or 4))
+
+
+class ResponseCacheTests(TestCase):
+    """
+    ETag и кэш ответов с абсолютными ссылками на изображения
+    различаются для схем и хостов запроса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.local',
+            first_name='Author', last_name='Author', password='password')
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/test.png', author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_scheme_and_host(self):
+        responses = {}
+        for host, secure in (('localhost', False), ('localhost', True),
+                             ('127.0.0.1', False), ('localhost', False)):
+            client = APIClient(SERVER_NAME=host)
+            response = client.get(RECIPES_URL, secure=secure)
+            self.assertEqual(response.status_code, 200)
+            image = response.data['results'][0]['image']
+            scheme = 'https' if secure else 'http'
+            self.assertTrue(image.startswith(f'{scheme}://{host}/'), image)
+            responses.setdefault((host, secure), set()).add(response['ETag'])
+        self.assertEqual(len(responses[('localhost', False)]), 1)
+        etags = set.union(*responses.values())
+        self.assertEqual(len(etags), 3)
+
+
+class ProfilingTests(TestCase):
+    """
+    Профилирование учитывает время сериализаторов проекта, не изменяя
+    классы DRF.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.local',
+            first_name='Author', last_name='Author', password='password')
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/test.png', author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_serializer_timing(self):
+        data, is_valid = BaseSerializer.data, BaseSerializer.is_valid
+        with self.settings(PROFILING_ENABLED=True):
+            # Промежуточные слои загружаются при первом запросе клиента.
+            client = APIClient(SERVER_NAME='localhost')
+            with self.assertLogs('core.profiling'):
+                response = client.get(RECIPES_URL)
+        self.assertEqual(response.status_code, 200)
+        timings = dict(metric.split(';dur=')
+                       for metric in response['Server-Timing'].split(', ')
+                       if ';dur=' in metric)
+        self.assertGreater(float(timings['serializer']), 0)
+        self.assertIs(BaseSerializer.data, data)
+        self.assertIs(BaseSerializer.is_valid, is_valid)
+
+    def test_many(self):
+        serializer = TagSerializer(Tag.objects.all(), many=True)
+        self.assertIsInstance(serializer, ProfiledListSerializer)
+        self.assertEqual(serializer.data, [])
+
+
+class RecipeRowsTests(TestCase):
+    """
+    Словари рецептов RecipeRowIterable и их сериализация
+    RecipeRowSerializer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@foodgram.local',
+            first_name='User', last_name='User', password='password')
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.local',
+            first_name='Автор', last_name='Автор', password='password')
+        cls.tags = [Tag.objects.create(name=name, color=color, slug=slug)
+                    for name, color, slug in (('Ужин', '#0000FF', 'dinner'),
+                                              ('Завтрак', '#FF0000',
+                                               'breakfast'))]
+        ingredients = list(Ingredient.objects.order_by('-pk')[:3])
+        cls.recipes = []
+        # Названия и картинки с символами, которые по-разному
+        # экранируются и кодируются, картинки без копий и без файла.
+        for name, image, image_variants, tags, amounts in (
+            ('Рецепт "0" 🍲', 'recipes/картинка 1.png',
+             {'thumbnail': {'jpeg': 'recipes/variants/0.jpeg',
+                            'webp': 'recipes/variants/0.webp'}},
+             cls.tags, (5, 1, 32767)),
+            ('</script> a\\b\tи\nперевод строки', 'recipes/a&b?c#d.jpeg',
+             {'thumbnail': {}}, cls.tags[:1], (2,)),
+            ('é' * 200, '', {}, [], ()),
+        ):
+            recipe = Recipe.objects.create(
+                name=name, text='Описание\n', cooking_time=10,
+                image=image, image_variants=image_variants, author=author)
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=amount)
+                for ingredient, amount in zip(ingredients, amounts)
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        Purchase.objects.create(user=cls.user, recipe=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rows(self):
+        with self.assertNumQueries(3):
+            rows = {row['id']: row for row in services.get_recipe_rows()}
+        full, single, empty = (rows[recipe.pk] for recipe in self.recipes)
+        # Теги в порядке Tag.Meta.ordering, ингредиенты в порядке
+        # добавления.
+        self.assertEqual([tag['slug'] for tag in full['tags']],
+                         ['breakfast', 'dinner'])
+        self.assertEqual([item['amount'] for item in full['ingredients']],
+                         [5, 1, 32767])
+        self.assertEqual(len(single['tags']), 1)
+        self.assertEqual(len(single['ingredients']), 1)
+        self.assertEqual((empty['tags'], empty['ingredients']), ([], []))
+
+    def test_rows_queries_do_not_grow(self):
+        with self.assertNumQueries(3):
+            list(services.get_recipe_rows()[:1])
+        with self.assertNumQueries(0):
+            list(services.get_recipe_rows().none())
+
+    def test_serializers_match(self):
+        factory = APIRequestFactory()
+        requests = [None]
+        for user, secure, host in ((AnonymousUser(), False, 'localhost'),
+                                   (self.user, False, 'localhost:8080'),
+                                   (self.user, True, '127.0.0.1')):
+            request = factory.get(RECIPES_URL, secure=secure, HTTP_HOST=host)
+            request.user = user
+            requests.append(request)
+        instances = list(services.get_recipes())
+        rows = list(services.get_recipe_rows())
+        for request in requests:
+            context = {'request': request}
+            with self.subTest(user=getattr(request, 'user', None),
+                              secure=request and request.is_secure()):
+                for expected, actual in (
+                    (RecipeSerializer(instances, many=True,
+                                      context=context),
+                     RecipeRowSerializer(rows, many=True, context=context)),
+                    (RecipeSerializer(instances[0], context=context),
+                     RecipeRowSerializer(rows[0], context=context)),
+                ):
+                    self.assertEqual(JSONRenderer().render(actual.data),
+                                     JSONRenderer().render(expected.data))
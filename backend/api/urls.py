@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import (FavoriteView, IngredientViewSet, PurchaseView,
-                    RecipeViewSet, ShoppingCartView, SubscribeView,
+from .views import (FavoriteBulkView, FavoriteView, IngredientViewSet,
+                    PurchaseBulkView, PurchaseView, RecipeViewSet,
+                    ShoppingCartView, SubscribeBulkView, SubscribeView,
                     SubscriptionsViewSet, TagViewSet)
 
 router = routers.DefaultRouter()
@@ -17,7 +18,10 @@ router.register('users/subscriptions',
 urlpatterns = [
     path('recipes/<int:recipe_id>/favorite/', FavoriteView.as_view()),
     path('recipes/<int:recipe_id>/shopping_cart/', PurchaseView.as_view()),
+    path('recipes/favorite/', FavoriteBulkView.as_view()),
+    path('recipes/shopping_cart/', PurchaseBulkView.as_view()),
     path('recipes/download_shopping_cart/', ShoppingCartView.as_view()),
     path('users/<int:author_id>/subscribe/', SubscribeView.as_view()),
+    path('users/subscribe/', SubscribeBulkView.as_view()),
     path('', include(router.urls)),
 ]
@@ -1,9 +1,20 @@
+from core.async_views import AsyncReadMixin
+from core.caching import VersionedCacheMixin
+from core.pagination import FeedPagination
+from core.relations import relations_version
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
+from recipes import exporters
 from recipes import services as recipe_services
+from recipes.ingredient_index import get_ingredient_index
 from recipes.models import Ingredient, Tag
+from recipes.scores import ORDERINGS, SCORE_ORDERING
 from rest_framework import mixins, status, views, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
@@ -11,18 +22,22 @@ from users import services as user_services
 
 from .filters import IngredientFilter, RecipeFilter
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          PurchaseSerializer, RecipeSerializer,
+from .serializers import (BulkIdsSerializer, FavoriteSerializer,
+                          IngredientSerializer, PurchaseSerializer,
+                          RecipeRowSerializer, RecipeSerializer,
                           ShortRecipeSerializer, SubscribeSerializer,
                           SubscriptionSerializer, TagSerializer)
 
 User = get_user_model()
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, AsyncReadMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """
     Ингредиенты.
     """
+    cache_versions = ('ingredient',)
+    read_from_replicas = True
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
@@ -30,32 +45,93 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    @action(['get'], detail=False)
+    def autocomplete(self, request):
+        """
+        Подсказки ингредиентов по параметру name из индекса в памяти.
+        Параметр limit ограничивается диапазоном от 1
+        до INGREDIENT_AUTOCOMPLETE_MAX_LIMIT.
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit')),
+                               settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT))
+        except (TypeError, ValueError):
+            limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        ingredients = get_ingredient_index().search(
+            request.query_params.get('name', ''), limit)
+        response = Response(ingredients)
+        patch_cache_control(response,
+                            public=True,
+                            max_age=settings.INGREDIENT_AUTOCOMPLETE_MAX_AGE)
+        return response
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(VersionedCacheMixin, AsyncReadMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """
     Теги.
     """
+    cache_versions = ('tag',)
+    read_from_replicas = True
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(VersionedCacheMixin, AsyncReadMixin,
+                    viewsets.ModelViewSet):
     """
     Рецепты.
+    list и retrieve читают словари рецептов и сериализуются
+    row_serializer_class, если он задан.
+    Параметр ordering=popular|trending сортирует ленту по рейтингам
+    рецептов (recipes.scores) вместо даты публикации.
     """
     serializer_class = RecipeSerializer
+    row_serializer_class = RecipeRowSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     http_method_names = ['get', 'post', 'patch', 'delete']
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    pagination_class = FeedPagination
+    cache_versions = ('tag', 'ingredient', 'user')
+    cache_per_user = True
+    read_from_replicas = True
+
+    @property
+    def cursor_ordering(self):
+        if self.request.query_params.get('ordering') in ORDERINGS:
+            return SCORE_ORDERING
+        return ('-published_at', '-id')
+
+    def get_cache_versions(self):
+        versions = super().get_cache_versions()
+        pk = self.kwargs.get('pk')
+        versions.append('recipe' if pk is None else f'recipe:{pk}')
+        if self.request.user.is_authenticated:
+            versions.append(relations_version(self.request.user.pk))
+        return versions
 
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        recipe_services.delete_recipe(instance)
+
+    def use_rows(self):
+        return (self.row_serializer_class is not None
+                and self.action in ('list', 'retrieve'))
+
+    def get_serializer_class(self):
+        if self.use_rows():
+            return self.row_serializer_class
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        return recipe_services.get_recipes_with_annotations(self.request.user)
+        if self.use_rows():
+            return recipe_services.get_recipe_rows()
+        return recipe_services.get_recipes()
 
 
 class FavoriteView(views.APIView):
@@ -104,23 +180,29 @@ class SubscribeView(views.APIView):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        author = (recipe_services.get_author_with_annotations(
-            author_id=author_id, user=request.user))
+        author = recipe_services.get_author_with_annotations(
+            author_id=author_id,
+            recipes_limit=request.query_params.get('recipes_limit'))
         serializer = SubscriptionSerializer(author,
                                             context={'request': request})
         return Response(serializer.data, status.HTTP_201_CREATED)
 
 
-class SubscriptionsViewSet(mixins.ListModelMixin,
+class SubscriptionsViewSet(AsyncReadMixin,
+                           mixins.ListModelMixin,
                            viewsets.GenericViewSet):
     """
     Список подписок на автора.
     """
     serializer_class = SubscriptionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
+    cursor_ordering = ('username', 'id')
 
     def get_queryset(self):
-        return recipe_services.get_subscribed_authors(self.request.user)
+        return recipe_services.get_subscribed_authors(
+            user=self.request.user,
+            recipes_limit=self.request.query_params.get('recipes_limit'))
 
 
 class PurchaseView(views.APIView):
@@ -150,16 +232,90 @@ class PurchaseView(views.APIView):
                         status.HTTP_201_CREATED)
 
 
+class BulkRelationView(views.APIView):
+    """
+    Пакетное добавление (POST) и удаление (DELETE) связей пользователя
+    с объектами из списка ids в одной транзакции.
+    В ответе - статус каждого id: created, exists, deleted, not_found
+    или forbidden.
+    """
+    permission_classes = [IsAuthenticated]
+    add = None
+    remove = None
+
+    def post(self, request):
+        return self.perform(request, self.add)
+
+    def delete(self, request):
+        return self.perform(request, self.remove)
+
+    @staticmethod
+    def perform(request, service):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = service(request.user, serializer.validated_data['ids'])
+        return Response({'results': [{'id': pk, 'status': result}
+                                     for pk, result in results.items()]})
+
+
+class FavoriteBulkView(BulkRelationView):
+    """
+    Пакетное добавление и удаление избранных рецептов.
+    """
+    add = staticmethod(recipe_services.add_favorites)
+    remove = staticmethod(recipe_services.remove_favorites)
+
+
+class PurchaseBulkView(BulkRelationView):
+    """
+    Пакетное добавление и удаление рецептов в списке покупок.
+    """
+    add = staticmethod(recipe_services.add_purchases)
+    remove = staticmethod(recipe_services.remove_purchases)
+
+
+class SubscribeBulkView(BulkRelationView):
+    """
+    Пакетное добавление и удаление подписок на авторов.
+    """
+    add = staticmethod(user_services.add_subscriptions)
+    remove = staticmethod(user_services.remove_subscriptions)
+
+
 class ShoppingCartView(views.APIView):
     """
     Скачивание файла со списком покупок.
+    Формат файла задается параметром запроса format: txt, csv, json, pdf.
     """
     permission_classes = [IsAuthenticated]
 
+    def perform_content_negotiation(self, request, force=False):
+        # Параметр format выбирает формат файла, а не рендерер DRF.
+        return super().perform_content_negotiation(request, force=True)
+
     @staticmethod
     def get(request):
+        renderer = exporters.get_renderer(request.query_params.get('format'))
+        if renderer is None:
+            return Response(
+                {'format': [f'Допустимые форматы: '
+                            f'{", ".join(exporters.RENDERERS)}.']},
+                status.HTTP_400_BAD_REQUEST
+            )
         shoppinglist = recipe_services.get_shoppinglist(request.user)
-        return HttpResponse(
-            shoppinglist,
-            headers={'Content-Type': 'text/plain'}
-        )
+        filename = f'shopping_list.{renderer.extension}'
+        headers = {
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        }
+        if isinstance(request._request, ASGIRequest):
+            # ASGIHandler перебирает потоковый ответ в цикле событий, где
+            # запросы к базе данных запрещены, а рендеринг (PDF) блокировал
+            # бы другие запросы. Поэтому под ASGI файл формируется целиком
+            # в потоке представления. Строк не больше, чем ингредиентов
+            # в справочнике.
+            return HttpResponse(renderer.render(shoppinglist),
+                                content_type=renderer.content_type,
+                                headers=headers)
+        return StreamingHttpResponse(renderer.render(shoppinglist),
+                                     content_type=renderer.content_type,
+                                     headers=headers)
@@ -0,0 +1,150 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from .relations import get_user_relations
+
+
+class AsyncReadMixin:
+    """
+    Асинхронные list и retrieve для наборов представлений DRF.
+    При ASYNC_READ_VIEWS (по умолчанию под ASGI) as_view возвращает
+    асинхронное представление: GET и HEAD для действий async_actions
+    обрабатываются в цикле событий асинхронными методами ORM
+    (aget, acount, async for), остальные запросы - синхронным
+    представлением DRF в потоке.
+    Связи пользователя загружаются до сериализации, поэтому сериализаторы
+    не обращаются к базе данных и выполняются в цикле событий.
+    Аутентификатор может определить асинхронный метод aauthenticate,
+    иначе authenticate выполняется в потоке.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_READ_VIEWS:
+            return view
+        sync_view = sync_to_async(view)
+        action_map = dict(actions)
+        if 'get' in action_map:
+            action_map.setdefault('head', action_map['get'])
+
+        async def async_view(request, *args, **kwargs):
+            action = action_map.get(request.method.lower())
+            if (request.method not in ('GET', 'HEAD')
+                    or action not in cls.async_actions):
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = action_map
+            for method, handler_action in action_map.items():
+                setattr(self, method, getattr(self, handler_action))
+            return await self.adispatch(request, *args, **kwargs)
+
+        async_view.__name__ = view.__name__
+        async_view.__qualname__ = view.__qualname__
+        async_view.__doc__ = view.__doc__
+        async_view.cls = cls
+        async_view.initkwargs = initkwargs
+        async_view.actions = actions
+        # csrf_exempt оборачивает в синхронную функцию.
+        async_view.csrf_exempt = True
+        return async_view
+
+    async def adispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response,
+                                               *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        (request.accepted_renderer,
+         request.accepted_media_type) = self.perform_content_negotiation(
+            request)
+        (request.version,
+         request.versioning_scheme) = self.determine_version(request,
+                                                             *args, **kwargs)
+        await self.aperform_authentication(request)
+        self.check_permissions(request)
+        self.check_throttles(request)
+
+    @staticmethod
+    async def aperform_authentication(request):
+        for authenticator in request.authenticators:
+            authenticate = getattr(authenticator, 'aauthenticate', None)
+            if authenticate is None:
+                authenticate = sync_to_async(authenticator.authenticate)
+            try:
+                user_auth_tuple = await authenticate(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def afilter_queryset(self, queryset):
+        # Проверка параметров фильтров может обращаться к базе данных
+        # (теги, автор, поисковый индекс), без параметров - нет.
+        if self.request.query_params:
+            return await sync_to_async(self.filter_queryset)(queryset)
+        return self.filter_queryset(queryset)
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        paginate = getattr(self.paginator, 'apaginate_queryset', None)
+        if paginate is None:
+            paginate = sync_to_async(self.paginator.paginate_queryset)
+        return await paginate(queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def aget_serializer(self, *args, **kwargs):
+        context = self.get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated:
+            context['user_relations'] = await sync_to_async(
+                get_user_relations)(user)
+        return self.get_serializer(*args, context=context, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = await self.aget_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        objects = [obj async for obj in queryset]
+        serializer = await self.aget_serializer(objects, many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = await self.aget_serializer(instance)
+        return Response(serializer.data)
@@ -0,0 +1,220 @@
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
+                            RecipeIngredient, Tag)
+from recipes.scores import refresh_scores
+from recipes.search import update_search_documents
+from recipes.services import rebuild_shopping_list, repair_counters
+from recipes.tags import get_tags_mask
+from users.models import Subscription
+
+User = get_user_model()
+
+SAVEPOINT_SQL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+@dataclass
+class Measurement:
+    """
+    Результат замера: время, пиковая память и число SQL запросов.
+    """
+    seconds: float = 0.0
+    peak_memory: int = 0
+    queries: int = 0
+    marks: dict = field(default_factory=dict)
+    started: float = 0.0
+
+    def mark(self, name):
+        """
+        Запоминает время от начала замера до текущего момента.
+        """
+        self.marks[name] = time.perf_counter() - self.started
+
+
+@contextmanager
+def measure(database='default', trace_memory=True):
+    """
+    Контекстный менеджер замера блока кода.
+    """
+    measurement = Measurement()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connections[database]) as queries:
+            measurement.started = time.perf_counter()
+            yield measurement
+            measurement.seconds = time.perf_counter() - measurement.started
+        measurement.queries = count_queries(queries)
+        if trace_memory:
+            measurement.peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+
+def count_queries(queries):
+    """
+    Возвращает число SQL запросов без операций с точками сохранения,
+    которые появляются из-за транзакции бенчмарка.
+    """
+    return sum(not query['sql'].startswith(SAVEPOINT_SQL)
+               for query in queries.captured_queries)
+
+
+class RollbackError(Exception):
+    """
+    Исключение для отката тестовых данных бенчмарка.
+    """
+
+
+@contextmanager
+def rollback(database='default'):
+    """
+    Выполняет блок в транзакции, которая всегда откатывается,
+    поэтому сгенерированные бенчмарком данные не попадают в базу.
+    """
+    try:
+        with transaction.atomic(using=database):
+            yield
+            raise RollbackError
+    except RollbackError:
+        pass
+
+
+def format_bytes(size):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ГБ'
+
+
+def percentile(values, percent):
+    """
+    Возвращает перцентиль выборки (метод ближайшего ранга).
+    """
+    values = sorted(values)
+    index = max(0, round(percent / 100 * len(values)) - 1)
+    return values[index]
+
+
+def summary(seconds):
+    """
+    Возвращает строку с медианой и 95-м перцентилем времени в мс.
+    """
+    return (f'p50 {statistics.median(seconds) * 1000:7.2f} мс, '
+            f'p95 {percentile(seconds, 95) * 1000:7.2f} мс')
+
+
+def create_users(count, prefix='benchmark'):
+    """
+    Создает пользователей для бенчмарка без хеширования паролей.
+    """
+    return User.objects.bulk_create(
+        User(username=f'{prefix}_{number}',
+             email=f'{prefix}_{number}@foodgram.local',
+             first_name='Benchmark',
+             last_name='Benchmark')
+        for number in range(count)
+    )
+
+
+def create_recipes(authors, count, ingredient_ids, ingredients, rnd,
+                   tags=(), tags_count=(1, 1)):
+    """
+    Создает count рецептов случайных авторов, у каждого рецепта
+    ingredients случайных ингредиентов (число или диапазон (min, max))
+    и tags_count (диапазон) случайных тегов из tags.
+    """
+    if isinstance(ingredients, int):
+        ingredients = (ingredients, ingredients)
+    recipe_tags = [rnd.sample(tags, rnd.randint(*tags_count)) if tags else []
+                   for _ in range(count)]
+    recipes = Recipe.objects.bulk_create(
+        Recipe(name=f'Рецепт {number}',
+               author=rnd.choice(authors),
+               image='recipes/benchmark.png',
+               text='Бенчмарк',
+               cooking_time=rnd.randint(1, 120),
+               tags_mask=get_tags_mask(recipe_tags[number]))
+        for number in range(count)
+    )
+    RecipeIngredient.objects.bulk_create(
+        (RecipeIngredient(recipe=recipe,
+                          ingredient_id=ingredient_id,
+                          amount=rnd.randint(1, 500))
+         for recipe in recipes
+         for ingredient_id in rnd.sample(ingredient_ids,
+                                         rnd.randint(*ingredients))),
+        batch_size=1000
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe=recipe, tag=tag)
+         for recipe, chosen in zip(recipes, recipe_tags) for tag in chosen),
+        batch_size=1000
+    )
+    return recipes
+
+
+@dataclass
+class SeedData:
+    """
+    Данные, созданные seed_database.
+    """
+    users: list
+    recipes: list
+    tags: list
+
+
+def seed_database(users, recipes, relations, rnd, ingredients=(3, 12),
+                  prefix='benchmark'):
+    """
+    Заполняет базу данных для бенчмарков: users пользователей,
+    recipes рецептов случайных авторов с ingredients ингредиентами
+    из справочника (загружается миграцией из data/ingredients.json).
+    У каждого пользователя случайное число избранных рецептов и подписок
+    (до relations) и покупок (до relations / 5), у первого пользователя -
+    максимальное. Списки покупок и поисковые документы заполняются.
+    """
+    ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+    tags = Tag.objects.bulk_create(
+        Tag(name=f'{prefix} {number}',
+            color=f'#BE{number:04X}',
+            slug=f'{prefix}-{number}',
+            bit=bit)
+        for number, bit in enumerate(Tag.get_free_bits(3))
+    )
+    user_objs = create_users(users, prefix=prefix)
+    recipe_objs = create_recipes(user_objs, recipes, ingredient_ids,
+                                 ingredients, rnd, tags=tags)
+    favorites, purchases, subscriptions = [], [], []
+    for number, user in enumerate(user_objs):
+        share = 1 if number == 0 else rnd.random()
+        favorites += [Favorite(user=user, recipe=recipe) for recipe in
+                      rnd.sample(recipe_objs, int(relations * share))]
+        purchases += [Purchase(user=user, recipe=recipe) for recipe in
+                      rnd.sample(recipe_objs, int(relations / 5 * share))]
+        authors = [author for author in user_objs if author != user]
+        subscriptions += [
+            Subscription(user=user, author=author) for author in
+            rnd.sample(authors, min(int(relations * share), len(authors)))
+        ]
+    Favorite.objects.bulk_create(favorites, batch_size=1000)
+    Purchase.objects.bulk_create(purchases, batch_size=1000)
+    Subscription.objects.bulk_create(subscriptions, batch_size=1000)
+    for user_id in {purchase.user_id for purchase in purchases}:
+        rebuild_shopping_list(user_id)
+    recipe_ids = [recipe.pk for recipe in recipe_objs]
+    for start in range(0, len(recipe_ids), 500):
+        update_search_documents(recipe_ids[start:start + 500])
+    # bulk_create не отправляет сигналы, изменяющие счетчики и рейтинги.
+    repair_counters()
+    refresh_scores()
+    return SeedData(users=user_objs, recipes=recipe_objs, tags=tags)
@@ -0,0 +1,132 @@
+from django.db import connections
+from django.db.models.constants import OnConflict
+from django.db.models.sql import DeleteQuery
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def delete_rows(queryset):
+    """
+    Удаляет строки queryset одним DELETE. В отличие от QuerySet.delete()
+    строки не загружаются для сигналов и каскадного удаления, поэтому
+    на модель не должны ссылаться внешние ключи.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_returning(queryset, field):
+    """
+    Удаляет строки queryset одним DELETE ... RETURNING, как delete_rows,
+    и возвращает значения колонки field удаленных строк. Строки,
+    которые удалил конкурентный запрос, не возвращаются.
+    """
+    query = queryset.query.clone()
+    query.__class__ = DeleteQuery
+    compiler = query.get_compiler(queryset.db)
+    sql, params = compiler.as_sql()
+    column = compiler.connection.ops.quote_name(
+        queryset.model._meta.get_field(field).column)
+    with compiler.connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {column}', params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_returning(model, objs, field):
+    """
+    Добавляет объекты одним INSERT на пакет, пропуская конфликтующие
+    строки (ON CONFLICT DO NOTHING, INSERT OR IGNORE в SQLite),
+    и возвращает значения колонки field добавленных строк: строки,
+    которые добавил конкурентный запрос, не возвращаются.
+    Как и bulk_create, не отправляет сигналы.
+    """
+    if not objs:
+        return []
+    opts = model._meta
+    fields = [field for field in opts.concrete_fields
+              if field is not opts.pk]
+    returning = [opts.get_field(field)]
+    ops = connections[model.objects.db].ops
+    batch_size = max(ops.bulk_batch_size(fields, objs), 1)
+    values = []
+    for start in range(0, len(objs), batch_size):
+        rows = model.objects._insert(objs[start:start + batch_size],
+                                     fields=fields,
+                                     returning_fields=returning,
+                                     on_conflict=OnConflict.IGNORE)
+        values += [row[0] for row in rows]
+    return values
+
+
+def unique(ids):
+    """
+    Возвращает id без повторов в исходном порядке.
+    """
+    return list(dict.fromkeys(ids))
+
+
+def duplicates(ids):
+    """
+    Возвращает id, которые встречаются в ids больше одного раза,
+    в порядке первого повтора.
+    """
+    seen, repeated = set(), {}
+    for pk in ids:
+        if pk in seen:
+            repeated[pk] = None
+        seen.add(pk)
+    return list(repeated)
+
+
+def existing_ids(queryset, ids):
+    """
+    Возвращает множество id из ids, которые есть в queryset.
+    """
+    return set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+
+
+def add_user_relations(model, user_id, field, ids, allowed_ids):
+    """
+    Создает связи пользователя model (избранное, корзина, подписки)
+    с объектами ids через поле field одним INSERT, пропуская
+    существующие связи. Связь создается только с объектами
+    из allowed_ids.
+    Новыми считаются связи, которые вернул сам INSERT, а не связи,
+    которых не было при предварительной выборке: связь, добавленную
+    конкурентным запросом, вызывающий код не учтет дважды.
+    Возвращает результаты {id: статус} и id объектов новых связей.
+    INSERT не отправляет сигналы: счетчики, кэши и зависимые данные
+    обновляет вызывающий код.
+    """
+    allowed = [pk for pk in ids if pk in allowed_ids]
+    created = set(insert_returning(
+        model,
+        [model(user_id=user_id, **{f'{field}_id': pk}) for pk in allowed],
+        field
+    ))
+    results = {}
+    for pk in ids:
+        if pk not in allowed_ids:
+            results[pk] = NOT_FOUND
+        else:
+            results[pk] = CREATED if pk in created else EXISTS
+    return results, [pk for pk in ids if pk in created]
+
+
+def remove_user_relations(model, user_id, field, ids):
+    """
+    Удаляет связи пользователя model с объектами ids одним DELETE
+    без загрузки объектов и без сигналов.
+    Удаленными считаются связи, которые вернул сам DELETE: связь,
+    удаленную конкурентным запросом, вызывающий код не учтет дважды.
+    Возвращает результаты {id: статус} и id объектов удаленных связей.
+    """
+    if not ids:
+        return {}, []
+    deleted = set(delete_returning(
+        model.objects.filter(user=user_id, **{f'{field}__in': ids}), field))
+    results = {pk: DELETED if pk in deleted else NOT_FOUND for pk in ids}
+    return results, [pk for pk in ids if pk in deleted]
@@ -0,0 +1,232 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .replicas import current_replica
+
+VERSION_KEY = 'version:{name}'
+RESPONSE_KEY = 'response:{etag}'
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def get_versions(*names):
+    """
+    Возвращает текущие метки версий по именам.
+    Метка - случайная строка, поэтому вытесненная из кэша версия
+    не может совпасть с прежней.
+    """
+    keys = [VERSION_KEY.format(name=name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def peek_version(name):
+    """
+    Возвращает метку версии или None, если ее нет в кэше.
+    В отличие от get_versions не создает метку.
+    """
+    return cache.get(VERSION_KEY.format(name=name))
+
+
+def add_version(name):
+    """
+    Создает метку версии и возвращает ее. Если метка уже есть
+    (ее успели создать или изменить), возвращает None.
+    """
+    version = _new_version()
+    if cache.add(VERSION_KEY.format(name=name), version, None):
+        return version
+    return None
+
+
+def bump_versions(*names):
+    """
+    Меняет метки версий сразу и повторно после фиксации транзакции,
+    чтобы ответ, закэшированный до фиксации, не пережил ее.
+    """
+    def bump():
+        cache.set_many({VERSION_KEY.format(name=name): _new_version()
+                        for name in names}, None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+class VersionedCacheMixin:
+    """
+    Условные ответы для list и retrieve по меткам версий моделей.
+    ETag вычисляется без обращения к БД и сериализаторам: по меткам
+    версий, схеме, хосту и пути запроса (в данных ответа абсолютные
+    ссылки на изображения) и, если ответ зависит от пользователя,
+    по id пользователя. На совпадающий If-None-Match отдается 304.
+    Данные ответа кэшируются целиком, если ответ не зависит
+    от пользователя или запрос анонимный.
+    alist и aretrieve - то же для асинхронных представлений
+    (core.async_views.AsyncReadMixin указывается после этого класса).
+    """
+    cache_versions = ()
+    cache_per_user = False
+
+    def get_cache_versions(self):
+        return list(self.cache_versions)
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(super().list, request,
+                                       *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(super().retrieve, request,
+                                       *args, **kwargs)
+
+    def alist(self, request, *args, **kwargs):
+        return self.aversioned_response(super().alist, request,
+                                        *args, **kwargs)
+
+    def aretrieve(self, request, *args, **kwargs):
+        return self.aversioned_response(super().aretrieve, request,
+                                        *args, **kwargs)
+
+    def versioned_response(self, handler, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+        etag = self.get_etag(request)
+        response = self.not_modified_response(request, etag)
+        if response is None:
+            key = self.get_response_cache_key(request, etag)
+            response = self.get_cached_response(key)
+            if response is None:
+                response = handler(request, *args, **kwargs)
+                self.cache_response(key, response)
+        return self.finalize_versioned_response(response, etag)
+
+    async def aversioned_response(self, handler, request, *args, **kwargs):
+        """
+        versioned_response для асинхронных представлений (AsyncReadMixin).
+        Обращения к кэшу короткие и выполняются в цикле событий.
+        """
+        etag = self.get_etag(request)
+        response = self.not_modified_response(request, etag)
+        if response is None:
+            key = self.get_response_cache_key(request, etag)
+            response = self.get_cached_response(key)
+            if response is None:
+                response = await handler(request, *args, **kwargs)
+                self.cache_response(key, response)
+        return self.finalize_versioned_response(response, etag)
+
+    def get_etag(self, request):
+        user_key = request.user.pk if self.cache_per_user else None
+        return make_etag(request.scheme, request.get_host(),
+                         request.get_full_path(), user_key,
+                         *get_versions(*self.get_cache_versions()))
+
+    @staticmethod
+    def not_modified_response(request, etag):
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return None
+
+    def get_response_cache_key(self, request, etag):
+        """
+        Возвращает ключ кэша данных ответа или None, если ответ
+        не кэшируется.
+        """
+        if self.cache_per_user and request.user.is_authenticated:
+            return None
+        return RESPONSE_KEY.format(etag=etag)
+
+    @staticmethod
+    def get_cached_response(key):
+        data = cache.get(key) if key is not None else None
+        if data is None:
+            return None
+        return Response(data)
+
+    @staticmethod
+    def cache_response(key, response):
+        """
+        Кэширует данные ответа. Ответ, прочитанный из реплики, мог
+        не застать изменение, уже отмеченное новой версией, поэтому
+        хранится не дольше DATABASE_REPLICA_RESPONSE_CACHE_TIMEOUT.
+        """
+        if key is None or response.status_code != status.HTTP_200_OK:
+            return
+        timeout = settings.RESPONSE_CACHE_TIMEOUT
+        if current_replica.get() is not None:
+            timeout = min(timeout,
+                          settings.DATABASE_REPLICA_RESPONSE_CACHE_TIMEOUT)
+        cache.set(key, response.data, timeout)
+
+    def finalize_versioned_response(self, response, etag):
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            if self.cache_per_user:
+                patch_vary_headers(response, ['Authorization'])
+        return response
+
+
+class LocalTTLCache:
+    """
+    Кэш в памяти процесса с вытеснением давно не использованных
+    записей (LRU) и временем жизни записей.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,98 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+class CounterFieldsMixin:
+    """
+    Модель с хранимыми счетчиками (counter_fields), которые изменяются
+    только запросами UPDATE с F-выражениями (add_to_counter).
+    save() существующего объекта не записывает счетчики, поэтому
+    устаревшие значения в памяти не затирают изменения других запросов.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+def add_to_counter(model, pk, field, delta):
+    """
+    Атомарно изменяет счетчик field объекта на delta.
+    """
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def move_counter(model, field, old_pk, new_pk):
+    """
+    Переносит единицу счетчика с одного объекта на другой,
+    например при смене автора рецепта.
+    """
+    if old_pk != new_pk:
+        add_to_counter(model, old_pk, field, -1)
+        add_to_counter(model, new_pk, field, 1)
+
+
+def deleted_with(origin, model, pk):
+    """
+    Проверяет, что объект удаляется каскадом вместе с объектом model
+    с первичным ключом pk (origin сигнала post_delete): счетчик
+    удаляемого объекта изменять не нужно.
+    """
+    return isinstance(origin, model) and origin.pk == pk
+
+
+def count_subquery(queryset, field):
+    """
+    Подзапрос количества строк queryset, у которых field ссылается
+    на внешний объект.
+    """
+    return Coalesce(Subquery(queryset
+                             .filter(**{field: OuterRef('pk')})
+                             .order_by()
+                             .values(field)
+                             .annotate(count=Count('pk'))
+                             .values('count')),
+                    0)
+
+
+def set_counts(queryset, field, related, related_field):
+    """
+    Записывает в счетчик field объектов queryset количество строк
+    related, ссылающихся на них через related_field. Используется
+    после пакетных операций, которые не отправляют сигналы.
+    """
+    queryset.update(**{field: count_subquery(related, related_field)})
+
+
+def recount(queryset, field, actual, dry_run=False, batch_size=1000):
+    """
+    Исправляет счетчик field объектов queryset, не совпадающий
+    с выражением actual (например, count_subquery).
+    Возвращает количество исправленных (при dry_run - неверных)
+    объектов. Объекты загружаются и обновляются частями.
+    """
+    rows = (queryset
+            .annotate(actual=actual)
+            .exclude(**{field: F('actual')})
+            .values_list('pk', 'actual')
+            .iterator(chunk_size=batch_size))
+    model, fixed, batch = queryset.model, 0, []
+    for pk, value in rows:
+        fixed += 1
+        if dry_run:
+            continue
+        batch.append(model(pk=pk, **{field: value}))
+        if len(batch) == batch_size:
+            model.objects.bulk_update(batch, [field])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [field])
+    return fixed
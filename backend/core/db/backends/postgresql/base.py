@@ -0,0 +1,74 @@
+from core.db.pool import ConnectionPool, get_pool
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+Database = base.Database
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений процесса.
+    Django "закрывает" соединение в конце запроса (CONN_MAX_AGE = 0),
+    а пул возвращает его следующему запросу любого потока.
+    Настройки пула задаются ключом POOL настроек базы данных:
+    MIN_SIZE, MAX_SIZE, MAX_IDLE (сек.) и TIMEOUT (сек.).
+    При CONN_HEALTH_CHECKS соединение проверяется перед выдачей из пула.
+    """
+
+    def get_pool(self, conn_params):
+        def create_pool():
+            options = self.settings_dict.get('POOL', {})
+            return ConnectionPool(
+                connect=lambda: super(DatabaseWrapper, self)
+                .get_new_connection(conn_params),
+                check=(self.check_pooled_connection
+                       if self.settings_dict['CONN_HEALTH_CHECKS']
+                       else None),
+                reset=self.reset_pooled_connection,
+                min_size=options.get('MIN_SIZE', 0),
+                max_size=options.get('MAX_SIZE', 10),
+                max_idle=options.get('MAX_IDLE', 300),
+                timeout=options.get('TIMEOUT', 30),
+            )
+
+        return get_pool(self.alias, create_pool)
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).getconn()
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            self.get_pool(self.get_connection_params()).putconn(
+                self.connection)
+
+    @staticmethod
+    def check_pooled_connection(connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Database.Error:
+            return False
+        return True
+
+    @staticmethod
+    def reset_pooled_connection(connection):
+        """
+        Откатывает незавершенную транзакцию соединения.
+        Возвращает False, если соединение нельзя использовать повторно.
+        """
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Database.Error:
+                return False
+        return True
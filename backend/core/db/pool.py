@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(Exception):
+    """
+    Свободное соединение не появилось за отведенное время.
+    """
+
+
+class ConnectionPool:
+    """
+    Пул соединений с базой данных, общий для потоков процесса.
+    connect() создает новое соединение, check(connection) проверяет
+    работоспособность, reset(connection) готовит соединение к повторному
+    использованию и возвращает False, если его нужно закрыть.
+    Соединения, простаивающие дольше max_idle секунд, закрываются,
+    пока в пуле больше min_size соединений.
+    """
+
+    def __init__(self, connect, check=None, reset=None, min_size=0,
+                 max_size=10, max_idle=300, timeout=30):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.size = 0
+        self._idle = deque()
+        self._condition = threading.Condition()
+
+    def getconn(self):
+        """
+        Возвращает свободное соединение, при необходимости создает
+        новое. Если пул заполнен, ждет до timeout секунд.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            self._reap()
+            while not self._idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f'Нет свободных соединений ({self.max_size}).')
+                self._condition.wait(remaining)
+            if self._idle:
+                connection = self._idle.pop()[0]
+            else:
+                connection = None
+                self.size += 1
+        if connection is not None and self.check is not None:
+            if not self.check(connection):
+                self._discard(connection)
+                return self.getconn()
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self._condition:
+                    self.size -= 1
+                    self._condition.notify()
+                raise
+        return connection
+
+    def putconn(self, connection):
+        """
+        Возвращает соединение в пул.
+        """
+        if self.reset is not None and not self.reset(connection):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._reap()
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            while self._idle:
+                self._close(self._idle.popleft()[0])
+                self.size -= 1
+            self._condition.notify_all()
+
+    def _discard(self, connection):
+        self._close(connection)
+        with self._condition:
+            self.size -= 1
+            self._condition.notify()
+
+    def _reap(self):
+        # Давно не использованные соединения в начале очереди.
+        expired = time.monotonic() - self.max_idle
+        while (self._idle and self._idle[0][1] < expired
+               and self.size > self.min_size):
+            self._close(self._idle.popleft()[0])
+            self.size -= 1
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, factory):
+    """
+    Возвращает пул соединений процесса для псевдонима базы данных.
+    После fork (воркеры gunicorn) создается новый пул: соединения
+    родительского процесса не используются.
+    """
+    key = (alias, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+
+def close_pools():
+    """
+    Закрывает свободные соединения всех пулов процесса.
+    """
+    with _pools_lock:
+        for (alias, pid), pool in _pools.items():
+            if pid == os.getpid():
+                pool.closeall()
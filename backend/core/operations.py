@@ -0,0 +1,47 @@
+from django.db.migrations.operations.base import Operation
+
+
+class AddPostgreSQLIndex(Operation):
+    """
+    Создает индекс, поддерживаемый только PostgreSQL (GIN, индексы
+    по выражениям с функциями PostgreSQL). В других СУБД ничего
+    не делает.
+    Индекс не попадает в состояние моделей: иначе SQLite пытался бы
+    создать его при пересоздании таблицы.
+    """
+    reduces_to_sql = False
+
+    def __init__(self, model_name, index):
+        self.model_name = model_name
+        self.index = index
+
+    def deconstruct(self):
+        return (self.__class__.__qualname__, [],
+                {'model_name': self.model_name, 'index': self.index})
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if (schema_editor.connection.vendor == 'postgresql'
+                and self.allow_migrate_model(schema_editor.connection.alias,
+                                             model)):
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if (schema_editor.connection.vendor == 'postgresql'
+                and self.allow_migrate_model(schema_editor.connection.alias,
+                                             model)):
+            schema_editor.remove_index(model, self.index)
+
+    def describe(self):
+        return (f'Create PostgreSQL index {self.index.name} '
+                f'on model {self.model_name}')
+
+    @property
+    def migration_name_fragment(self):
+        return f'{self.model_name.lower()}_{self.index.name.lower()}'
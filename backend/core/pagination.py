@@ -1,4 +1,16 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import (EmptyPage, InvalidPage, Page,
+                                   PageNotAnInteger, Paginator)
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -7,3 +19,239 @@ class CustomPageNumberPagination(PageNumberPagination):
     Количество элементов на странице задается через параметр запроса limit.
     """
     page_size_query_param = 'limit'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор с оценкой количества объектов по плану запроса PostgreSQL.
+    Для небольших выборок и других СУБД выполняется точный COUNT.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if (estimate is None
+                or estimate < settings.PAGINATION_ESTIMATE_THRESHOLD):
+            return super().count
+        return estimate
+
+
+def estimate_count(queryset):
+    """
+    Возвращает оценку количества строк queryset из EXPLAIN
+    или None, если оценка недоступна.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return plan[0]['Plan']['Plan Rows']
+
+
+class UncountedPage(Page):
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class UncountedPaginator(Paginator):
+    """
+    Пагинатор без COUNT: наличие следующей страницы определяется
+    выборкой одного лишнего объекта.
+    """
+    count = None
+    num_pages = 1
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы не является целым числом.')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1.')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and number > 1:
+            raise EmptyPage('Страница не содержит результатов.')
+        # Известная нижняя граница количества страниц.
+        self.num_pages = number + (len(objects) > self.per_page)
+        return UncountedPage(objects[:self.per_page], number, self,
+                             has_next=len(objects) > self.per_page)
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация.
+    Сортировка задается атрибутом cursor_ordering представления,
+    последнее поле сортировки должно быть уникальным.
+    В отличие от CursorPagination позиция курсора содержит значения
+    всех полей сортировки, а не только первого: при равных значениях
+    первого поля (время публикации, рейтинг) страница выбирается
+    условием по кортежу полей, а не OFFSET.
+    """
+    page_size_query_param = 'limit'
+    ordering = ('-published_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = self.filter_position(queryset, position)
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = None
+        if len(results) > self.page_size:
+            following = self._get_position_from_instance(results[-1],
+                                                         self.ordering)
+        has_current = position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = has_current, position
+            self.has_previous = following is not None
+            self.previous_position = following
+        else:
+            self.has_next = following is not None
+            self.next_position = following
+            self.has_previous, self.previous_position = has_current, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def filter_position(self, queryset, position):
+        """
+        Оставляет объекты после позиции в порядке сортировки queryset:
+        (a < x) OR (a = x AND b < y) для сортировки ('-a', '-b').
+        Условие записывается как a <= x AND (a < x OR b < y): так оно
+        задает диапазон индекса по первому полю, и просмотр индекса
+        начинается с позиции, а не с начала выборки.
+        """
+        ordering = queryset.query.order_by
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError('Неверное количество значений позиции.')
+            condition = None
+            for field, value in reversed(list(zip(ordering, values))):
+                name = field.lstrip('-')
+                lookup = 'lt' if field.startswith('-') else 'gt'
+                after = Q(**{f'{name}__{lookup}': value})
+                if condition is None:
+                    condition = after
+                else:
+                    condition = (Q(**{f'{name}__{lookup}e': value})
+                                 & (after | condition))
+            return queryset.filter(condition)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_position_from_instance(self, instance, ordering):
+        names = [field.lstrip('-') for field in ordering]
+        if isinstance(instance, dict):
+            values = [instance[name] for name in names]
+        else:
+            values = [getattr(instance, name) for name in names]
+        return json.dumps([str(value) for value in values])
+
+
+class FeedPagination(CustomPageNumberPagination):
+    """
+    Пагинация лент с выбором режима параметрами запроса.
+    pagination=cursor (или параметр cursor) включает курсорную пагинацию:
+    стоимость любой страницы равна стоимости первой.
+    count=exact|estimate|none задает способ подсчета объектов
+    для постраничной пагинации: точный COUNT, оценка по плану запроса
+    или без подсчета (в ответе count равен null).
+    """
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    cursor_pagination_class = CustomCursorPagination
+    count_paginator_classes = {
+        'exact': Paginator,
+        'estimate': EstimatedCountPaginator,
+        'none': UncountedPaginator,
+    }
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset,
+                                                           request,
+                                                           view)
+        count_mode = request.query_params.get(self.count_query_param,
+                                              settings.PAGINATION_COUNT_MODE)
+        self.django_paginator_class = self.count_paginator_classes.get(
+            count_mode, Paginator)
+        if self.django_paginator_class is UncountedPaginator:
+            self.display_page_controls = False
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset для асинхронных представлений.
+        Постраничный режим с точным подсчетом выполняется асинхронными
+        методами ORM, остальные режимы - в потоке.
+        """
+        count_mode = request.query_params.get(self.count_query_param,
+                                              settings.PAGINATION_COUNT_MODE)
+        if (self.is_cursor_mode(request)
+                or self.count_paginator_classes.get(count_mode,
+                                                    Paginator)
+                is not Paginator):
+            return await sync_to_async(self.paginate_queryset)(queryset,
+                                                               request,
+                                                               view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = Paginator(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * page_size
+        objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+        self.page = Page(objects, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return objects
+
+    def is_cursor_mode(self, request):
+        cursor_query_param = self.cursor_pagination_class.cursor_query_param
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or cursor_query_param in request.query_params)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
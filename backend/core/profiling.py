@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import LIST_SERIALIZER_KWARGS, ListSerializer
+
+logger = logging.getLogger(__name__)
+
+# Профиль текущего запроса. Контекст копируется в потоки sync_to_async,
+# поэтому запросы асинхронных представлений тоже попадают в профиль.
+current_profile = ContextVar('current_profile', default=None)
+
+# Кадры ORM Django пропускаются при поиске места вызова запроса.
+ORM_DIR = os.path.join('django', 'db', '')
+
+_installed = False
+
+
+@dataclass
+class Profile:
+    """
+    Профиль запроса: число SQL запросов, время в базе данных,
+    в сериализаторах и в представлении, повторяющиеся запросы.
+    """
+    started: float = field(default_factory=time.perf_counter)
+    view_started: float = None
+    queries: int = 0
+    db_seconds: float = 0.0
+    serializer_seconds: float = 0.0
+    serializer_depth: int = 0
+    statements: Counter = field(default_factory=Counter)
+    call_sites: dict = field(default_factory=dict)
+
+    def add_query(self, sql, seconds):
+        """
+        Учитывает запрос. Место вызова запоминается, когда один и тот же
+        SQL (с разными параметрами) выполняется
+        PROFILING_DUPLICATE_THRESHOLD раз: стек разбирается только
+        для повторяющихся запросов.
+        """
+        self.queries += 1
+        self.db_seconds += seconds
+        self.statements[sql] += 1
+        if self.statements[sql] == settings.PROFILING_DUPLICATE_THRESHOLD:
+            self.call_sites[sql] = get_call_site()
+
+    def get_duplicates(self):
+        return [
+            {'sql': sql,
+             'count': self.statements[sql],
+             'call_site': call_site}
+            for sql, call_site in self.call_sites.items()
+        ]
+
+
+def get_call_site():
+    """
+    Возвращает место вызова запроса "путь:строка в функция": первый кадр
+    стека из кода проекта или, если запрос выполняет код библиотеки
+    (например, поле DRF), первый кадр вне ORM Django.
+    """
+    project_dir = f'{settings.BASE_DIR}/'
+    entry_point = f'{project_dir}manage.py'
+    library_site = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        skipped = filename == __file__ or ORM_DIR in filename
+        if (not skipped and filename.startswith(project_dir)
+                and filename != entry_point):
+            return format_frame(frame)
+        if not skipped and library_site is None:
+            library_site = frame
+        frame = frame.f_back
+    return library_site and format_frame(library_site)
+
+
+def format_frame(frame):
+    """
+    Возвращает "путь:строка в функция" с путем относительно каталога
+    sys.path (проекта или site-packages).
+    """
+    filename = frame.f_code.co_filename
+    prefixes = [path for path in sys.path
+                if path and filename.startswith(os.path.join(path, ''))]
+    if prefixes:
+        filename = os.path.relpath(filename, max(prefixes, key=len))
+    return f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def profile_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def add_query_wrapper(sender=None, connection=None, **kwargs):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+@contextmanager
+def profile_serializer():
+    """
+    Добавляет время блока ко времени сериализаторов профиля текущего
+    запроса. Вложенные блоки (например, .data сериализатора внутри
+    SerializerMethodField) не учитываются повторно.
+    """
+    profile = current_profile.get()
+    if profile is None or profile.serializer_depth:
+        yield
+        return
+    profile.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializer_seconds += time.perf_counter() - started
+        profile.serializer_depth -= 1
+
+
+class ProfiledSerializerMixin:
+    """
+    Учитывает время is_valid и data сериализатора в профиле запроса
+    ProfilingMiddleware. Списки (many=True) создаются как
+    ProfiledListSerializer. Вне профилируемых запросов ничего не делает.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        # Как BaseSerializer.many_init, но с ProfiledListSerializer.
+        list_kwargs = {key: kwargs.pop(key)
+                       for key in ('allow_empty', 'max_length', 'min_length')
+                       if key in kwargs}
+        list_kwargs['child'] = cls(*args, **kwargs)
+        list_kwargs.update({key: value for key, value in kwargs.items()
+                            if key in LIST_SERIALIZER_KWARGS})
+        return ProfiledListSerializer(*args, **list_kwargs)
+
+    def is_valid(self, *args, **kwargs):
+        with profile_serializer():
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with profile_serializer():
+            return super().data
+
+
+class ProfiledListSerializer(ProfiledSerializerMixin, ListSerializer):
+    pass
+
+
+def install():
+    """
+    Подключает учет SQL запросов ко всем соединениям с базой данных.
+    Вызывается один раз при включенном профилировании.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(add_query_wrapper,
+                               dispatch_uid='core.profiling')
+    for connection in connections.all(initialized_only=True):
+        add_query_wrapper(connection=connection)
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов при PROFILING_ENABLED: число SQL запросов,
+    время в базе данных, в сериализаторах проекта
+    (ProfiledSerializerMixin), в представлении и общее время
+    передаются в заголовке Server-Timing и записываются строкой JSON
+    в журнал core.profiling. Повторяющиеся запросы (N+1) записываются
+    с местом вызова, уровень записи при этом - WARNING.
+    Без PROFILING_ENABLED Django исключает промежуточный слой
+    (MiddlewareNotUsed), поэтому накладных расходов нет.
+    Слой ставится первым в MIDDLEWARE, чтобы общее время включало
+    остальные промежуточные слои.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, profile):
+        finished = time.perf_counter()
+        view_seconds = (finished - profile.view_started
+                        if profile.view_started is not None else 0.0)
+        duplicates = profile.get_duplicates()
+        timings = {
+            'db': profile.db_seconds,
+            'serializer': profile.serializer_seconds,
+            'view': view_seconds,
+            'total': finished - profile.started,
+        }
+        metrics = [f'{name};dur={milliseconds(seconds)}'
+                   for name, seconds in timings.items()]
+        metrics[0] += f';desc="{profile.queries} queries"'
+        if duplicates:
+            metrics.append(f'n-plus-one;desc="{len(duplicates)} statements"')
+        response['Server-Timing'] = ', '.join(metrics)
+        logger.log(
+            logging.WARNING if duplicates else logging.INFO,
+            json.dumps({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'queries': profile.queries,
+                **{f'{name}_ms': milliseconds(seconds)
+                   for name, seconds in timings.items()},
+                'duplicates': duplicates,
+            }, ensure_ascii=False)
+        )
+        return response
@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+
+from core.caching import bump_versions
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import IntegerField, Value
+from recipes.models import Favorite, Purchase
+from users.models import Subscription
+
+CACHE_KEY = 'user-relations:{user_id}'
+
+FAVORITES, PURCHASES, SUBSCRIPTIONS = range(3)
+
+
+@dataclass(frozen=True)
+class UserRelations:
+    """
+    Множества id избранных рецептов, рецептов в корзине
+    и авторов, на которых подписан пользователь.
+    """
+    favorites: frozenset = frozenset()
+    purchases: frozenset = frozenset()
+    subscriptions: frozenset = frozenset()
+
+
+EMPTY_RELATIONS = UserRelations()
+
+
+def _load_relations(user_id):
+    """
+    Загружает связи пользователя одним запросом.
+    """
+    kind = IntegerField()
+    rows = (Favorite.objects
+            .filter(user=user_id)
+            .values_list(Value(FAVORITES, output_field=kind), 'recipe_id')
+            .union(Purchase.objects
+                   .filter(user=user_id)
+                   .values_list(Value(PURCHASES, output_field=kind),
+                                'recipe_id'),
+                   Subscription.objects
+                   .filter(user=user_id)
+                   .values_list(Value(SUBSCRIPTIONS, output_field=kind),
+                                'author_id'),
+                   all=True))
+    relations = ([], [], [])
+    for relation, obj_id in rows:
+        relations[relation].append(obj_id)
+    return UserRelations(*map(frozenset, relations))
+
+
+def get_user_relations(user):
+    """
+    Возвращает связи пользователя из кэша, при промахе загружает их из БД.
+    """
+    if user is None or user.is_anonymous:
+        return EMPTY_RELATIONS
+    key = CACHE_KEY.format(user_id=user.pk)
+    relations = cache.get(key)
+    if relations is None:
+        relations = _load_relations(user.pk)
+        cache.set(key, relations, settings.USER_RELATIONS_CACHE_TIMEOUT)
+    return relations
+
+
+def invalidate_user_relations(*user_ids):
+    """
+    Сбрасывает кэш связей пользователей сразу и повторно после фиксации
+    транзакции: значение, закэшированное конкурентным запросом до фиксации,
+    не переживет ее.
+    """
+    keys = [CACHE_KEY.format(user_id=user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+    bump_versions(*[relations_version(user_id) for user_id in user_ids])
+
+
+def relations_version(user_id):
+    """
+    Возвращает имя метки версии связей пользователя.
+    """
+    return f'relations:{user_id}'
+
+
+def get_context_relations(context):
+    """
+    Возвращает связи пользователя запроса из контекста сериализатора.
+    Связи запоминаются в контексте, поэтому вложенные сериализаторы
+    и элементы списка обращаются к кэшу один раз за запрос.
+    """
+    relations = context.get('user_relations')
+    if relations is None:
+        request = context.get('request')
+        relations = get_user_relations(getattr(request, 'user', None))
+        context['user_relations'] = relations
+    return relations
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+# Алиас реплики, из которой читает текущий запрос, или None.
+# Контекст копируется в потоки sync_to_async, поэтому асинхронные
+# представления тоже читают из реплики.
+current_replica = ContextVar('current_replica', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'db_primary'
+PIN_KEY = 'replica-pin:{digest}'
+
+
+class ReplicaRouter:
+    """
+    Чтение из реплики, выбранной ReplicaMiddleware для текущего
+    запроса, запись и чтение вне таких запросов - из основной базы.
+    Токены всегда читаются из основной базы: клиент, получивший токен,
+    может не хранить cookie закрепления и сразу обратиться с ним
+    к реплике, которая еще не получила токен.
+    Миграции применяются только к основной базе.
+    """
+    primary_apps = ('authtoken',)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.primary_apps:
+            return DEFAULT_DB_ALIAS
+        return current_replica.get()
+
+    @staticmethod
+    def db_for_write(model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    @staticmethod
+    def allow_migrate(db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def get_pin_key(request):
+    """
+    Возвращает ключ кэша закрепления за основной базой по заголовку
+    Authorization или None для запросов без него.
+    """
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    digest = hashlib.sha1(authorization.encode()).hexdigest()
+    return PIN_KEY.format(digest=digest)
+
+
+def is_pinned(request):
+    """
+    Проверяет, закреплен ли клиент за основной базой.
+    """
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    key = get_pin_key(request)
+    return key is not None and bool(cache.get(key))
+
+
+class ReplicaMiddleware:
+    """
+    Направляет безопасные запросы (GET, HEAD, OPTIONS) к наборам
+    представлений с атрибутом read_from_replicas в случайную реплику
+    из DATABASE_REPLICAS.
+    После небезопасного запроса клиент на DATABASE_REPLICA_PIN_SECONDS
+    закрепляется за основной базой, чтобы видеть свои изменения,
+    пока реплики их догоняют: ставится cookie, а для запросов
+    с заголовком Authorization - ключ в кэше (клиенты API могут
+    не хранить cookie).
+    Без реплик Django исключает промежуточный слой (MiddlewareNotUsed).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = current_replica.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = current_replica.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.finish(request, response)
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if (request.method in SAFE_METHODS
+                and getattr(view_class, 'read_from_replicas', False)
+                and not is_pinned(request)):
+            current_replica.set(random.choice(settings.DATABASE_REPLICAS))
+
+    @staticmethod
+    def finish(request, response):
+        if request.method in SAFE_METHODS:
+            return response
+        seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds,
+                            httponly=True, samesite='Lax')
+        key = get_pin_key(request)
+        if key is not None:
+            cache.set(key, True, seconds)
+        return response
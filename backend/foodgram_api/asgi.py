@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_api.settings')
+# Синхронный код представлений выполняется в разных потоках, поэтому
+# постоянные соединения потоков не переиспользуются и накапливаются.
+# Соединения закрываются в конце запроса или берутся из пула
+# (DB_CONN_POOL=true).
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+# Чтение рецептов, тегов, ингредиентов и подписок - асинхронными
+# представлениями.
+os.environ.setdefault('ASYNC_READ_VIEWS', 'true')
 
 application = get_asgi_application()
@@ -24,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'corsheaders',
     'django_filters',
@@ -36,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,10 +80,115 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        # Время жизни соединения, сек.; 0 - закрывать в конце запроса.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS',
+                                        'true').lower() == 'true',
     }
 }
 
+# Пул соединений процесса для PostgreSQL (WSGI с потоками и ASGI).
+# Соединения возвращаются в пул в конце запроса вместо закрытия.
+if (os.getenv('DB_CONN_POOL', 'false').lower() == 'true'
+        and DATABASES['default']['ENGINE']
+        == 'django.db.backends.postgresql'):
+    DATABASES['default'].update({
+        'ENGINE': 'core.db.backends.postgresql',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 0)),
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'MAX_IDLE': int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        },
+    })
+
+# Реплики только для чтения: через запятую host[:port] для PostgreSQL
+# или пути к файлам для SQLite. Алиасы реплик - replica1, replica2, ...
+# Безопасные запросы к наборам представлений с read_from_replicas
+# читают из реплик (core.replicas).
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**DATABASES['default'],
+                        'TEST': {'MIRROR': 'default'}}
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        host, _, port = replica.strip().partition(':')
+        DATABASES[alias].update(HOST=host,
+                                PORT=port or DATABASES['default']['PORT'])
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# Время, на которое клиент после изменения данных читает из основной
+# базы, сек. Должно превышать отставание реплик.
+DATABASE_REPLICA_PIN_SECONDS = int(
+    os.getenv('DB_REPLICA_PIN_SECONDS', 10)
+)
+# Время хранения в кэше данных ответов, прочитанных из реплик, сек.
+DATABASE_REPLICA_RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('DB_REPLICA_RESPONSE_CACHE_TIMEOUT', 60)
+)
+
+
+# Cache
+
+# Метки версий кэша (токены, связи пользователей, ETag и данные ответов)
+# сбрасываются только в этом кэше. Кэш в памяти процесса подходит для
+# одного процесса сервера, при нескольких воркерах gunicorn нужен общий
+# кэш (Redis, база данных, файлы), иначе отозванный токен и устаревшие
+# ответы остаются в других процессах; gunicorn.conf.py проверяет это.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+# Время жизни кэша избранного, корзины и подписок пользователя, сек.
+USER_RELATIONS_CACHE_TIMEOUT = int(
+    os.getenv('USER_RELATIONS_CACHE_TIMEOUT', 300)
+)
+
+# Время жизни закэшированных данных ответов тегов, ингредиентов
+# и рецептов, сек. Ответы также сбрасываются при смене версий моделей.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 600))
+
+# Асинхронные list и retrieve рецептов, тегов, ингредиентов и подписок
+# (core.async_views.AsyncReadMixin). По умолчанию включены под ASGI.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
+
+
+# Профилирование запросов (core.profiling.ProfilingMiddleware): заголовок
+# Server-Timing и строка JSON в журнале core.profiling.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+# Число выполнений одного SQL за запрос, после которого он считается N+1.
+PROFILING_DUPLICATE_THRESHOLD = int(
+    os.getenv('PROFILING_DUPLICATE_THRESHOLD', 3)
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -123,6 +231,24 @@ STATICFILES_DIRS = os.path.join(BASE_DIR, 'foodgram_api/static/'),
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Картинки рецептов
+
+# Максимальный размер загружаемой картинки, байт.
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 2 ** 20))
+# Максимальное количество пикселей картинки.
+RECIPE_IMAGE_MAX_PIXELS = int(os.getenv('RECIPE_IMAGE_MAX_PIXELS', 40_000_000))
+# Уменьшенные копии картинок: название и наибольшая сторона, пикс.
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': int(os.getenv('RECIPE_IMAGE_THUMBNAIL_SIZE', 480)),
+}
+# Количество потоков обработки картинок; 0 - обработка без очереди.
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+
+# Рейтинг актуальности рецептов: период полураспада веса добавления
+# в избранное и корзину, час.
+RECIPE_TRENDING_HALF_LIFE = float(os.getenv('RECIPE_TRENDING_HALF_LIFE', 72))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -138,13 +264,24 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'core.pagination.CustomPageNumberPagination',
     'PAGE_SIZE': 6
 }
 
+# Наибольшее количество id в пакетных запросах избранного, корзины
+# и подписок.
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 100))
+
+# Подсчет объектов лент по умолчанию: exact, estimate или none.
+PAGINATION_COUNT_MODE = os.getenv('PAGINATION_COUNT_MODE', 'exact')
+# Оценки меньше порога заменяются точным COUNT.
+PAGINATION_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_ESTIMATE_THRESHOLD', 10000)
+)
+
 
 # Аутентификация
 
@@ -153,3 +290,30 @@ AUTH_USER_MODEL = 'users.User'
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
+
+# Кэш токен -> пользователь в памяти процесса: количество записей
+# и время жизни записи, сек.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
+
+# Подсказки ингредиентов
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = 10
+INGREDIENT_AUTOCOMPLETE_MAX_LIMIT = 50
+# Время кэширования ответа клиентом, сек.
+INGREDIENT_AUTOCOMPLETE_MAX_AGE = int(
+    os.getenv('INGREDIENT_AUTOCOMPLETE_MAX_AGE', 300)
+)
+
+# Поиск рецептов по индексу в памяти (не PostgreSQL): наибольшее
+# количество результатов. На каждый результат в запрос передаются
+# три параметра (SQLite до 3.32 допускает не более 999).
+RECIPE_SEARCH_MAX_RESULTS = 300
+
+# Список покупок
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
@@ -0,0 +1,27 @@
+import os
+
+wsgi_app = os.getenv('GUNICORN_APP', 'foodgram_api.wsgi:application')
+# ASGI: GUNICORN_APP=foodgram_api.asgi:application
+# и GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+# Версии кэша (токены, связи пользователей, ETag и ответы) должны быть
+# общими для процессов: несколько воркеров - только с общим кэшем
+# (CACHE_BACKEND: Redis, база данных, файлы).
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+# Потоки воркера делят пул соединений процесса (DB_CONN_POOL=true).
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+LOCAL_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def on_starting(server):
+    cache_backend = os.getenv('CACHE_BACKEND', LOCAL_CACHE_BACKEND)
+    if server.cfg.workers > 1 and cache_backend == LOCAL_CACHE_BACKEND:
+        raise RuntimeError(
+            f'Воркеров: {server.cfg.workers}, но кэш Django - память '
+            f'процесса ({LOCAL_CACHE_BACKEND}): сброс версий кэша '
+            f'не дойдет до других воркеров. Задайте общий кэш '
+            f'CACHE_BACKEND и CACHE_LOCATION или GUNICORN_WORKERS=1.'
+        )
@@ -1,7 +1,15 @@
+from core.counters import move_counter
 from django.contrib import admin
+from django.contrib.auth import get_user_model
 
+from . import services
+from .images import schedule_image_variants
 from .models import (Favorite, Ingredient, Purchase, Recipe, RecipeIngredient,
                      Tag)
+from .search import update_search_documents
+from .signals import bump_recipe_versions
+
+User = get_user_model()
 
 
 @admin.register(Ingredient)
@@ -23,7 +31,7 @@ class RecipeIngredientsInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'published_at')
+    list_display = ('name', 'author', 'published_at', 'favorites_count')
     list_filter = ('tags',)
     search_fields = ('author__username', 'name', 'tags__name')
     date_hierarchy = 'published_at'
@@ -37,6 +45,27 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('published_at', )
     inlines = [RecipeIngredientsInline]
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'author' in form.changed_data:
+            move_counter(User, 'recipes_count',
+                         form.initial['author'], obj.author_id)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_documents([form.instance.pk])
+        if 'image' in form.changed_data:
+            schedule_image_variants(form.instance)
+        for user_id in services.get_purchasers(form.instance):
+            services.rebuild_shopping_list(user_id)
+
+    def delete_model(self, request, obj):
+        services.delete_recipe(obj)
+
+    def delete_queryset(self, request, queryset):
+        for recipe in queryset:
+            services.delete_recipe(recipe)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -44,9 +73,32 @@ class FavoriteAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__email')
     fields = ('user', 'recipe')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'recipe' in form.changed_data:
+            move_counter(Recipe, 'favorites_count',
+                         form.initial['recipe'], obj.recipe_id)
+            bump_recipe_versions(form.initial['recipe'], obj.recipe_id)
+
 
 @admin.register(Purchase)
 class PurchaseAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     search_fields = ('user__username', 'user__email')
     fields = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        services.rebuild_shopping_list(obj.user_id)
+        if change and 'user' in form.changed_data:
+            services.rebuild_shopping_list(form.initial['user'])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        services.rebuild_shopping_list(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in user_ids:
+            services.rebuild_shopping_list(user_id)
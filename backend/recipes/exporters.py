@@ -0,0 +1,320 @@
+import base64
+import csv
+import json
+import logging
+import os
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import Recipe, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+# Поля рецепта в записи экспорта.
+RECIPE_EXPORT_FIELDS = ('pk', 'name', 'text', 'cooking_time',
+                        'published_at', 'image', 'author__email')
+
+
+class ShoppingListRenderer:
+    """
+    Базовый рендерер списка покупок.
+    Метод render принимает итератор строк списка покупок (словари с ключами
+    name, measurement_unit, amount) и возвращает генератор фрагментов
+    файла, пригодный для StreamingHttpResponse.
+    """
+    format = None
+    content_type = None
+    extension = None
+
+    def render(self, items):
+        raise NotImplementedError
+
+
+class TextRenderer(ShoppingListRenderer):
+    format = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+    line = '{name} ({measurement_unit}) - {amount}\n'
+
+    def render(self, items):
+        for item in items:
+            yield self.line.format(**item)
+
+
+class _Echo:
+    """
+    Файлоподобный объект, возвращающий записанное значение.
+    Позволяет отдавать строки csv.writer по одной.
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+class CsvRenderer(ShoppingListRenderer):
+    format = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+    header = ('Ингредиент', 'Единица измерения', 'Количество')
+
+    def render(self, items):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(self.header)
+        for item in items:
+            yield writer.writerow((item['name'],
+                                   item['measurement_unit'],
+                                   item['amount']))
+
+
+class JsonRenderer(ShoppingListRenderer):
+    format = 'json'
+    content_type = 'application/json'
+    extension = 'json'
+
+    def render(self, items):
+        separator = '['
+        for item in items:
+            yield separator + json.dumps(
+                {'name': item['name'],
+                 'measurement_unit': item['measurement_unit'],
+                 'amount': item['amount']},
+                ensure_ascii=False
+            )
+            separator = ',\n'
+        yield ']\n' if separator != '[' else '[]\n'
+
+
+class PdfRenderer(ShoppingListRenderer):
+    """
+    Постраничный PDF без внешних сервисов и библиотек.
+    Каждая страница формата A4 рисуется Pillow в монохромное изображение
+    и сразу отдается клиенту, поэтому в памяти находится только одна
+    страница. Шрифт с кириллицей задается настройкой SHOPPING_LIST_PDF_FONT.
+    """
+    format = 'pdf'
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    dpi = 150
+    page_size = (1240, 1754)
+    margin = 90
+    font_size = 28
+    line_spacing = 14
+    title = 'Список покупок'
+
+    def __init__(self):
+        self.font = self._load_font()
+        self.line_height = self.font_size + self.line_spacing
+        self.lines_per_page = ((self.page_size[1] - 2 * self.margin)
+                               // self.line_height) - 2
+
+    def _load_font(self):
+        font_path = getattr(settings, 'SHOPPING_LIST_PDF_FONT', None)
+        try:
+            return ImageFont.truetype(font_path, self.font_size)
+        except (OSError, TypeError, ValueError):
+            logger.warning('Шрифт %s недоступен, используется шрифт '
+                           'Pillow по умолчанию.', font_path)
+            return ImageFont.load_default()
+
+    def _pages(self, items):
+        page, has_pages = [], False
+        for item in items:
+            page.append(TextRenderer.line.format(**item).rstrip())
+            if len(page) == self.lines_per_page:
+                yield page
+                page, has_pages = [], True
+        if page or not has_pages:
+            yield page
+
+    def _draw_page(self, lines, number):
+        image = Image.new('1', self.page_size, 1)
+        draw = ImageDraw.Draw(image)
+        position = self.margin
+        draw.text((self.margin, position),
+                  f'{self.title} - {number}', font=self.font, fill=0)
+        position += 2 * self.line_height
+        for line in lines:
+            draw.text((self.margin, position), line, font=self.font, fill=0)
+            position += self.line_height
+        return zlib.compress(image.tobytes())
+
+    def render(self, items):
+        writer = _PdfWriter()
+        yield writer.header()
+        width, height = (round(size * 72 / self.dpi)
+                         for size in self.page_size)
+        page_ids = []
+        for number, lines in enumerate(self._pages(items), start=1):
+            image_id, content_id, page_id = writer.reserve(3)
+            page_ids.append(page_id)
+            yield writer.stream(
+                image_id,
+                f'/Type /XObject /Subtype /Image /Width {self.page_size[0]} '
+                f'/Height {self.page_size[1]} /ColorSpace /DeviceGray '
+                f'/BitsPerComponent 1 /Filter /FlateDecode',
+                self._draw_page(lines, number)
+            )
+            yield writer.stream(
+                content_id, '',
+                f'q {width} 0 0 {height} 0 0 cm /Im Do Q'.encode()
+            )
+            yield writer.object(
+                page_id,
+                f'<< /Type /Page /Parent {writer.pages_id} 0 R '
+                f'/MediaBox [0 0 {width} {height}] '
+                f'/Resources << /XObject << /Im {image_id} 0 R >> >> '
+                f'/Contents {content_id} 0 R >>'
+            )
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        yield writer.object(
+            writer.pages_id,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'
+        )
+        yield writer.object(
+            writer.catalog_id,
+            f'<< /Type /Catalog /Pages {writer.pages_id} 0 R >>'
+        )
+        yield writer.trailer()
+
+
+class _PdfWriter:
+    """
+    Минимальный последовательный писатель PDF.
+    Запоминает смещения объектов для таблицы xref.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.catalog_id = 1
+        self.pages_id = 2
+        self.last_id = 2
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def reserve(self, count):
+        self.last_id += count
+        return range(self.last_id - count + 1, self.last_id + 1)
+
+    def header(self):
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def object(self, obj_id, body):
+        self.offsets[obj_id] = self.offset
+        return self._emit(f'{obj_id} 0 obj\n{body}\nendobj\n'.encode())
+
+    def stream(self, obj_id, dictionary, data):
+        self.offsets[obj_id] = self.offset
+        return self._emit(
+            f'{obj_id} 0 obj\n<< {dictionary} /Length {len(data)} >>\n'
+            f'stream\n'.encode()
+            + data
+            + b'\nendstream\nendobj\n'
+        )
+
+    def trailer(self):
+        size = self.last_id + 1
+        xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        for obj_id in range(1, size):
+            xref.append(f'{self.offsets[obj_id]:010d} 00000 n \n')
+        xref.append(f'trailer\n<< /Size {size} /Root {self.catalog_id} 0 R '
+                    f'>>\nstartxref\n{self.offset}\n%%EOF\n')
+        return ''.join(xref).encode()
+
+
+RENDERERS = {renderer.format: renderer
+             for renderer in (TextRenderer,
+                              CsvRenderer,
+                              JsonRenderer,
+                              PdfRenderer)}
+
+DEFAULT_FORMAT = TextRenderer.format
+
+
+def get_renderer(export_format=None):
+    """
+    Возвращает рендерер списка покупок для формата или None,
+    если формат не поддерживается.
+    """
+    renderer_class = RENDERERS.get(export_format or DEFAULT_FORMAT)
+    return renderer_class() if renderer_class else None
+
+
+def read_image(name):
+    """
+    Возвращает картинку рецепта для записи экспорта: имя файла
+    и содержимое в base64 или, если файл недоступен, путь.
+    """
+    try:
+        with default_storage.open(name) as file:
+            content = base64.b64encode(file.read()).decode()
+    except OSError:
+        logger.warning('Картинка %s недоступна, экспортируется путь.', name)
+        return {'path': name}
+    return {'name': os.path.basename(name), 'content': content}
+
+
+def recipe_records(recipes, batch_size=500, executor=None):
+    """
+    Возвращает генератор записей экспорта рецептов queryset recipes
+    в порядке id: поля рецепта, email автора, slug тегов, ингредиенты
+    с количеством (название и единица измерения) и картинка.
+    Рецепты загружаются пакетами по batch_size с ингредиентами и тегами
+    пакета, поэтому память не зависит от числа рецептов.
+    Если передан пул потоков executor, картинки пакета читаются в нем
+    и встраиваются в запись в base64, иначе записывается путь картинки.
+    """
+    last_pk = 0
+    while True:
+        rows = list(recipes
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values(*RECIPE_EXPORT_FIELDS)[:batch_size])
+        if not rows:
+            return
+        last_pk = rows[-1]['pk']
+        ids = [row['pk'] for row in rows]
+        ingredients = defaultdict(list)
+        for recipe_id, name, measurement_unit, amount in (
+            RecipeIngredient
+            .objects
+            .filter(recipe__in=ids)
+            .order_by('recipe_id', 'ingredient__name')
+            .values_list('recipe_id', 'ingredient__name',
+                         'ingredient__measurement_unit', 'amount')
+        ):
+            ingredients[recipe_id].append({
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            })
+        tags = defaultdict(list)
+        for recipe_id, slug in (Recipe.tags.through
+                                .objects
+                                .filter(recipe__in=ids)
+                                .order_by('recipe_id', 'tag__slug')
+                                .values_list('recipe_id', 'tag__slug')):
+            tags[recipe_id].append(slug)
+        names = [row['image'] for row in rows]
+        if executor is None:
+            images = [{'path': name} for name in names]
+        else:
+            images = executor.map(read_image, names)
+        for row, image in zip(rows, images):
+            yield {
+                'name': row['name'],
+                'text': row['text'],
+                'cooking_time': row['cooking_time'],
+                'published_at': row['published_at'].isoformat(),
+                'author': row['author__email'],
+                'tags': tags[row['pk']],
+                'ingredients': ingredients[row['pk']],
+                'image': image,
+            }
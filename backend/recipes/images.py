@@ -0,0 +1,166 @@
+import base64
+import binascii
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .signals import bump_recipe_versions
+
+logger = logging.getLogger(__name__)
+
+# Длина фрагмента base64, кратная 4.
+DECODE_CHUNK_SIZE = 64 * 1024
+
+VARIANT_FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True,
+             'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def decode_base64_file(encoded, name, max_size=None):
+    """
+    Декодирует base64 по фрагментам во временный файл, который
+    хранится в памяти до FILE_UPLOAD_MAX_MEMORY_SIZE байт.
+    Декодирование прекращается, как только размер файла превысит
+    max_size байт.
+    """
+    if max_size is None:
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+    file = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    size, tail = 0, ''
+    for start in range(0, len(encoded), DECODE_CHUNK_SIZE):
+        chunk = tail + ''.join(
+            encoded[start:start + DECODE_CHUNK_SIZE].split())
+        end = len(chunk) - len(chunk) % 4
+        decoded = base64.b64decode(chunk[:end], validate=True)
+        size += len(decoded)
+        if size > max_size:
+            file.close()
+            raise ImageTooLargeError(max_size)
+        file.write(decoded)
+        tail = chunk[end:]
+    if tail:
+        file.close()
+        raise binascii.Error('Incorrect padding')
+    file.seek(0)
+    return File(file, name=name)
+
+
+def variant_name(image_name, variant, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'recipes/variants/{stem}_{variant}.{extension}'
+
+
+def render_variant(image, max_side, options):
+    """
+    Возвращает уменьшенную копию изображения в заданном формате.
+    """
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    variant.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def generate_image_variants(recipe_id, image_name):
+    """
+    Создает уменьшенные копии картинки рецепта во всех форматах
+    и сохраняет их имена в Recipe.image_variants, если картинка
+    за это время не сменилась. Прежние копии удаляются.
+    """
+    with default_storage.open(image_name) as file:
+        image = Image.open(file)
+        if image.width * image.height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise ImageTooLargeError(image.width * image.height)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    variants = {}
+    for variant, max_side in settings.RECIPE_IMAGE_VARIANTS.items():
+        variants[variant] = {}
+        for extension, options in VARIANT_FORMATS.items():
+            content = render_variant(image, max_side, options)
+            variants[variant][extension] = default_storage.save(
+                variant_name(image_name, variant, extension),
+                ContentFile(content))
+    old_variants = (Recipe
+                    .objects
+                    .filter(pk=recipe_id)
+                    .values_list('image_variants', flat=True)
+                    .first())
+    updated = (Recipe
+               .objects
+               .filter(pk=recipe_id, image=image_name)
+               .update(image_variants=variants))
+    if not updated:
+        old_variants = variants
+    bump_recipe_versions(recipe_id)
+    for names in (old_variants or {}).values():
+        for name in names.values():
+            default_storage.delete(name)
+
+
+def process_image(recipe_id, image_name):
+    """
+    Создает копии картинки, ошибки записываются в журнал.
+    Возвращает True, если копии созданы.
+    """
+    try:
+        generate_image_variants(recipe_id, image_name)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+        return False
+    return True
+
+
+def process_image_in_worker(recipe_id, image_name):
+    """
+    process_image для фонового потока: соединение потока с базой
+    данных закрывается по завершении.
+    """
+    try:
+        return process_image(recipe_id, image_name)
+    finally:
+        close_old_connections()
+
+
+@functools.cache
+def get_executor():
+    """
+    Возвращает общий для процесса пул потоков обработки картинок.
+    """
+    return ThreadPoolExecutor(max_workers=settings.RECIPE_IMAGE_WORKERS,
+                              thread_name_prefix='recipe-images')
+
+
+def schedule_image_variants(recipe):
+    """
+    Ставит создание копий картинки в очередь после фиксации транзакции.
+    При RECIPE_IMAGE_WORKERS = 0 копии создаются сразу в текущем потоке.
+    """
+    recipe_id, image_name = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.RECIPE_IMAGE_WORKERS:
+            get_executor().submit(process_image_in_worker, recipe_id,
+                                  image_name)
+        else:
+            process_image(recipe_id, image_name)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,493 @@
+import binascii
+import csv
+import json
+import re
+from collections import Counter
+from itertools import islice
+
+from core.caching import bump_versions
+from core.counters import set_counts
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+
+from .images import ImageTooLargeError, decode_base64_file
+from .ingredient_index import invalidate_ingredient_index
+from .models import Ingredient, Recipe, RecipeIngredient, Tag
+from .search import SEARCH_VERSION, make_search_document
+from .tags import update_tags_masks
+
+User = get_user_model()
+
+INSERTED = 'inserted'
+UNCHANGED = 'unchanged'
+CONFLICTING = 'conflicting'
+INVALID = 'invalid'
+IMPORTED = 'imported'
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+# Начало значения JSON: все, кроме пробельных символов и запятых.
+VALUE_START_RE = re.compile(r'[^\s,]')
+
+
+def read_json_objects(file, chunk_size=2 ** 16, max_object_size=2 ** 20):
+    """
+    Читает из текстового файла значения JSON по одному: элементы массива
+    или значения, разделенные пробельными символами (JSON Lines).
+    Файл читается фрагментами chunk_size, поэтому память ограничена
+    размером фрагмента и одного значения (не больше max_object_size).
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    started = in_array = False
+    while True:
+        match = VALUE_START_RE.search(buffer, position)
+        if match is None:
+            if eof:
+                return
+            buffer, position = file.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if match.group() == '[' and not started:
+            started = in_array = True
+            position = match.end()
+            continue
+        if match.group() == ']' and in_array:
+            in_array = False
+            position = match.end()
+            continue
+        try:
+            value, position = decoder.raw_decode(buffer, match.start())
+        except json.JSONDecodeError:
+            if eof or len(buffer) - match.start() > max_object_size:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[match.start():] + chunk, 0
+            continue
+        started = True
+        yield value
+
+
+def read_csv_records(file, fields):
+    """
+    Читает строки CSV как словари с ключами fields. Если первая строка
+    содержит все fields, она считается заголовком, иначе колонки идут
+    в порядке fields.
+    """
+    reader = csv.reader(file)
+    first = next(reader, None)
+    if first is None:
+        return
+    if set(fields) <= set(first):
+        columns = first
+    else:
+        columns = fields
+        yield dict(zip(columns, first))
+    for row in reader:
+        yield dict(zip(columns, row))
+
+
+def normalize(value):
+    """
+    Убирает пробельные символы по краям и повторяющиеся внутри строки.
+    """
+    return ' '.join(value.split()) if isinstance(value, str) else ''
+
+
+def ingredient_key(name, measurement_unit):
+    return name.casefold(), measurement_unit.casefold()
+
+
+def parse_ingredient(record):
+    """
+    Возвращает (название, единица измерения) записи или None,
+    если запись некорректна.
+    """
+    if not isinstance(record, dict):
+        return None
+    name = normalize(record.get('name'))
+    measurement_unit = normalize(record.get('measurement_unit'))
+    fields = Ingredient._meta
+    if (not name or not measurement_unit
+            or len(name) > fields.get_field('name').max_length
+            or len(measurement_unit)
+            > fields.get_field('measurement_unit').max_length):
+        return None
+    return name, measurement_unit
+
+
+def load_ingredients(records, batch_size=1000, dry_run=False, report=None):
+    """
+    Загружает ингредиенты из записей {name, measurement_unit} по ключу
+    (название, единица измерения): новые добавляются пакетами
+    bulk_create по batch_size, существующие пропускаются. Запись,
+    совпадающая с существующим ингредиентом без учета регистра,
+    но записанная иначе, считается конфликтующей и не добавляется:
+    ограничение уникальности ее бы пропустило.
+    Записи читаются потоком, и каждый пакет сравнивается со справочником
+    запросом по названиям пакета, поэтому в памяти только один пакет
+    независимо от размера файла и справочника. С dry_run пакеты
+    добавляются в транзакции, которая откатывается: следующие пакеты
+    сравниваются с ними так же, как при загрузке.
+    report(статус, номер записи, (название, единица) или запись,
+    существующий ингредиент) вызывается для каждой записи.
+    Возвращает количество записей по статусам.
+    Повторная загрузка того же файла ничего не меняет.
+    """
+    if dry_run:
+        with transaction.atomic():
+            try:
+                return load_ingredient_batches(records, batch_size, report)
+            finally:
+                transaction.set_rollback(True)
+    counts = load_ingredient_batches(records, batch_size, report)
+    if counts[INSERTED]:
+        # bulk_create не отправляет сигналы.
+        invalidate_ingredient_index()
+        bump_versions('ingredient')
+    return counts
+
+
+def load_ingredient_batches(records, batch_size, report=None):
+    counts = Counter(dict.fromkeys((INSERTED, UNCHANGED, CONFLICTING,
+                                    INVALID), 0))
+    number = 0
+    for batch in batches(records, batch_size):
+        ingredients = [parse_ingredient(record) for record in batch]
+        known = get_existing_ingredients(filter(None, ingredients))
+        new = []
+        for record, ingredient in zip(batch, ingredients):
+            number += 1
+            status, existing = classify_ingredient(ingredient, known)
+            if status == INSERTED:
+                # Повторы внутри пакета сравниваются с первой записью.
+                known[ingredient_key(*ingredient)] = ingredient
+                new.append(ingredient)
+            counts[status] += 1
+            if report is not None:
+                report(status, number, ingredient or record, existing)
+        insert_ingredients(new)
+    return counts
+
+
+def classify_ingredient(ingredient, known):
+    """
+    Возвращает статус ингредиента и совпадающий с ним ингредиент
+    из known: {ключ: (название, единица)} или None.
+    """
+    if ingredient is None:
+        return INVALID, None
+    existing = known.get(ingredient_key(*ingredient))
+    if existing is None:
+        return INSERTED, None
+    return (UNCHANGED if existing == ingredient else CONFLICTING), existing
+
+
+def get_existing_ingredients(ingredients):
+    """
+    Возвращает {ключ: (название, единица)} ингредиентов справочника
+    с названиями ingredients без учета регистра. Сравнение по UPPER(name)
+    в PostgreSQL использует индекс ingredient_name_upper_idx; точные
+    названия ищутся отдельно, так как UPPER в SQLite меняет регистр
+    только латиницы.
+    """
+    names = {name for name, measurement_unit in ingredients}
+    if not names:
+        return {}
+    rows = (Ingredient
+            .objects
+            .annotate(name_upper=Upper('name'))
+            .filter(Q(name__in=names)
+                    | Q(name_upper__in={name.upper() for name in names}))
+            .order_by()
+            .values_list('name', 'measurement_unit'))
+    return {ingredient_key(*row): row for row in rows}
+
+
+def insert_ingredients(ingredients):
+    if ingredients:
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in ingredients],
+            ignore_conflicts=True
+        )
+
+
+def batches(items, size):
+    """
+    Разбивает итератор на списки не длиннее size.
+    """
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def require(condition, message):
+    if not condition:
+        raise InvalidRecord(message)
+
+
+def parse_recipe_ingredients(items):
+    """
+    Возвращает {(название, единица измерения): количество}.
+    """
+    require(isinstance(items, list) and items, 'нет ингредиентов')
+    amounts = {}
+    for item in items:
+        require(isinstance(item, dict), 'некорректный ингредиент')
+        key = (item.get('name'), item.get('measurement_unit'))
+        amount = item.get('amount')
+        require(isinstance(amount, int) and 1 <= amount <= 32767,
+                f'некорректное количество ингредиента {key}')
+        require(key not in amounts, f'ингредиент {key} повторяется')
+        amounts[key] = amount
+    return amounts
+
+
+def parse_image(image):
+    require(isinstance(image, dict), 'нет картинки')
+    if 'content' in image:
+        require(isinstance(image['content'], str)
+                and isinstance(image.get('name'), str),
+                'некорректная картинка')
+    else:
+        require(isinstance(image.get('path'), str),
+                'некорректная картинка')
+    return image
+
+
+def parse_recipe(record):
+    """
+    Проверяет запись импорта рецепта (формат exporters.recipe_records)
+    и возвращает словарь данных рецепта.
+    """
+    require(isinstance(record, dict), 'запись не является объектом')
+    name, text = record.get('name'), record.get('text')
+    cooking_time = record.get('cooking_time')
+    require(isinstance(name, str) and 0 < len(name) <= 200,
+            'некорректное название')
+    require(isinstance(text, str) and text, 'некорректное описание')
+    require(isinstance(cooking_time, int) and 1 <= cooking_time <= 32767,
+            'некорректное время приготовления')
+    published_at = record.get('published_at')
+    if published_at is not None:
+        published_at = (parse_datetime(published_at)
+                        if isinstance(published_at, str) else None)
+        require(published_at is not None, 'некорректная дата публикации')
+    tags = record.get('tags', [])
+    require(isinstance(tags, list)
+            and all(isinstance(tag, str) for tag in tags),
+            'некорректные теги')
+    return {
+        'name': name,
+        'text': text,
+        'cooking_time': cooking_time,
+        'published_at': published_at,
+        'author': record.get('author'),
+        'tags': set(tags),
+        'ingredients': parse_recipe_ingredients(record.get('ingredients')),
+        'image': parse_image(record.get('image')),
+    }
+
+
+def resolve_references(data, authors, tags, ingredients):
+    """
+    Заменяет в данных рецепта естественные ключи автора (email), тегов
+    (slug) и ингредиентов (название, единица измерения) на id.
+    """
+    require(data['author'] in authors, f'автор {data["author"]} не найден')
+    missing = sorted(data['tags'] - tags.keys())
+    require(not missing, f'теги {missing} не найдены')
+    missing = [key for key in data['ingredients'] if key not in ingredients]
+    require(not missing, f'ингредиенты {missing} не найдены')
+    data['author'] = authors[data['author']]
+    data['search_document'] = make_search_document(
+        data['text'], sorted(name for name, _ in data['ingredients']))
+    data['tags'] = [tags[slug] for slug in data['tags']]
+    data['ingredients'] = {ingredients[key]: amount
+                           for key, amount in data['ingredients'].items()}
+
+
+def store_image(image):
+    """
+    Возвращает имя файла картинки в хранилище: существующий файл
+    по пути или файл, декодированный из base64 и сохраненный в recipes/.
+    Выполняется в пуле потоков.
+    """
+    if 'content' not in image:
+        require(default_storage.exists(image['path']),
+                f'картинка {image["path"]} не найдена')
+        return image['path']
+    try:
+        file = decode_base64_file(image['content'], image['name'])
+        Image.open(file).verify()
+    except (binascii.Error, ImageTooLargeError, OSError, SyntaxError):
+        raise InvalidRecord(f'некорректная картинка {image["name"]}')
+    file.seek(0)
+    with file:
+        return default_storage.save(f'recipes/{image["name"]}', file)
+
+
+def store_image_or_error(image):
+    try:
+        return store_image(image), None
+    except InvalidRecord as error:
+        return None, error
+
+
+def load_references(recipes):
+    """
+    Загружает id авторов и ингредиентов рецептов пакета.
+    """
+    authors = dict(User
+                   .objects
+                   .filter(email__in={data['author'] for _, data in recipes
+                                      if isinstance(data['author'], str)})
+                   .values_list('email', 'pk'))
+    names = {name for _, data in recipes for name, _ in data['ingredients']}
+    ingredients = {
+        (name, measurement_unit): pk
+        for name, measurement_unit, pk in (Ingredient
+                                           .objects
+                                           .filter(name__in=names)
+                                           .values_list('name',
+                                                        'measurement_unit',
+                                                        'pk'))
+    }
+    return authors, ingredients
+
+
+@transaction.atomic
+def create_recipes(recipes):
+    """
+    Создает рецепты пакета с ингредиентами и тегами запросами
+    bulk_create. Поисковые документы составляются из данных записей.
+    bulk_create не отправляет сигналы, поэтому маски тегов и счетчики
+    рецептов авторов обновляются здесь, а рейтинги создает refresh_scores
+    после импорта.
+    Возвращает созданные рецепты.
+    """
+    objects = Recipe.objects.bulk_create(
+        Recipe(name=data['name'], text=data['text'],
+               cooking_time=data['cooking_time'],
+               author_id=data['author'], image=data['image'],
+               search_document=data['search_document'])
+        for data in recipes
+    )
+    # auto_now_add заменяет дату публикации при создании.
+    dated = []
+    for recipe, data in zip(objects, recipes):
+        if data['published_at'] is not None:
+            recipe.published_at = data['published_at']
+            dated.append(recipe)
+    Recipe.objects.bulk_update(dated, ['published_at'])
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                         amount=amount)
+        for recipe, data in zip(objects, recipes)
+        for ingredient_id, amount in data['ingredients'].items()
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag_id=tag_id)
+        for recipe, data in zip(objects, recipes)
+        for tag_id in data['tags']
+    )
+    update_tags_masks([recipe.pk for recipe in objects])
+    set_counts(User.objects.filter(pk__in={data['author']
+                                           for data in recipes}),
+               'recipes_count', Recipe.objects.all(), 'author')
+    return objects
+
+
+def import_batch(batch, tags, executor, report=None):
+    """
+    Импортирует пакет записей [(номер, запись)]: проверяет записи,
+    загружает авторов и ингредиенты пакета двумя запросами, сохраняет
+    картинки в пуле потоков executor и создает рецепты.
+    Возвращает количество записей по статусам и созданные рецепты.
+    """
+    counts = Counter()
+
+    def reject(number, record, error):
+        counts[INVALID] += 1
+        if report is not None:
+            report(INVALID, number, record, error)
+
+    parsed = []
+    for number, record in batch:
+        try:
+            parsed.append((number, parse_recipe(record)))
+        except InvalidRecord as error:
+            reject(number, record, error)
+    recipes = store_images(resolve_batch(parsed, tags, reject), executor,
+                           reject)
+    objects = create_recipes(recipes) if recipes else []
+    counts[IMPORTED] += len(objects)
+    return counts, objects
+
+
+def resolve_batch(parsed, tags, reject):
+    """
+    Заменяет естественные ключи в данных рецептов пакета на id.
+    Возвращает рецепты, для которых найдены все объекты.
+    """
+    authors, ingredients = load_references(parsed)
+    resolved = []
+    for number, data in parsed:
+        try:
+            resolve_references(data, authors, tags, ingredients)
+        except InvalidRecord as error:
+            reject(number, data['name'], error)
+        else:
+            resolved.append((number, data))
+    return resolved
+
+
+def store_images(resolved, executor, reject):
+    """
+    Сохраняет картинки рецептов в пуле потоков executor.
+    Возвращает данные рецептов с сохраненными картинками.
+    """
+    images = executor.map(store_image_or_error,
+                          [data['image'] for _, data in resolved])
+    recipes = []
+    for (number, data), (image, error) in zip(resolved, images):
+        if error is not None:
+            reject(number, data['name'], error)
+        else:
+            data['image'] = image
+            recipes.append(data)
+    return recipes
+
+
+def import_recipes(records, executor, batch_size=500, report=None,
+                   progress=None):
+    """
+    Импортирует рецепты из записей формата exporters.recipe_records
+    пакетами по batch_size, каждый пакет - в отдельной транзакции.
+    Картинки декодируются и сохраняются в пуле потоков executor.
+    Записи читаются потоком, в памяти находится один пакет.
+    report(статус, номер записи, запись или название, ошибка)
+    вызывается для некорректных записей, progress(количество по
+    статусам, созданные рецепты) - после каждого пакета.
+    Возвращает количество записей по статусам.
+    """
+    tags = dict(Tag.objects.values_list('slug', 'pk'))
+    counts = Counter(dict.fromkeys((IMPORTED, INVALID), 0))
+    for batch in batches(enumerate(records, 1), batch_size):
+        batch_counts, objects = import_batch(batch, tags, executor, report)
+        counts.update(batch_counts)
+        if objects:
+            bump_versions('recipe', 'user', SEARCH_VERSION)
+        if progress is not None:
+            progress(counts, objects)
+    return counts
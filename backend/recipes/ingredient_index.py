@@ -0,0 +1,93 @@
+import threading
+from bisect import bisect_left
+
+from core.caching import get_versions
+
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """
+    Отсортированный индекс названий ингредиентов в памяти процесса.
+    Поиск по префиксу выполняется двоичным поиском, затем, если
+    результатов не хватает, добавляются совпадения с началом слова
+    и прочие вхождения подстроки.
+    """
+
+    version = None
+
+    def __init__(self, ingredients):
+        self.ingredients = sorted(
+            ((name.lower(), pk, name, measurement_unit)
+             for pk, name, measurement_unit in ingredients),
+            key=lambda ingredient: (ingredient[0], ingredient[1])
+        )
+        self.keys = [ingredient[0] for ingredient in self.ingredients]
+
+    def __len__(self):
+        return len(self.ingredients)
+
+    def _prefix_matches(self, query):
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + '\uffff', lo=start)
+        return self.ingredients[start:end]
+
+    def search(self, query, limit):
+        """
+        Возвращает не более limit ингредиентов в порядке релевантности:
+        совпадения с началом названия (короткие раньше), с началом
+        слова в названии, затем прочие вхождения query.
+        """
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+        prefix = sorted(self._prefix_matches(query),
+                        key=lambda ingredient: len(ingredient[0]))
+        results = prefix[:limit]
+        if len(results) < limit:
+            words, substrings = [], []
+            for ingredient in self.ingredients:
+                position = ingredient[0].find(query, 1)
+                if position == -1 or ingredient[0].startswith(query):
+                    continue
+                if not ingredient[0][position - 1].isalnum():
+                    words.append(ingredient)
+                else:
+                    substrings.append(ingredient)
+            results += (words + substrings)[:limit - len(results)]
+        return [{'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in results]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """
+    Возвращает индекс ингредиентов, при необходимости строит его.
+    Индекс перестраивается, если версия ингредиентов в общем кэше
+    изменилась, в том числе в другом процессе.
+    """
+    global _index
+    version, = get_versions('ingredient')
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            index = _index
+            if index is None or index.version != version:
+                index = IngredientIndex(Ingredient.objects.values_list(
+                    'pk', 'name', 'measurement_unit').order_by())
+                index.version = version
+                # Индекс, построенный во время изменения ингредиентов,
+                # получит устаревшую версию и будет перестроен.
+                _index = index
+    return index
+
+
+def invalidate_ingredient_index():
+    """
+    Сбрасывает индекс, он будет перестроен при следующем поиске.
+    """
+    global _index
+    _index = None
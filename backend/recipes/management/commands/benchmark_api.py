@@ -0,0 +1,366 @@
+import base64
+import json
+import random
+import statistics
+import tempfile
+from dataclasses import dataclass
+from io import BytesIO
+
+from core.benchmark import (format_bytes, measure, percentile, rollback,
+                            seed_database)
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import URLResolver, get_resolver, resolve
+from PIL import Image
+from recipes.models import Favorite, Ingredient, Purchase, Recipe
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-Password-1'
+DEFAULT_BUDGET = settings.BASE_DIR / 'core' / 'benchmark_budget.json'
+URLCONFS = ('api.urls', 'users.urls')
+
+
+@dataclass
+class Scenario:
+    """
+    Запрос бенчмарка и ожидаемый код ответа.
+    """
+    name: str
+    method: str
+    path: str
+    status: int = 200
+    data: dict = None
+    anonymous: bool = False
+
+
+def image_payload():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def get_api_routes():
+    """
+    Возвращает маршруты api.urls и users.urls в формате
+    ResolverMatch.route, без маршрутов с суффиксом формата.
+    """
+    routes = set()
+    for urlconf in URLCONFS:
+        for resolver in get_resolver().url_patterns:
+            if (isinstance(resolver, URLResolver)
+                    and resolver.urlconf_name == urlconf):
+                routes |= set(walk_routes(resolver.url_patterns,
+                                          str(resolver.pattern)))
+    return routes
+
+
+def walk_routes(patterns, prefix=''):
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from walk_routes(pattern.url_patterns, route)
+        elif '(?P<format>' not in route:
+            yield route
+
+
+def bulk_ids(queryset, field='pk', count=10):
+    """
+    Возвращает тело пакетного запроса с первыми count id.
+    """
+    return {'ids': list(queryset.values_list(field, flat=True)[:count])}
+
+
+def get_scenarios(seed, user):
+    """
+    Возвращает сценарии для всех маршрутов API. Объекты выбираются так,
+    чтобы запросы на изменение завершались успешно.
+    """
+    favorites = Favorite.objects.filter(user=user).values('recipe')
+    purchases = Purchase.objects.filter(user=user).values('recipe')
+    subscriptions = Subscription.objects.filter(user=user).values('author')
+    own_recipe = seed.recipes[0]
+    Recipe.objects.filter(pk=own_recipe.pk).update(author=user)
+    other_recipe = (Recipe
+                    .objects
+                    .exclude(author=user)
+                    .exclude(pk__in=favorites)
+                    .exclude(pk__in=purchases)
+                    .first())
+    favorite = favorites.first()['recipe']
+    purchase = purchases.first()['recipe']
+    subscribed = subscriptions.first()['author']
+    unsubscribed = (seed.users[-1] if seed.users[-1] != user
+                    else seed.users[1])
+    Subscription.objects.filter(user=user, author=unsubscribed).delete()
+    ingredient = Ingredient.objects.order_by('pk').first()
+    query = ingredient.name[:2]
+    authors = User.objects.exclude(pk=user.pk).exclude(pk__in=subscriptions)
+    recipe = {
+        'name': 'Бенчмарк',
+        'text': 'Рецепт для бенчмарка',
+        'cooking_time': 15,
+        'tags': [seed.tags[0].pk],
+        'ingredients': [{'id': pk, 'amount': 100} for pk in
+                        Ingredient.objects.values_list('pk', flat=True)[:8]],
+        'image': image_payload(),
+    }
+    return [
+        Scenario('api-root', 'get', '/api/'),
+        Scenario('ingredients-list', 'get',
+                 f'/api/ingredients/?name={query}', anonymous=True),
+        Scenario('ingredients-detail', 'get',
+                 f'/api/ingredients/{ingredient.pk}/', anonymous=True),
+        Scenario('ingredients-autocomplete', 'get',
+                 f'/api/ingredients/autocomplete/?name={query}',
+                 anonymous=True),
+        Scenario('tags-list', 'get', '/api/tags/', anonymous=True),
+        Scenario('tags-detail', 'get', f'/api/tags/{seed.tags[0].pk}/',
+                 anonymous=True),
+        Scenario('recipes-list-anonymous', 'get', '/api/recipes/',
+                 anonymous=True),
+        Scenario('recipes-list', 'get', '/api/recipes/'),
+        Scenario('recipes-list-page-10', 'get', '/api/recipes/?page=10'),
+        Scenario('recipes-list-cursor', 'get',
+                 '/api/recipes/?pagination=cursor'),
+        Scenario('recipes-list-favorited', 'get',
+                 '/api/recipes/?is_favorited=1'),
+        Scenario('recipes-list-tags', 'get',
+                 f'/api/recipes/?tags={seed.tags[0].slug}'),
+        Scenario('recipes-list-search', 'get',
+                 f'/api/recipes/?search={ingredient.name.split()[0]}'),
+        Scenario('recipes-list-popular', 'get',
+                 '/api/recipes/?ordering=popular'),
+        Scenario('recipes-list-trending-cursor', 'get',
+                 '/api/recipes/?ordering=trending&pagination=cursor'),
+        Scenario('recipes-detail', 'get', f'/api/recipes/{other_recipe.pk}/'),
+        Scenario('recipes-create', 'post', '/api/recipes/', 201, recipe),
+        Scenario('recipes-update', 'patch', f'/api/recipes/{own_recipe.pk}/',
+                 data=recipe),
+        Scenario('recipes-delete', 'delete',
+                 f'/api/recipes/{own_recipe.pk}/', 204),
+        Scenario('favorite-create', 'post',
+                 f'/api/recipes/{other_recipe.pk}/favorite/', 201),
+        Scenario('favorite-delete', 'delete',
+                 f'/api/recipes/{favorite}/favorite/', 204),
+        Scenario('shopping-cart-create', 'post',
+                 f'/api/recipes/{other_recipe.pk}/shopping_cart/', 201),
+        Scenario('shopping-cart-delete', 'delete',
+                 f'/api/recipes/{purchase}/shopping_cart/', 204),
+        Scenario('favorites-bulk-create', 'post', '/api/recipes/favorite/',
+                 data=bulk_ids(Recipe.objects.exclude(pk__in=favorites))),
+        Scenario('favorites-bulk-delete', 'delete', '/api/recipes/favorite/',
+                 data=bulk_ids(favorites, 'recipe')),
+        Scenario('shopping-cart-bulk-create', 'post',
+                 '/api/recipes/shopping_cart/',
+                 data=bulk_ids(Recipe.objects.exclude(pk__in=purchases))),
+        Scenario('shopping-cart-bulk-delete', 'delete',
+                 '/api/recipes/shopping_cart/',
+                 data=bulk_ids(purchases, 'recipe')),
+        Scenario('shopping-cart-download', 'get',
+                 '/api/recipes/download_shopping_cart/'),
+        Scenario('subscribe', 'post',
+                 f'/api/users/{unsubscribed.pk}/subscribe/?recipes_limit=3',
+                 201),
+        Scenario('unsubscribe', 'delete',
+                 f'/api/users/{subscribed}/subscribe/', 204),
+        Scenario('subscribe-bulk', 'post', '/api/users/subscribe/',
+                 data=bulk_ids(authors)),
+        Scenario('unsubscribe-bulk', 'delete', '/api/users/subscribe/',
+                 data=bulk_ids(subscriptions, 'author')),
+        Scenario('subscriptions', 'get', '/api/users/subscriptions/'),
+        *[Scenario(f'subscriptions-recipes-limit-{limit}', 'get',
+                   f'/api/users/subscriptions/?recipes_limit={limit}')
+          for limit in (1, 3, 10)],
+        Scenario('token-login', 'post', '/api/auth/token/login/',
+                 data={'email': user.email, 'password': PASSWORD},
+                 anonymous=True),
+        Scenario('token-logout', 'post', '/api/auth/token/logout/', 204),
+        Scenario('users-list', 'get', '/api/users/'),
+        Scenario('users-create', 'post', '/api/users/', 201,
+                 {'email': 'benchmark-new@foodgram.local',
+                  'username': 'benchmark_new',
+                  'first_name': 'Benchmark',
+                  'last_name': 'Benchmark',
+                  'password': PASSWORD},
+                 anonymous=True),
+        Scenario('users-me', 'get', '/api/users/me/'),
+        Scenario('users-detail', 'get', f'/api/users/{subscribed}/'),
+        Scenario('users-set-password', 'post', '/api/users/set_password/',
+                 204, {'current_password': PASSWORD,
+                       'new_password': PASSWORD + '-new'}),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Измеряет число SQL запросов, время ответа (p50, p95) '
+            'и пиковую память для всех маршрутов API и сравнивает '
+            'их с бюджетом. Тестовые данные создаются в транзакции '
+            'и откатываются; каждый запрос выполняется в точке '
+            'сохранения, которая тоже откатывается. Используется база '
+            'данных из настроек (SQLite или PostgreSQL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--relations', type=int, default=50,
+                            help='Максимальное количество избранных '
+                                 'рецептов и подписок пользователя.')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Количество замеров каждого запроса.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', action='append', metavar='SCENARIO',
+                            help='Выполнить только указанные сценарии.')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Очищать кэш перед каждым запросом.')
+        parser.add_argument('--budget', metavar='PATH',
+                            default=DEFAULT_BUDGET,
+                            help='JSON с бюджетом: для каждого сценария '
+                                 'queries (с пустым кэшем), warm_queries '
+                                 '(с прогретым кэшем), p95_ms '
+                                 'и peak_memory_kb (любые из них). '
+                                 'По умолчанию - core/benchmark_budget.json '
+                                 'с числом запросов для параметров '
+                                 'по умолчанию.')
+        parser.add_argument('--write-budget', metavar='PATH',
+                            help='Записать результаты как бюджет.')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help='Запас времени и памяти для '
+                                 '--write-budget.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 3 or options['relations'] < 5:
+            raise CommandError('Нужно не меньше 3 пользователей '
+                               'и 5 связей.')
+        budget = {}
+        if options['budget']:
+            with open(options['budget'], encoding='utf-8') as file:
+                budget = json.load(file)
+        self.stdout.write(f'База данных: {connection.vendor}')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root,
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'benchmark-api',
+            }},
+        ), rollback():
+            results = self.run(options)
+        failures = self.check_results(results, budget)
+        if options['write_budget']:
+            self.write_budget(results, options)
+        if failures:
+            raise CommandError('\n'.join(failures))
+
+    def run(self, options):
+        rnd = random.Random(options['seed'])
+        seed = seed_database(options['users'], options['recipes'],
+                             options['relations'], rnd)
+        user = seed.users[0]
+        user.set_password(PASSWORD)
+        user.save()
+        token = Token.objects.create(user=user)
+        scenarios = get_scenarios(seed, user)
+        self.check_coverage(scenarios)
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios
+                         if scenario.name in options['only']]
+        results = {}
+        for scenario in scenarios:
+            client = APIClient(SERVER_NAME='localhost')
+            if not scenario.anonymous:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            results[scenario.name] = self.run_scenario(client, scenario,
+                                                       options)
+            self.stdout.write(self.format_result(scenario.name,
+                                                 results[scenario.name]))
+        return results
+
+    @staticmethod
+    def check_coverage(scenarios):
+        covered = {resolve(scenario.path.split('?')[0]).route
+                   for scenario in scenarios}
+        missing = get_api_routes() - covered
+        if missing:
+            raise CommandError('Нет сценариев для маршрутов: '
+                               + ', '.join(sorted(missing)))
+
+    def run_scenario(self, client, scenario, options):
+        # Первый запрос прогревает кэши, последний замеряет запросы
+        # и память с пустым кэшем: иначе ответы и данные, закэшированные
+        # прогревом и предыдущими сценариями, скрывают запросы к базе.
+        self.request(client, scenario, options)
+        seconds = []
+        for _ in range(options['requests']):
+            with measure(trace_memory=False) as warm:
+                self.request(client, scenario, options)
+            seconds.append(warm.seconds)
+        cache.clear()
+        with measure() as measurement:
+            status = self.request(client, scenario, options)
+        return {
+            'status': status,
+            'expected_status': scenario.status,
+            'queries': measurement.queries,
+            'warm_queries': warm.queries,
+            'p50_ms': statistics.median(seconds) * 1000,
+            'p95_ms': percentile(seconds, 95) * 1000,
+            'peak_memory_kb': measurement.peak_memory / 1024,
+        }
+
+    @staticmethod
+    def request(client, scenario, options):
+        if options['cold_cache']:
+            cache.clear()
+        with rollback():
+            response = getattr(client, scenario.method)(
+                scenario.path, scenario.data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response.status_code
+
+    @staticmethod
+    def format_result(name, result):
+        return (f'{name:>30}: {result["status"]}, '
+                f'{result["queries"]:3} запросов '
+                f'({result["warm_queries"]} с кэшем), '
+                f'p50 {result["p50_ms"]:7.2f} мс, '
+                f'p95 {result["p95_ms"]:7.2f} мс, '
+                f'память {format_bytes(result["peak_memory_kb"] * 1024)}')
+
+    @staticmethod
+    def check_results(results, budget):
+        failures = []
+        for name, result in results.items():
+            if result['status'] != result['expected_status']:
+                failures.append(f'{name}: код ответа {result["status"]}, '
+                                f'ожидается {result["expected_status"]}.')
+            for metric, limit in budget.get(name, {}).items():
+                if result[metric] > limit:
+                    failures.append(f'{name}: {metric} {result[metric]:.2f} '
+                                    f'превышает бюджет {limit}.')
+        return failures
+
+    @staticmethod
+    def write_budget(results, options):
+        tolerance = options['tolerance']
+        budget = {
+            name: {
+                'queries': result['queries'],
+                'warm_queries': result['warm_queries'],
+                'p95_ms': round(result['p95_ms'] * tolerance, 1),
+                'peak_memory_kb': round(result['peak_memory_kb']
+                                        * tolerance),
+            }
+            for name, result in results.items()
+        }
+        with open(options['write_budget'], 'w', encoding='utf-8') as file:
+            json.dump(budget, file, indent=2, ensure_ascii=False)
+            file.write('\n')
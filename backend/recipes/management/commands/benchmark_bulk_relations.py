@@ -0,0 +1,93 @@
+import random
+import statistics
+
+from core.benchmark import create_users, measure, rollback, seed_database
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+# Вид связи: маршрут запроса для одного объекта и пакетного запроса.
+KINDS = {
+    'favorites': ('/api/recipes/{}/favorite/', '/api/recipes/favorite/'),
+    'shopping-cart': ('/api/recipes/{}/shopping_cart/',
+                      '/api/recipes/shopping_cart/'),
+    'subscriptions': ('/api/users/{}/subscribe/', '/api/users/subscribe/'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает добавление и удаление списка рецептов в избранном '
+            'и корзине и подписок на список авторов запросами для '
+            'каждого объекта и одним пакетным запросом: число SQL '
+            'запросов и общее время. Тестовые данные создаются '
+            'в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=20,
+                            help='Количество объектов в списке.')
+        parser.add_argument('--requests', type=int, default=5,
+                            help='Количество замеров каждого способа.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        items = options['items']
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark-bulk-relations',
+        }}), rollback():
+            seed = seed_database(users=items, recipes=max(items, 50),
+                                 relations=5,
+                                 rnd=random.Random(options['seed']),
+                                 prefix='benchmark_bulk')
+            client = APIClient(SERVER_NAME='localhost')
+            client.force_authenticate(create_users(
+                1, prefix='benchmark_bulk_user')[0])
+            ids = {
+                'favorites': [recipe.pk for recipe in seed.recipes[:items]],
+                'shopping-cart': [recipe.pk for recipe in
+                                  seed.recipes[:items]],
+                'subscriptions': [user.pk for user in seed.users[:items]],
+            }
+            for kind, (single, bulk) in KINDS.items():
+                for method in ('post', 'delete'):
+                    self.compare(client, kind, method, single, bulk,
+                                 ids[kind], options['requests'])
+
+    def compare(self, client, kind, method, single, bulk, ids, requests):
+        results = {}
+        for name, send in (
+            ('по одному', lambda: [getattr(client, method)(single.format(pk))
+                                   for pk in ids]),
+            ('пакетом', lambda: [getattr(client, method)(
+                bulk, {'ids': ids}, format='json')]),
+        ):
+            results[name] = self.run(client, method, bulk, ids, send,
+                                     requests)
+        action = 'добавление' if method == 'post' else 'удаление'
+        single_seconds = results['по одному'][1]
+        for name, (queries, seconds) in results.items():
+            self.stdout.write(
+                f'{kind:>14} {action:>10} {name:>10}: '
+                f'{queries:4} запросов, {seconds * 1000:8.2f} мс, '
+                f'x{single_seconds / seconds:.1f}')
+
+    @staticmethod
+    def run(client, method, bulk, ids, send, requests):
+        """
+        Возвращает число SQL запросов и медиану времени отправки
+        запросов send. Перед удалением связи создаются пакетным
+        запросом вне замера.
+        """
+        seconds = []
+        for _ in range(requests):
+            with rollback():
+                if method == 'delete':
+                    client.post(bulk, {'ids': ids}, format='json')
+                with measure(trace_memory=False) as measurement:
+                    responses = send()
+                for response in responses:
+                    if response.status_code >= 300:
+                        raise CommandError(f'{response.status_code}: '
+                                           f'{response.data}')
+            seconds.append(measurement.seconds)
+        return measurement.queries, statistics.median(seconds)
@@ -0,0 +1,171 @@
+import json
+import random
+import re
+
+from core.benchmark import rollback, seed_database
+from core.pagination import CustomCursorPagination
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
+                            ShoppingListItem)
+from recipes.scores import order_by_score
+from recipes.tags import filter_by_tags
+
+User = get_user_model()
+
+# Индексы в плане запроса: PostgreSQL (Index Scan, Index Only Scan,
+# Bitmap Index Scan) и SQLite (SEARCH/SCAN ... USING INDEX).
+PLAN_INDEX_RE = {
+    'postgresql': re.compile(r'Index (?:Only )?Scan (?:Backward )?using '
+                             r'(\w+)|Bitmap Index Scan on (\w+)'),
+    'sqlite': re.compile(r'USING (?:COVERING )?INDEX (\w+)'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Проверяет планы (EXPLAIN) частых запросов: ленты рецептов '
+            '(в том числе страницы после курсора), '
+            'фильтров по автору, тегам, избранному и корзине, подзапросов '
+            'Exists, списка покупок, подписок и поиска ингредиентов. Для '
+            'каждого запроса ожидается доступ к таблице по индексу, '
+            'начинающемуся с нужных колонок. В PostgreSQL последовательное '
+            'сканирование отключается (enable_seqscan = off), поэтому '
+            'проверяется, что подходящий индекс есть, независимо от '
+            'объема тестовых данных. Индексы только для PostgreSQL в '
+            'других СУБД не проверяются. Тестовые данные создаются '
+            'в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true',
+                            help='Выводить планы всех запросов.')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_INDEX_RE:
+            raise CommandError(f'СУБД {vendor} не поддерживается.')
+        failures = 0
+        with rollback():
+            seed = seed_database(users=20, recipes=200, relations=10,
+                                 rnd=random.Random(0),
+                                 prefix='benchmark_explain')
+            if vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset, table, expected, postgresql_only in (
+                self.get_scenarios(seed)
+            ):
+                if postgresql_only and vendor != 'postgresql':
+                    self.stdout.write(f'{name:>24}: пропущен '
+                                      f'(только PostgreSQL)')
+                    continue
+                failures += not self.check_plan(name, queryset, table,
+                                                expected, options['plans'])
+        if failures:
+            raise CommandError(f'Запросов без индекса: {failures}.')
+        self.stdout.write(self.style.SUCCESS('Все запросы используют '
+                                             'индексы.'))
+
+    @staticmethod
+    def get_scenarios(seed):
+        """
+        Возвращает запросы: название, queryset, таблица, ожидаемый
+        индекс (имя или начальные колонки) и признак "только PostgreSQL".
+        """
+        user, author = seed.users[0], seed.recipes[0].author
+        favorites = Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+        purchases = Purchase.objects.filter(user=user, recipe=OuterRef('pk'))
+        recipes = 'recipes_recipe'
+        # Страница после курсора с позицией первого рецепта.
+        position = json.dumps(['1.0', str(seed.recipes[0].pk)])
+        return [
+            ('recipes-feed',
+             Recipe.objects.order_by('-published_at', '-id')[:6],
+             recipes, 'recipe_published_idx', False),
+            ('recipes-author',
+             Recipe.objects.filter(author=author)[:6],
+             recipes, 'recipe_author_published_idx', False),
+            ('recipes-tags',
+             filter_by_tags(Recipe.objects.all(), seed.tags[:1])[:6],
+             recipes, 'recipe_published_idx', False),
+            ('recipes-popular',
+             order_by_score(Recipe.objects.all(), 'popular')[:6],
+             'recipes_recipescore', 'recipe_score_popular_idx', False),
+            ('recipes-popular-cursor',
+             CustomCursorPagination().filter_position(
+                 order_by_score(Recipe.objects.all(), 'popular'),
+                 position)[:6],
+             'recipes_recipescore', 'recipe_score_popular_idx', False),
+            ('favorites-exists',
+             Recipe.objects.annotate(is_favorited=Exists(favorites))[:6],
+             'recipes_favorite', ['user_id', 'recipe_id'], False),
+            ('purchases-exists',
+             Recipe.objects.annotate(is_in_cart=Exists(purchases))[:6],
+             'recipes_purchase', ['user_id', 'recipe_id'], False),
+            ('recipes-is-favorited',
+             Recipe.objects.filter(pk__in=Favorite.objects.filter(
+                 user=user).values('recipe')),
+             'recipes_favorite', ['user_id'], False),
+            ('shopping-cart',
+             Purchase.objects.filter(user=user).values('recipe'),
+             'recipes_purchase', ['user_id'], False),
+            ('shopping-list',
+             ShoppingListItem.objects.filter(user=user).values(
+                 'ingredient__name', 'total_amount'),
+             'recipes_shoppinglistitem', ['user_id'], False),
+            ('subscriptions',
+             User.objects.filter(subscribers__user=user).order_by(
+                 'username'),
+             'users_subscription', ['user_id'], False),
+            ('ingredients-prefix',
+             Ingredient.objects.filter(name__istartswith='са'),
+             'recipes_ingredient', 'ingredient_name_upper_idx', True),
+        ]
+
+    def check_plan(self, name, queryset, table, expected, print_plan):
+        plan = queryset.explain()
+        used = {group
+                for match in PLAN_INDEX_RE[connection.vendor].finditer(plan)
+                for group in match.groups() if group}
+        if isinstance(expected, str):
+            acceptable = {expected}
+        else:
+            acceptable = self.get_indexes(table, expected)
+        matched = sorted(used & acceptable)
+        if matched:
+            self.stdout.write(f'{name:>24}: ок, {", ".join(matched)}')
+        else:
+            self.stderr.write(
+                f'{name:>24}: нет индекса {table} '
+                f'{expected if isinstance(expected, str) else expected}, '
+                f'индексы плана: {", ".join(sorted(used)) or "нет"}')
+        if print_plan or not matched:
+            self.stdout.write(plan)
+        return bool(matched)
+
+    @staticmethod
+    def get_indexes(table, columns):
+        """
+        Возвращает имена индексов таблицы (в том числе индексов
+        ограничений уникальности), начинающихся с колонок columns.
+        """
+        with connection.cursor() as cursor:
+            indexes = {
+                name: info['columns'] for name, info in (
+                    connection.introspection.get_constraints(cursor, table)
+                    .items()
+                ) if info['index'] or info['unique']
+            }
+            if connection.vendor == 'sqlite':
+                # Индексы ограничений уникальности SQLite создает сам
+                # (sqlite_autoindex_*), интроспекция Django их не выдает.
+                quoted = connection.ops.quote_name(table)
+                cursor.execute(f'PRAGMA index_list({quoted})')
+                for name in [row[1] for row in cursor.fetchall()]:
+                    cursor.execute(f'PRAGMA index_info('
+                                   f'{connection.ops.quote_name(name)})')
+                    indexes[name] = [row[2] for row in
+                                     sorted(cursor.fetchall())]
+        return {name for name, index_columns in indexes.items()
+                if index_columns[:len(columns)] == columns}
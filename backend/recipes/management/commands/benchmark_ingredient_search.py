@@ -0,0 +1,49 @@
+import random
+import time
+
+from api.views import IngredientViewSet
+from core.benchmark import summary
+from django.core.management.base import BaseCommand, CommandError
+from recipes.ingredient_index import get_ingredient_index
+from recipes.models import Ingredient
+from rest_framework.test import APIRequestFactory
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа поиска ингредиентов по префиксу '
+            '(/api/ingredients/?name=) и подсказок из индекса в памяти '
+            '(/api/ingredients/autocomplete/?name=).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--max-length', type=int, default=3,
+                            help='Максимальная длина запроса.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('В базе данных нет ингредиентов.')
+        rnd = random.Random(options['seed'])
+        queries = [rnd.choice(names)[:rnd.randint(1, options['max_length'])]
+                   for _ in range(options['requests'])]
+        get_ingredient_index()
+        views = (
+            ('name', IngredientViewSet.as_view({'get': 'list'}),
+             '/api/ingredients/'),
+            ('autocomplete',
+             IngredientViewSet.as_view({'get': 'autocomplete'}),
+             '/api/ingredients/autocomplete/'),
+        )
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+        for name, view, path in views:
+            seconds, sizes = [], []
+            for query in queries:
+                request = factory.get(path, {'name': query})
+                started = time.perf_counter()
+                response = view(request).render()
+                seconds.append(time.perf_counter() - started)
+                sizes.append(len(response.content))
+            self.stdout.write(f'{name:>12}: {summary(seconds)}, '
+                              f'средний ответ '
+                              f'{sum(sizes) / len(sizes) / 1024:.1f} КБ')
@@ -0,0 +1,120 @@
+import random
+import time
+
+from api.serializers import RecipeSerializer
+from api.views import RecipeViewSet
+from core.benchmark import create_recipes, create_users, rollback, summary
+from core.relations import invalidate_user_relations
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef, Prefetch
+from recipes.models import Favorite, Ingredient, Purchase, Recipe
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory, force_authenticate
+from users.models import Subscription, User
+from users.serializers import UserSerializer
+
+
+class LegacyUserSerializer(UserSerializer):
+    is_subscribed = serializers.BooleanField(read_only=True, default=False)
+
+
+class LegacyRecipeSerializer(RecipeSerializer):
+    author = LegacyUserSerializer(read_only=True)
+    is_favorited = serializers.BooleanField(read_only=True, default=False)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True,
+                                                   default=False)
+
+
+class LegacyRecipeViewSet(RecipeViewSet):
+    """
+    Прежняя реализация: признаки вычисляются подзапросами Exists.
+    """
+    serializer_class = LegacyRecipeSerializer
+    row_serializer_class = None
+
+    def get_queryset(self):
+        user = self.request.user
+        authors = User.objects.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('pk'))))
+        favorites = Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+        purchases = Purchase.objects.filter(user=user, recipe=OuterRef('pk'))
+        return (Recipe
+                .objects
+                .annotate(is_favorited=Exists(favorites),
+                          is_in_shopping_cart=Exists(purchases))
+                .prefetch_related(Prefetch('author', queryset=authors),
+                                  'ingredients_in_recipe__ingredient',
+                                  'tags'))
+
+
+class SerializerRecipeViewSet(RecipeViewSet):
+    """
+    Кэш связей пользователя, экземпляры моделей и RecipeSerializer.
+    """
+    row_serializer_class = None
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа списка рецептов с подзапросами Exists, '
+            'с кэшем связей пользователя и RecipeSerializer, с кэшем '
+            'и словарями рецептов (RecipeRowSerializer). Тестовые данные '
+            'создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--relations', type=int, default=500,
+                            help='Количество избранных рецептов, покупок '
+                                 'и подписок пользователя.')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы.')
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if len(ingredient_ids) < 10:
+            raise CommandError('Недостаточно ингредиентов в базе данных.')
+        with rollback():
+            user = self.seed(ingredient_ids, **options)
+            for name, viewset in (('Exists', LegacyRecipeViewSet),
+                                  ('кэш', SerializerRecipeViewSet),
+                                  ('словари', RecipeViewSet)):
+                invalidate_user_relations(user.pk)
+                seconds = self.run(user, viewset, options)
+                self.stdout.write(f'{name:>8}: {summary(seconds)}')
+
+    @staticmethod
+    def seed(ingredient_ids, users, recipes, relations, seed, **options):
+        rnd = random.Random(seed)
+        authors = create_users(users, prefix='benchmark_recipe_list')
+        recipe_objs = create_recipes(authors, recipes, ingredient_ids, 8, rnd)
+        user = authors[0]
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe)
+            for recipe in rnd.sample(recipe_objs, relations)
+        )
+        Purchase.objects.bulk_create(
+            Purchase(user=user, recipe=recipe)
+            for recipe in rnd.sample(recipe_objs, relations)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=author)
+            for author in rnd.sample(authors[1:], min(relations, users - 1))
+        )
+        return user
+
+    @staticmethod
+    def run(user, viewset, options):
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+        view = viewset.as_view({'get': 'list'})
+        seconds = []
+        for number in range(options['requests']):
+            page = number % 10 + 1
+            request = factory.get('/api/recipes/',
+                                  {'limit': options['limit'], 'page': page})
+            force_authenticate(request, user=user)
+            started = time.perf_counter()
+            view(request).render()
+            seconds.append(time.perf_counter() - started)
+        return seconds
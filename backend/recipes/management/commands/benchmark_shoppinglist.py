@@ -0,0 +1,96 @@
+import random
+
+from api.views import ShoppingCartView
+from core.benchmark import (create_recipes, create_users, format_bytes,
+                            measure, rollback)
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from recipes import services
+from recipes.exporters import RENDERERS
+from recipes.models import Ingredient, Purchase, RecipeIngredient
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+
+def legacy_shoppinglist(user):
+    """
+    Прежняя реализация: список собирается конкатенацией строк.
+    """
+    recipes = Purchase.objects.filter(user=user).values('recipe')
+    ingredients = (RecipeIngredient
+                   .objects
+                   .filter(recipe__in=recipes)
+                   .values('ingredient_id')
+                   .annotate(name=F('ingredient__name'),
+                             measurement_unit=F(
+                                 'ingredient__measurement_unit'),
+                             amount=Sum('amount')))
+    shopping_list = ''
+    ingredient_line = '{ingredient} ({measurement_unit}) - {amount}\n'
+    for ingredient in ingredients:
+        shopping_list += ingredient_line.format(
+            ingredient=ingredient.get('name'),
+            measurement_unit=ingredient.get('measurement_unit'),
+            amount=ingredient.get('amount')
+        )
+    return HttpResponse(shopping_list,
+                        headers={'Content-Type': 'text/plain'})
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время до первого байта и пиковую память выгрузки '
+            'списка покупок с прежней реализацией. Тестовые данные '
+            'создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=300,
+                            help='Количество рецептов в корзине.')
+        parser.add_argument('--ingredients', type=int, default=15,
+                            help='Количество ингредиентов в рецепте.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if len(ingredient_ids) < options['ingredients']:
+            raise CommandError('Недостаточно ингредиентов в базе данных.')
+        with rollback():
+            user = self.seed(ingredient_ids, **options)
+            self.run(user)
+
+    @staticmethod
+    def seed(ingredient_ids, recipes, ingredients, seed, **options):
+        rnd = random.Random(seed)
+        user = create_users(1, prefix='benchmark_shoppinglist')[0]
+        recipe_objs = create_recipes([user], recipes, ingredient_ids,
+                                     ingredients, rnd)
+        Purchase.objects.bulk_create(
+            Purchase(user=user, recipe=recipe) for recipe in recipe_objs
+        )
+        services.rebuild_shopping_list(user)
+        return user
+
+    def run(self, user):
+        factory = APIRequestFactory()
+        view = ShoppingCartView.as_view()
+        self.report('legacy', lambda: legacy_shoppinglist(user))
+        for export_format in RENDERERS:
+            request = factory.get('/api/recipes/download_shopping_cart/',
+                                  {'format': export_format})
+            force_authenticate(request, user=user)
+            self.report(export_format, lambda: view(request))
+
+    def report(self, name, get_response):
+        with measure() as measurement:
+            response = get_response()
+            size = 0
+            for chunk in response:
+                if not size:
+                    measurement.mark('first_byte')
+                size += len(chunk)
+        self.stdout.write(
+            f'{name:>8}: первый байт '
+            f'{measurement.marks.get("first_byte", 0) * 1000:8.1f} мс, '
+            f'всего {measurement.seconds * 1000:8.1f} мс, '
+            f'пик памяти {format_bytes(measurement.peak_memory):>10}, '
+            f'размер {format_bytes(size):>10}'
+        )
@@ -0,0 +1,97 @@
+import random
+import time
+
+from core.benchmark import create_recipes, create_users, rollback, summary
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.tags import filter_by_tags
+
+
+def filter_by_slugs(queryset, tags):
+    """
+    Прежний фильтр RecipeFilter.tags: соединение с таблицей связей
+    и таблицей тегов по tags__slug и DISTINCT.
+    """
+    return queryset.filter(
+        tags__slug__in=[tag.slug for tag in tags]).distinct()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает фильтр рецептов по тегам через соединение '
+            'с тегами (tags__slug и DISTINCT) с проверкой маски тегов '
+            'рецепта (Recipe.tags_mask): время первой страницы ленты '
+            'и подсчета рецептов для одного и нескольких тегов. '
+            'Результаты фильтров сравниваются. Тестовые данные '
+            'создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=50000)
+        parser.add_argument('--tags', type=int, default=8,
+                            help='Количество тегов.')
+        parser.add_argument('--max-recipe-tags', type=int, default=3,
+                            help='Наибольшее количество тегов рецепта.')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы.')
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Нет ингредиентов в базе данных.')
+        failures = 0
+        with rollback():
+            tags = self.seed(ingredient_ids, **options)
+            for name, selected in (('один тег', tags[:1]),
+                                   ('два тега', tags[:2]),
+                                   ('половина тегов',
+                                    tags[:len(tags) // 2])):
+                failures += not self.compare(name, selected, options)
+        if failures:
+            raise CommandError(f'Фильтров с разными результатами: '
+                               f'{failures}.')
+
+    @staticmethod
+    def seed(ingredient_ids, users, recipes, tags, max_recipe_tags, seed,
+             **options):
+        rnd = random.Random(seed)
+        bits = Tag.get_free_bits(tags)
+        if len(bits) < tags:
+            raise CommandError(f'Свободных битов маски тегов: {len(bits)}.')
+        tag_objs = Tag.objects.bulk_create(
+            Tag(name=f'benchmark_tag_filter {number}',
+                color=f'#BF{number:04X}',
+                slug=f'benchmark-tag-filter-{number}',
+                bit=bit)
+            for number, bit in enumerate(bits)
+        )
+        authors = create_users(users, prefix='benchmark_tag_filter')
+        create_recipes(authors, recipes, ingredient_ids, 1, rnd,
+                       tags=tag_objs,
+                       tags_count=(1, min(max_recipe_tags, tags)))
+        return tag_objs
+
+    def compare(self, name, tags, options):
+        results = {}
+        for filter_name, filter_tags in (('соединение', filter_by_slugs),
+                                         ('маска', filter_by_tags)):
+            queryset = filter_tags(Recipe.objects.all(), tags)
+            seconds = {'страница': [], 'количество': []}
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                page = tuple(queryset.values_list('pk', flat=True)
+                             [:options['limit']])
+                seconds['страница'].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                count = queryset.count()
+                seconds['количество'].append(time.perf_counter() - started)
+            results[filter_name] = (page, count)
+            for operation, values in seconds.items():
+                self.stdout.write(f'{name:>14}, {filter_name:>10}, '
+                                  f'{operation:>10}: {summary(values)}')
+        if len(set(results.values())) > 1:
+            self.stderr.write(f'{name}: результаты фильтров различаются: '
+                              f'{results}')
+            return False
+        return True
@@ -0,0 +1,58 @@
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.exporters import recipe_records
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты с тегами, ингредиентами и картинками '
+            'в файл JSON Lines: одна строка - один рецепт. Автор '
+            'записывается по email, теги - по slug, ингредиенты - '
+            'по названию и единице измерения. Картинки записываются '
+            'путем в хранилище или, с ключом --inline-images, '
+            'содержимым в base64. Рецепты читаются пакетами, поэтому '
+            'память не зависит от их числа. Файл загружается командой '
+            'import_recipes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Путь к файлу, по умолчанию stdout.')
+        parser.add_argument('--inline-images', action='store_true',
+                            help='Встроить картинки в base64.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Количество рецептов в запросе.')
+        parser.add_argument('--workers', type=int,
+                            default=max(settings.RECIPE_IMAGE_WORKERS, 1),
+                            help='Количество потоков чтения картинок.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        total = Recipe.objects.count()
+        executor = (ThreadPoolExecutor(max_workers=options['workers'])
+                    if options['inline_images'] else nullcontext())
+        try:
+            output = (nullcontext(sys.stdout) if path == '-'
+                      else open(path, 'w', encoding='utf-8'))
+        except OSError as error:
+            raise CommandError(f'Не удалось открыть файл: {error}')
+        started = reported = time.perf_counter()
+        exported = 0
+        with output as file, executor:
+            for record in recipe_records(
+                Recipe.objects.all(), batch_size=options['batch_size'],
+                executor=executor if options['inline_images'] else None
+            ):
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                exported += 1
+                if time.perf_counter() - reported >= 1:
+                    reported = time.perf_counter()
+                    self.stderr.write(f'Выгружено {exported} из {total}.')
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {exported} '
+            f'({time.perf_counter() - started:.2f} с).'))
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.images import process_image_in_worker
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создает уменьшенные копии картинок рецептов, у которых '
+            'их еще нет. С ключом --all копии пересоздаются для всех '
+            'рецептов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать копии всех картинок.')
+        parser.add_argument('--workers', type=int,
+                            default=max(settings.RECIPE_IMAGE_WORKERS, 1),
+                            help='Количество потоков обработки.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        recipes = list(recipes.values_list('pk', 'image'))
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(lambda recipe:
+                                        process_image_in_worker(*recipe),
+                                        recipes))
+        failed = results.count(False)
+        if failed:
+            raise CommandError(f'Не удалось обработать картинок: {failed} '
+                               f'из {len(recipes)}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {len(recipes)}.'))
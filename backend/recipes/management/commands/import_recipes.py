@@ -0,0 +1,79 @@
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes import importers
+from recipes.images import process_image_in_worker
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из файла JSON Lines, созданного командой '
+            'export_recipes. Автор, теги и ингредиенты ищутся по email, '
+            'slug и паре (название, единица измерения) и должны '
+            'существовать. Рецепты создаются пакетами bulk_create, '
+            'каждый пакет - в отдельной транзакции, картинки '
+            'декодируются и сохраняются в пуле потоков. Файл читается '
+            'потоком, в памяти находится один пакет. Некорректные '
+            'записи пропускаются с сообщением. Повторный импорт создает '
+            'рецепты повторно.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Путь к файлу, по умолчанию stdin.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Количество рецептов в транзакции.')
+        parser.add_argument('--workers', type=int,
+                            default=max(settings.RECIPE_IMAGE_WORKERS, 1),
+                            help='Количество потоков обработки картинок.')
+        parser.add_argument('--image-variants', action='store_true',
+                            help='Создать уменьшенные копии картинок '
+                                 'после каждого пакета.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.image_variants = options['image_variants']
+        self.started = self.reported = time.perf_counter()
+        try:
+            source = (nullcontext(sys.stdin) if path == '-'
+                      else open(path, encoding='utf-8'))
+        except OSError as error:
+            raise CommandError(f'Не удалось открыть файл: {error}')
+        with source as file, ThreadPoolExecutor(
+            max_workers=options['workers']
+        ) as self.executor:
+            try:
+                counts = importers.import_recipes(
+                    importers.read_json_objects(file), self.executor,
+                    batch_size=options['batch_size'], report=self.report,
+                    progress=self.progress)
+            except (json.JSONDecodeError, UnicodeDecodeError) as error:
+                raise CommandError(f'Ошибка разбора файла: {error}')
+        refresh_scores()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {counts[importers.IMPORTED]}, '
+            f'пропущено записей: {counts[importers.INVALID]} '
+            f'({time.perf_counter() - self.started:.2f} с).'))
+        if counts[importers.IMPORTED] and not self.image_variants:
+            self.stdout.write('Уменьшенные копии картинок создает команда '
+                              'generate_image_variants.')
+
+    def report(self, status, number, record, error):
+        self.stderr.write(f'Запись {number} ({str(record)[:50]}): {error}.')
+
+    def progress(self, counts, recipes):
+        if self.image_variants:
+            list(self.executor.map(
+                lambda recipe: process_image_in_worker(recipe.pk,
+                                                       recipe.image.name),
+                recipes))
+        if time.perf_counter() - self.reported >= 1:
+            self.reported = time.perf_counter()
+            self.stderr.write(
+                f'Загружено {counts[importers.IMPORTED]}, пропущено '
+                f'{counts[importers.INVALID]} '
+                f'({time.perf_counter() - self.started:.0f} с).')
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes import importers
+
+FORMATS = ('json', 'csv')
+# Формат файла по расширению.
+EXTENSIONS = {
+    '.json': 'json',
+    '.jsonl': 'json',
+    '.csv': 'csv',
+}
+
+
+class Command(BaseCommand):
+    help = ('Загружает справочник ингредиентов из файла JSON (массив или '
+            'JSON Lines) или CSV (name, measurement_unit). Файл читается '
+            'потоком, новые ингредиенты добавляются пакетами, '
+            'существующие пропускаются, поэтому повторная загрузка '
+            'ничего не меняет. Выводит количество добавленных, '
+            'неизмененных, конфликтующих и некорректных записей. '
+            'С ключом --dry-run только показывает изменения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data',
+                                 'ingredients.json'),
+            help='Путь к файлу, по умолчанию data/ingredients.json.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Формат файла, по умолчанию '
+                                 'по расширению.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество ингредиентов в запросе.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Показать изменения без записи в базу.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (options['format'] or EXTENSIONS.get(
+            os.path.splitext(path)[1].lower()))
+        if file_format is None:
+            raise CommandError(f'Неизвестный формат файла {path}, '
+                               f'укажите --format.')
+        self.dry_run = options['dry_run']
+        started = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                if file_format == 'json':
+                    records = importers.read_json_objects(file)
+                else:
+                    records = importers.read_csv_records(
+                        file, ['name', 'measurement_unit'])
+                counts = importers.load_ingredients(
+                    records, batch_size=options['batch_size'],
+                    dry_run=self.dry_run, report=self.report)
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать файл: {error}')
+        except (json.JSONDecodeError, UnicodeDecodeError) as error:
+            raise CommandError(f'Ошибка разбора файла {path}: {error}')
+        seconds = time.perf_counter() - started
+        action = 'Будет добавлено' if self.dry_run else 'Добавлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action}: {counts[importers.INSERTED]}, '
+            f'без изменений: {counts[importers.UNCHANGED]}, '
+            f'конфликтов: {counts[importers.CONFLICTING]}, '
+            f'некорректных записей: {counts[importers.INVALID]} '
+            f'({seconds:.2f} с).'))
+
+    def report(self, status, number, ingredient, existing):
+        if status == importers.INSERTED and self.dry_run:
+            self.stdout.write(f'+ {ingredient[0]} ({ingredient[1]})')
+        elif status == importers.CONFLICTING:
+            self.stderr.write(
+                f'Запись {number}: {ingredient[0]} ({ingredient[1]}) '
+                f'совпадает с {existing[0]} ({existing[1]}) '
+                f'без учета регистра.')
+        elif status == importers.INVALID:
+            self.stderr.write(f'Запись {number}: некорректный '
+                              f'ингредиент {ingredient!r}.')
@@ -0,0 +1,234 @@
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from core.benchmark import percentile
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+SERVER = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py']
+WSGI = {'GUNICORN_APP': 'foodgram_api.wsgi:application',
+        'GUNICORN_WORKER_CLASS': 'sync'}
+ASGI = {'GUNICORN_APP': 'foodgram_api.asgi:application',
+        'GUNICORN_WORKER_CLASS': 'uvicorn.workers.UvicornWorker',
+        'DB_CONN_MAX_AGE': '0'}
+
+# Режим: переменные окружения сервера.
+MODES = {
+    'wsgi-close': {**WSGI, 'DB_CONN_MAX_AGE': '0', 'DB_CONN_POOL': 'false'},
+    'wsgi-persistent': {**WSGI, 'DB_CONN_MAX_AGE': '600',
+                        'DB_CONN_POOL': 'false'},
+    'wsgi-pool': {**WSGI, 'DB_CONN_POOL': 'true'},
+    'asgi-sync': {**ASGI, 'ASYNC_READ_VIEWS': 'false',
+                  'DB_CONN_POOL': 'false'},
+    'asgi-async': {**ASGI, 'ASYNC_READ_VIEWS': 'true',
+                   'DB_CONN_POOL': 'false'},
+    'asgi-async-pool': {**ASGI, 'ASYNC_READ_VIEWS': 'true',
+                        'DB_CONN_POOL': 'true'},
+}
+POSTGRESQL_MODES = {'wsgi-pool', 'asgi-async-pool'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(port, path, headers, timeout=30):
+    client = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        client.request('GET', path, headers=headers)
+        response = client.getresponse()
+        response.read()
+        return response.status
+    finally:
+        client.close()
+
+
+def hold_slow_clients(port, count, deadline, interval=0.5):
+    """
+    Держит count медленных клиентов: соединения, передающие заголовки
+    запроса по одной строке каждые interval секунд до deadline.
+    """
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(b'GET /api/tags/ HTTP/1.1\r\nHost: localhost\r\n')
+            sockets.append(sock)
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            for sock in sockets:
+                try:
+                    sock.sendall(b'X-Slow-Client: 1\r\n')
+                except OSError:
+                    pass
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест: для каждого режима запускает сервер '
+            'приложения на свободном порту с базой данных из настроек '
+            '(PostgreSQL или SQLite) и измеряет пропускную способность '
+            'и время ответа при заданном числе одновременных клиентов. '
+            'Режимы: закрытие соединений в конце запроса, постоянные '
+            'соединения, пул соединений (только PostgreSQL) под WSGI '
+            '(gunicorn) и под ASGI (uvicorn) с синхронными или '
+            'асинхронными представлениями чтения. Медленные клиенты '
+            'занимают соединения на все время теста. Для '
+            'аутентифицированных запросов создается пользователь '
+            'load_test с токеном.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', action='append', choices=MODES,
+                            dest='modes',
+                            help='Режимы сервера, по умолчанию все.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Пути запросов, по умолчанию '
+                                 '/api/recipes/ и /api/users/subscriptions/.')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность теста режима, сек.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество процессов сервера; больше '
+                                 'одного - только с общим кэшем '
+                                 '(CACHE_BACKEND).')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Количество потоков процесса WSGI.')
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='Количество медленных клиентов.')
+        parser.add_argument('--anonymous', action='store_true',
+                            help='Запросы без токена.')
+
+    def handle(self, *args, **options):
+        modes = options['modes'] or list(MODES)
+        paths = options['paths'] or ['/api/recipes/',
+                                     '/api/users/subscriptions/']
+        headers = {'Host': 'localhost'}
+        if not options['anonymous']:
+            headers['Authorization'] = f'Token {self.get_token()}'
+        self.stdout.write(f'База данных: {connection.vendor}, клиентов: '
+                          f'{options["concurrency"]}, медленных клиентов: '
+                          f'{options["slow_clients"]}, '
+                          f'{options["duration"]} с на режим')
+        for mode in modes:
+            if (mode in POSTGRESQL_MODES
+                    and connection.vendor != 'postgresql'):
+                self.stdout.write(f'{mode:>16}: пропущен, нужен PostgreSQL')
+                continue
+            server = self.start_server(mode, options)
+            try:
+                port = server.port
+                self.wait_ready(server, port, paths[0], headers)
+                result = self.run_clients(port, paths, headers, options)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            self.stdout.write(f'{mode:>16}: {self.format_result(result)}')
+
+    @staticmethod
+    def get_token():
+        user, _ = User.objects.get_or_create(
+            username='load_test',
+            defaults={'email': 'load_test@foodgram.local',
+                      'first_name': 'Load',
+                      'last_name': 'Test'})
+        return Token.objects.get_or_create(user=user)[0].key
+
+    @staticmethod
+    def start_server(mode, options):
+        port = free_port()
+        env = {
+            **os.environ,
+            **MODES[mode],
+            'GUNICORN_BIND': f'127.0.0.1:{port}',
+            'GUNICORN_WORKERS': str(options['workers']),
+            'GUNICORN_THREADS': str(options['threads']),
+            # Под ASGI каждый запрос выполняет синхронный код в своем
+            # потоке.
+            'DB_POOL_MAX_SIZE': str(max(options['threads'],
+                                        options['concurrency'])),
+            'DJANGO_SETTINGS_MODULE': os.environ.get(
+                'DJANGO_SETTINGS_MODULE', 'foodgram_api.settings'),
+        }
+        server = subprocess.Popen(
+            SERVER, cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        server.port = port
+        return server
+
+    @staticmethod
+    def wait_ready(server, port, path, headers, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('Сервер завершился: '
+                                   + server.stderr.read().decode()[-2000:])
+            try:
+                get(port, path, headers)
+            except OSError:
+                time.sleep(0.2)
+            else:
+                return
+        raise CommandError('Сервер не ответил за отведенное время.')
+
+    @staticmethod
+    def run_clients(port, paths, headers, options):
+        deadline = time.monotonic() + options['duration']
+        seconds, errors = [], []
+        lock = threading.Lock()
+
+        def client(number):
+            local_seconds, local_errors = [], 0
+            request = number
+            while time.monotonic() < deadline:
+                path = paths[request % len(paths)]
+                request += 1
+                started = time.perf_counter()
+                try:
+                    status = get(port, path, headers)
+                except OSError:
+                    status = None
+                if status != 200:
+                    local_errors += 1
+                    continue
+                local_seconds.append(time.perf_counter() - started)
+            with lock:
+                seconds.extend(local_seconds)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=client, args=(number,))
+                   for number in range(options['concurrency'])]
+        if options['slow_clients']:
+            threads.append(threading.Thread(
+                target=hold_slow_clients,
+                args=(port, options['slow_clients'], deadline)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {'seconds': seconds, 'errors': sum(errors),
+                'duration': options['duration']}
+
+    @staticmethod
+    def format_result(result):
+        seconds = result['seconds']
+        if not seconds:
+            return f'нет успешных ответов, ошибок {result["errors"]}'
+        return (f'{len(seconds) / result["duration"]:8.1f} запр./с, '
+                f'p50 {statistics.median(seconds) * 1000:7.2f} мс, '
+                f'p95 {percentile(seconds, 95) * 1000:7.2f} мс, '
+                f'ошибок {result["errors"]}')
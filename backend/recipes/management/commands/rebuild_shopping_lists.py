@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from recipes import services
+from recipes.models import Purchase, ShoppingListItem
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает списки покупок пользователей по их корзинам. '
+            'С ключом --verify только проверяет списки покупок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить списки покупок.')
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', metavar='USER_ID',
+                            help='Обработать только указанных пользователей.')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or self.get_user_ids()
+        mismatches = 0
+        for user_id in user_ids:
+            if options['verify']:
+                mismatches += self.verify(user_id)
+            else:
+                services.rebuild_shopping_list(user_id)
+        if options['verify'] and mismatches:
+            raise CommandError(
+                f'Списков покупок с расхождениями: {mismatches}.')
+        action = 'Проверено' if options['verify'] else 'Пересобрано'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} списков покупок: {len(user_ids)}.'))
+
+    @staticmethod
+    def get_user_ids():
+        purchasers = Purchase.objects.values_list('user_id', flat=True)
+        owners = ShoppingListItem.objects.values_list('user_id', flat=True)
+        return sorted(set(purchasers.distinct()) | set(owners.distinct()))
+
+    def verify(self, user_id):
+        expected = services.get_expected_shopping_list(user_id)
+        actual = dict(ShoppingListItem
+                      .objects
+                      .filter(user=user_id)
+                      .values_list('ingredient_id', 'total_amount'))
+        if expected == actual:
+            return 0
+        for ingredient_id in sorted(expected.keys() | actual.keys()):
+            if expected.get(ingredient_id) != actual.get(ingredient_id):
+                self.stderr.write(
+                    f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                    f'ожидается {expected.get(ingredient_id, 0)}, '
+                    f'в списке {actual.get(ingredient_id, 0)}.'
+                )
+        return 1
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинги рецептов для сортировок ленты '
+            'popular и trending: рецептов, добавленных в избранное '
+            'или корзину (или удаленных из них) после последнего '
+            'расчета, с ключом --full - всех. Рейтинги новых событий '
+            'появляются в ленте после пересчета, поэтому команду '
+            'следует запускать периодически (например, из cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать рейтинги всех рецептов.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Количество рецептов в транзакции.')
+
+    def handle(self, *args, **options):
+        count = refresh_scores(full=options['full'],
+                               batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рейтингов рецептов: {count}.'))
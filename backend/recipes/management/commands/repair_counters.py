@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes import services
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает хранимые счетчики: рецепты и подписчики '
+            'пользователей, добавления рецептов в избранное. '
+            'С ключом --dry-run только проверяет счетчики.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить счетчики.')
+
+    def handle(self, *args, **options):
+        fixed = services.repair_counters(dry_run=options['dry_run'])
+        for counter, count in fixed.items():
+            self.stdout.write(f'{counter}: {count}')
+        if options['dry_run'] and any(fixed.values()):
+            raise CommandError(
+                f'Неверных счетчиков: {sum(fixed.values())}.')
+        action = 'Проверено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} счетчиков: {sum(fixed.values())}.'))
@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    Purchase = apps.get_model('recipes', 'Purchase')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    items = (Purchase
+             .objects
+             .values('user_id',
+                     ingredient_id=F('recipe__ingredients_in_recipe__ingredient'))
+             .annotate(total_amount=Sum('recipe__ingredients_in_recipe__amount'))
+             .filter(ingredient_id__isnull=False)
+             .order_by())
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(**item) for item in items.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('recipes', '0004_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop)
+    ]
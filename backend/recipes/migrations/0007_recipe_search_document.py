@@ -0,0 +1,44 @@
+# Generated by Django 4.1.6 on 2026-10-18 05:46
+
+import core.operations
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def fill_search_documents(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    names = {}
+    for recipe_id, name in (RecipeIngredient
+                            .objects
+                            .values_list('recipe_id', 'ingredient__name')
+                            .order_by('recipe_id', 'ingredient__name')
+                            .iterator()):
+        names.setdefault(recipe_id, []).append(name)
+    recipes = list(Recipe.objects.only('pk', 'text'))
+    for recipe in recipes:
+        recipe.search_document = '\n'.join([*names.get(recipe.pk, []),
+                                            recipe.text])
+    Recipe.objects.bulk_update(recipes, ['search_document'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_alter_recipe_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False, verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(fill_search_documents,
+                             migrations.RunPython.noop),
+        core.operations.AddPostgreSQLIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='russian', weight='A'), '||', django.contrib.postgres.search.SearchVector('search_document', config='russian', weight='B'), django.contrib.postgres.search.SearchConfig('russian')), name='recipe_search_idx'),
+        ),
+    ]
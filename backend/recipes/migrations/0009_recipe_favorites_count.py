@@ -0,0 +1,31 @@
+# Generated by Django 4.1.6 on 2026-10-18 06:09
+
+from core.counters import count_subquery
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    User.objects.update(recipes_count=count_subquery(Recipe.objects.all(),
+                                                     'author'))
+    Recipe.objects.update(favorites_count=count_subquery(
+        Favorite.objects.all(), 'recipe'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_variants'),
+        ('users', '0011_user_recipes_count_subscribers_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.6 on 2026-10-18 08:05
+
+import core.operations
+import django.db.models.functions.text
+from django.contrib.postgres.indexes import OpClass
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-published_at', '-id'], name='recipe_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-published_at', '-id'], name='recipe_author_published_idx'),
+        ),
+        # Выражение совпадает с условием istartswith в PostgreSQL:
+        # UPPER("name"::text) LIKE UPPER(%s).
+        core.operations.AddPostgreSQLIndex(
+            model_name='ingredient',
+            index=models.Index(OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='ingredient_name_upper_idx'),
+        ),
+        # Фильтр рецептов по тегам: id рецептов из индекса без чтения
+        # таблицы (index-only scan). Таблица связи создается Django,
+        # поэтому индекс не описан в модели.
+        core.operations.AddPostgreSQLIndex(
+            model_name='recipe_tags',
+            index=models.Index(fields=['tag', 'recipe'], name='recipe_tags_tag_recipe_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.6 on 2026-10-18 10:12
+
+from django.db import migrations, models
+from django.db.models import (BigIntegerField, F, OuterRef, Subquery, Sum,
+                              Value)
+from django.db.models.functions import Cast, Coalesce
+
+
+def assign_tag_bits(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    tags = list(Tag.objects.order_by('pk'))
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ['bit'])
+
+
+def fill_tags_masks(apps, schema_editor):
+    # Как recipes.tags.update_tags_masks, но с моделями миграции.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    tag_masks = (Recipe.tags.through
+                 .objects
+                 .filter(recipe=OuterRef('pk'))
+                 .values('recipe')
+                 .annotate(mask=Sum(Cast(Value(1), BigIntegerField())
+                                    .bitleftshift(F('tag__bit'))))
+                 .values('mask'))
+    Recipe.objects.update(tags_mask=Coalesce(
+        Subquery(tag_masks, output_field=BigIntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит маски тегов'),
+        ),
+        migrations.RunPython(assign_tag_bits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True, verbose_name='Бит маски тегов'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_tags_masks, migrations.RunPython.noop),
+    ]
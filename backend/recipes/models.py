@@ -1,12 +1,38 @@
+from core.counters import CounterFieldsMixin
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVector
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Exists, OuterRef
 
 User = get_user_model()
 
+# Конфигурация полнотекстового поиска PostgreSQL.
+SEARCH_CONFIG = 'russian'
+
+# Количество битов маски тегов рецепта (BigIntegerField со знаком),
+# то есть наибольшее количество тегов.
+TAG_BITS = 63
+
+
+def recipe_search_vector():
+    """
+    Поисковый вектор рецепта: название с весом A, описание
+    и названия ингредиентов с весом B. Выражение совпадает
+    с выражением индекса recipe_search_idx (только PostgreSQL,
+    создается миграцией 0007), поэтому используется им.
+    """
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('search_document', weight='B',
+                           config=SEARCH_CONFIG))
+
 
 class Ingredient(models.Model):
+    """
+    Ингредиент. Поиск по началу названия без учета регистра
+    (istartswith) в PostgreSQL использует индекс ingredient_name_upper_idx
+    по UPPER(name), создаваемый миграцией 0011.
+    """
     name = models.CharField('Название',
                             max_length=200)
     measurement_unit = models.CharField('Единица измерения',
@@ -28,6 +54,10 @@ class Ingredient(models.Model):
 
 
 class Tag(models.Model):
+    """
+    Тег. Каждому тегу назначается свободный бит маски тегов рецепта
+    (Recipe.tags_mask), поэтому тегов не больше TAG_BITS.
+    """
     name = models.CharField('Название',
                             max_length=50,
                             unique=True)
@@ -35,6 +65,9 @@ class Tag(models.Model):
                              max_length=7,
                              unique=True)
     slug = models.SlugField(unique=True)
+    bit = models.PositiveSmallIntegerField('Бит маски тегов',
+                                           unique=True,
+                                           editable=False)
 
     class Meta:
         verbose_name = 'Тег'
@@ -44,20 +77,43 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    @classmethod
+    def get_free_bits(cls, count):
+        """
+        Возвращает не больше count наименьших незанятых битов.
+        """
+        used = set(cls.objects.values_list('bit', flat=True))
+        return [bit for bit in range(TAG_BITS) if bit not in used][:count]
+
+    @classmethod
+    def get_free_bit(cls):
+        """
+        Возвращает наименьший незанятый бит. Если все биты заняты,
+        вызывает ValidationError.
+        """
+        bits = cls.get_free_bits(1)
+        if not bits:
+            raise ValidationError(f'Можно создать не больше {TAG_BITS} '
+                                  f'тегов.')
+        return bits[0]
+
+    def clean(self):
+        if self.bit is None:
+            self.get_free_bit()
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.get_free_bit()
+        super().save(*args, **kwargs)
 
-class RecipeManager(models.Manager):
-    def with_is_favorited_and_is_in_shopping_cart(self, user):
-        if user.is_anonymous:
-            return self.all()
-        user_favorites = Favorite.objects.filter(user=user,
-                                                 recipe=OuterRef('pk'))
-        user_purchases = Purchase.objects.filter(user=user,
-                                                 recipe=OuterRef('pk'))
-        return self.annotate(is_favorited=Exists(user_favorites),
-                             is_in_shopping_cart=Exists(user_purchases))
 
+class Recipe(CounterFieldsMixin, models.Model):
+    counter_fields = ('favorites_count',)
 
-class Recipe(models.Model):
     name = models.CharField('Название',
                             max_length=200)
     author = models.ForeignKey(User,
@@ -80,13 +136,33 @@ class Recipe(models.Model):
                                          verbose_name='Ингридиенты')
     published_at = models.DateTimeField('Опубликован',
                                         auto_now_add=True)
-
-    objects = RecipeManager()
+    search_document = models.TextField('Поисковый документ',
+                                       blank=True,
+                                       editable=False)
+    image_variants = models.JSONField('Уменьшенные копии картинки',
+                                      default=dict,
+                                      blank=True,
+                                      editable=False)
+    favorites_count = models.PositiveIntegerField('В избранном',
+                                                  default=0,
+                                                  editable=False)
+    # Биты тегов рецепта (Tag.bit) для фильтра по тегам без соединений,
+    # обновляется recipes.tags.update_tags_masks.
+    tags_mask = models.BigIntegerField('Маска тегов',
+                                       default=0,
+                                       editable=False)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ['-published_at']
+        ordering = ['-published_at', '-id']
+        # Лента рецептов и рецепты автора в порядке ordering.
+        indexes = [
+            models.Index(fields=['-published_at', '-id'],
+                         name='recipe_published_idx'),
+            models.Index(fields=['author', '-published_at', '-id'],
+                         name='recipe_author_published_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -130,6 +206,8 @@ class Favorite(models.Model):
                                on_delete=models.CASCADE,
                                db_index=True,
                                verbose_name='Рецепт')
+    created_at = models.DateTimeField('Добавлено',
+                                      auto_now_add=True)
 
     class Meta:
         verbose_name = 'Избранное'
@@ -153,6 +231,8 @@ class Purchase(models.Model):
     recipe = models.ForeignKey(Recipe,
                                on_delete=models.CASCADE,
                                verbose_name='Рецепт')
+    created_at = models.DateTimeField('Добавлено',
+                                      auto_now_add=True)
 
     class Meta:
         verbose_name = 'Покупка'
@@ -166,3 +246,59 @@ class Purchase(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class RecipeScore(models.Model):
+    """
+    Рейтинги рецепта для сортировки ленты (recipes.scores).
+    stale - рецепт добавлен в избранное или корзину (или удален из них)
+    после последнего расчета.
+    """
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='score',
+                                  verbose_name='Рецепт')
+    popular = models.FloatField('Популярность', default=0)
+    trending = models.FloatField('Актуальность', default=0)
+    stale = models.BooleanField('Требует пересчета', default=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular', '-recipe'],
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='recipe_score_trending_idx'),
+            models.Index(fields=['stale'],
+                         condition=models.Q(stale=True),
+                         name='recipe_score_stale_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popular}, {self.trending}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='shopping_list',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient,
+                                   on_delete=models.CASCADE,
+                                   verbose_name='Ингредиент')
+    total_amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} - {self.ingredient.name}'
@@ -0,0 +1,152 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from core.caching import bump_versions
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Favorite, Purchase, Recipe, RecipeScore
+
+# Веса событий: добавление в корзину ценнее добавления в избранное,
+# публикация дает новому рецепту начальную актуальность.
+FAVORITE_WEIGHT = 1.0
+PURCHASE_WEIGHT = 2.0
+PUBLISH_WEIGHT = 1.0
+
+# Начало отсчета времени для рейтинга актуальности.
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+# Сортировки ленты рецептов по рейтингам: параметр ordering -> поле.
+ORDERINGS = {
+    'popular': 'popular',
+    'trending': 'trending',
+}
+# Аннотации с рейтингом и id рецепта из таблицы рейтингов,
+# по которым сортируется лента.
+ORDERING_ANNOTATION = 'feed_score'
+ORDERING_ID_ANNOTATION = 'feed_id'
+SCORE_ORDERING = (f'-{ORDERING_ANNOTATION}', f'-{ORDERING_ID_ANNOTATION}')
+
+
+def decay_exponent(moment):
+    """
+    Показатель экспоненты веса события: вес удваивается каждые
+    RECIPE_TRENDING_HALF_LIFE часов, прошедших от EPOCH.
+    """
+    hours = (moment - EPOCH).total_seconds() / 3600
+    return math.log(2) * hours / settings.RECIPE_TRENDING_HALF_LIFE
+
+
+def log_sum_exp(exponents):
+    m = max(exponents)
+    return m + math.log(sum(math.exp(value - m) for value in exponents))
+
+
+def calculate_scores(published_at, events):
+    """
+    Возвращает рейтинги рецепта (popular, trending) по времени
+    публикации и событиям [(вес, время)].
+    popular - сумма весов событий.
+    trending - логарифм суммы весов, растущих экспоненциально со временем
+    события: это рейтинг с затуханием старых событий, но затухание
+    одинаково для всех рецептов, поэтому рейтинги без новых событий
+    не нужно пересчитывать со временем. В логарифмической шкале
+    экспоненты не переполняются.
+    """
+    events = [(PUBLISH_WEIGHT, published_at), *events]
+    return (
+        sum(weight for weight, _ in events[1:]),
+        log_sum_exp([math.log(weight) + decay_exponent(moment)
+                     for weight, moment in events]),
+    )
+
+
+def get_events(recipe_ids):
+    events = defaultdict(list)
+    for model, weight in ((Favorite, FAVORITE_WEIGHT),
+                          (Purchase, PURCHASE_WEIGHT)):
+        for recipe_id, created_at in (model
+                                      .objects
+                                      .filter(recipe__in=recipe_ids)
+                                      .values_list('recipe_id',
+                                                   'created_at')):
+            events[recipe_id].append((weight, created_at))
+    return events
+
+
+def create_score(recipe):
+    """
+    Создает рейтинги нового рецепта.
+    """
+    popular, trending = calculate_scores(recipe.published_at, [])
+    RecipeScore.objects.create(recipe=recipe, popular=popular,
+                               trending=trending, stale=False)
+
+
+def mark_stale(*recipe_ids):
+    RecipeScore.objects.filter(recipe__in=recipe_ids).update(stale=True)
+
+
+@transaction.atomic
+def refresh_batch(recipe_ids):
+    """
+    Пересчитывает рейтинги рецептов.
+    Признак stale снимается до чтения событий в той же транзакции:
+    событие, сохраненное во время расчета, снова установит признак.
+    """
+    RecipeScore.objects.filter(recipe__in=recipe_ids).update(stale=False)
+    events = get_events(recipe_ids)
+    scores = []
+    for recipe_id, published_at in (Recipe
+                                    .objects
+                                    .filter(pk__in=recipe_ids)
+                                    .values_list('pk', 'published_at')):
+        popular, trending = calculate_scores(published_at,
+                                             events[recipe_id])
+        scores.append(RecipeScore(recipe_id=recipe_id, popular=popular,
+                                  trending=trending))
+    RecipeScore.objects.bulk_update(scores, ['popular', 'trending'])
+
+
+def refresh_scores(full=False, batch_size=500):
+    """
+    Пересчитывает рейтинги рецептов с признаком stale (при full - всех)
+    и создает рейтинги рецептов без них (например, после bulk_create).
+    Возвращает количество пересчитанных рецептов.
+    """
+    RecipeScore.objects.bulk_create(
+        (RecipeScore(recipe_id=recipe_id) for recipe_id in Recipe
+         .objects
+         .filter(score__isnull=True)
+         .values_list('pk', flat=True)),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    scores = RecipeScore.objects.all()
+    if not full:
+        scores = scores.filter(stale=True)
+    recipe_ids = list(scores.values_list('recipe_id', flat=True))
+    for start in range(0, len(recipe_ids), batch_size):
+        refresh_batch(recipe_ids[start:start + batch_size])
+    if recipe_ids:
+        bump_versions('recipe')
+    return len(recipe_ids)
+
+
+def order_by_score(queryset, ordering):
+    """
+    Сортирует рецепты по рейтингу ordering (ключ ORDERINGS) по индексу
+    таблицы рейтингов. Рейтинг и id рецепта добавляются аннотациями
+    ORDERING_ANNOTATION и ORDERING_ID_ANNOTATION для курсорной
+    пагинации. При равных рейтингах рецепты сортируются по колонке
+    recipe таблицы рейтингов, а не recipes_recipe.id: так сортировка
+    и условие курсора совпадают с индексом (рейтинг, recipe).
+    """
+    return (queryset
+            .filter(score__isnull=False)
+            .annotate(**{ORDERING_ANNOTATION:
+                         F(f'score__{ORDERINGS[ordering]}'),
+                         ORDERING_ID_ANNOTATION: F('score__recipe')})
+            .order_by(*SCORE_ORDERING))
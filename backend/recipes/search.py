@@ -0,0 +1,173 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from core.caching import bump_versions, get_versions
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, FloatField, Value, When
+
+from .models import (SEARCH_CONFIG, Recipe, RecipeIngredient,
+                     recipe_search_vector)
+
+# Веса совпадений в названии рецепта и в поисковом документе
+# для индекса в памяти (аналог весов A и B в PostgreSQL).
+NAME_WEIGHT = 1.0
+DOCUMENT_WEIGHT = 0.4
+
+WORD_RE = re.compile(r'\w+')
+
+# Версия поискового индекса в памяти. Меняется только при изменении
+# содержимого рецептов (название, описание, ингредиенты), а не при
+# добавлении в избранное или в корзину, как версия 'recipe'.
+SEARCH_VERSION = 'search'
+# Поля рецепта, от которых зависит индекс.
+SEARCH_FIELDS = frozenset(('name', 'text', 'search_document'))
+
+
+def make_search_document(text, ingredient_names):
+    """
+    Возвращает поисковый документ рецепта: названия ингредиентов
+    и описание.
+    """
+    return '\n'.join([*ingredient_names, text])
+
+
+def update_search_documents(recipe_ids):
+    """
+    Пересчитывает поисковые документы рецептов и меняет версию
+    поискового индекса.
+    """
+    names = defaultdict(list)
+    for recipe_id, name in (RecipeIngredient
+                            .objects
+                            .filter(recipe__in=recipe_ids)
+                            .values_list('recipe_id', 'ingredient__name')
+                            .order_by('recipe_id', 'ingredient__name')):
+        names[recipe_id].append(name)
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids).only('pk', 'text'))
+    for recipe in recipes:
+        recipe.search_document = make_search_document(recipe.text,
+                                                      names[recipe.pk])
+    Recipe.objects.bulk_update(recipes, ['search_document'], batch_size=1000)
+    bump_versions(SEARCH_VERSION)
+
+
+def rank_key(item):
+    """
+    Ключ сортировки пар (id рецепта, ранг): по убыванию ранга, затем
+    по убыванию id.
+    """
+    return -item[1], -item[0]
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class RecipeSearchIndex:
+    """
+    Инвертированный индекс рецептов в памяти процесса.
+    Используется вместо полнотекстового поиска PostgreSQL в других СУБД.
+    Слово запроса совпадает со всеми словами индекса, которые с него
+    начинаются; рецепт должен содержать все слова запроса.
+    """
+    version = None
+
+    def __init__(self, recipes):
+        postings = defaultdict(dict)
+        for pk, name, document in recipes:
+            for weight, text in ((NAME_WEIGHT, name),
+                                 (DOCUMENT_WEIGHT, document)):
+                for term in tokenize(text):
+                    scores = postings[term]
+                    scores[pk] = scores.get(pk, 0) + weight
+        self.terms = sorted(postings)
+        self.postings = [postings[term] for term in self.terms]
+
+    def _term_scores(self, word):
+        scores = {}
+        start = bisect_left(self.terms, word)
+        end = bisect_left(self.terms, word + '\uffff', lo=start)
+        for term_scores in self.postings[start:end]:
+            for pk, score in term_scores.items():
+                scores[pk] = max(scores.get(pk, 0), score)
+        return scores
+
+    def search(self, query, limit=None):
+        """
+        Возвращает список не более limit пар (id рецепта, ранг)
+        по убыванию ранга.
+        """
+        words = set(tokenize(query))
+        if not words:
+            return []
+        ranks = None
+        for word in sorted(words, key=len, reverse=True):
+            scores = self._term_scores(word)
+            if ranks is None:
+                ranks = scores
+            else:
+                ranks = {pk: rank + scores[pk]
+                         for pk, rank in ranks.items() if pk in scores}
+            if not ranks:
+                return []
+        if limit is None:
+            return sorted(ranks.items(), key=rank_key)
+        return heapq.nsmallest(limit, ranks.items(), key=rank_key)
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_recipe_search_index():
+    """
+    Возвращает индекс рецептов, перестраивая его после изменения
+    содержимого рецептов (версия SEARCH_VERSION).
+    """
+    global _index
+    [version] = get_versions(SEARCH_VERSION)
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            index = _index
+            if index is None or index.version != version:
+                index = RecipeSearchIndex(Recipe.objects.values_list(
+                    'pk', 'name', 'search_document').order_by())
+                index.version = version
+                _index = index
+    return index
+
+
+def search_recipes(queryset, query):
+    """
+    Отбирает рецепты, соответствующие поисковому запросу, и сортирует
+    их по рангу (аннотация search_rank).
+    В PostgreSQL используется полнотекстовый поиск по индексу
+    recipe_search_idx, в других СУБД - индекс в памяти: отбираются
+    RECIPE_SEARCH_MAX_RESULTS рецептов с наибольшим рангом.
+    """
+    ordering = ['-search_rank', *Recipe._meta.ordering]
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        return (queryset
+                .alias(search=recipe_search_vector())
+                .filter(search=search_query)
+                .annotate(search_rank=SearchRank(recipe_search_vector(),
+                                                 search_query))
+                .order_by(*ordering))
+    ranks = get_recipe_search_index().search(
+        query, settings.RECIPE_SEARCH_MAX_RESULTS)
+    if not ranks:
+        return queryset.none()
+    return (queryset
+            .filter(pk__in=[pk for pk, _ in ranks])
+            .annotate(search_rank=Case(
+                *[When(pk=pk, then=Value(rank)) for pk, rank in ranks],
+                output_field=FloatField()))
+            .order_by(*ordering))
@@ -1,7 +1,22 @@
+from core.bulk import (add_user_relations, delete_rows, existing_ids,
+                       remove_user_relations, unique)
+from core.counters import count_subquery, recount, set_counts
+from core.relations import invalidate_user_relations
 from django.contrib.auth import get_user_model
-from django.db.models import F, Prefetch, Sum
+from django.db import transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from django.db.models.query import ValuesIterable
+from users.models import Subscription
 
-from .models import Favorite, Purchase, Recipe, RecipeIngredient
+from .images import schedule_image_variants
+from .models import (Favorite, Purchase, Recipe, RecipeIngredient,
+                     ShoppingListItem, Tag)
+from .scores import mark_stale
+from .search import update_search_documents
+from .shopping import (get_purchasers, get_recipes_amounts,
+                       update_shopping_lists)
+from .signals import bump_recipe_versions
+from .tags import get_tags_mask
 
 User = get_user_model()
 
@@ -9,46 +24,235 @@ User = get_user_model()
 def create_recipe(data):
     """
     Создает рецепт, добавляет теги и ингредиенты.
+    Маска тегов записывается вместе с рецептом.
     """
     ingredients = data.pop('ingredients_in_recipe')
     tags = data.pop('tags')
-    recipe = Recipe.objects.create(**data)
+    recipe = Recipe.objects.create(**data, tags_mask=get_tags_mask(tags))
     set_recipe_tags_and_ingredients(recipe, tags, ingredients)
+    schedule_image_variants(recipe)
     return recipe
 
 
+@transaction.atomic
 def update_recipe(recipe, data):
     """
-    Обновляет все поля рецепта.
+    Обновляет рецепт, выполняя запросы только для изменившихся данных:
+    поля рецепта, теги и ингредиенты сравниваются с текущими (теги
+    и ингредиенты берутся из prefetch_related объекта, если загружены).
+    Списки покупок пользователей, добавивших рецепт в корзину,
+    корректируются на разницу в количестве ингредиентов.
+    Маска тегов сохраняется вместе с изменившимися полями рецепта.
     """
-    ingredients = data.pop('ingredients_in_recipe')
-    tags = data.pop('tags')
-    for attr, value in data.items():
-        setattr(recipe, attr, value)
-    recipe.save()
-    recipe.ingredients.clear()
-    set_recipe_tags_and_ingredients(recipe, tags, ingredients)
+    ingredients = data.pop('ingredients_in_recipe', None)
+    tags = data.pop('tags', None)
+    if tags is not None:
+        data['tags_mask'] = get_tags_mask(tags)
+    fields = [attr for attr, value in data.items()
+              if getattr(recipe, attr) != value]
+    for attr in fields:
+        setattr(recipe, attr, data[attr])
+    if fields:
+        recipe.save(update_fields=fields)
+    if 'image' in fields:
+        schedule_image_variants(recipe)
+    tags_changed = tags is not None and set_recipe_tags(
+        recipe, {tag.pk for tag in tags},
+        {tag.pk for tag in recipe.tags.all()})
+    deltas, added, ingredients_changed = {}, set(), False
+    if ingredients is not None:
+        current = {recipe_ingredient.ingredient_id: recipe_ingredient
+                   for recipe_ingredient in recipe.ingredients_in_recipe.all()}
+        amounts = {params['ingredient'].pk: params['amount']
+                   for params in ingredients}
+        deltas = set_recipe_ingredients(recipe, amounts, current)
+        added = amounts.keys() - current.keys()
+        ingredients_changed = amounts.keys() != current.keys()
+    if 'text' in fields or ingredients_changed:
+        update_search_documents([recipe.pk])
+    if deltas:
+        # Строки прежних ингредиентов рецепта уже есть в списках покупок.
+        update_shopping_lists(get_purchasers(recipe), deltas,
+                              new_ingredients=added)
+    if tags_changed or deltas:
+        # Пакетные операции не отправляют сигналы.
+        bump_recipe_versions(recipe.pk)
     return recipe
 
 
+@transaction.atomic
+def delete_recipe(recipe):
+    """
+    Удаляет рецепт. Его ингредиенты вычитаются из списков покупок
+    сигналом pre_delete рецепта.
+    """
+    recipe.delete()
+
+
 def set_recipe_tags_and_ingredients(recipe, tags, ingredients):
     """
-    Добавляет теги и ингредиенты рецепта.
+    Добавляет теги и ингредиенты нового рецепта. Маска тегов
+    (Recipe.tags_mask) должна соответствовать tags.
     """
-    recipe.tags.set(tags)
-    RecipeIngredient.objects.bulk_create(
-        [RecipeIngredient(recipe=recipe, **params)
-         for params in ingredients]
-    )
+    set_recipe_tags(recipe, {tag.pk for tag in tags})
+    set_recipe_ingredients(recipe, {params['ingredient'].pk: params['amount']
+                                    for params in ingredients})
+    update_search_documents([recipe.pk])
+    # bulk_create и bulk_update не отправляют сигналы.
+    bump_recipe_versions(recipe.pk)
+
+
+def set_recipe_tags(recipe, tag_ids, current_ids=frozenset()):
+    """
+    Приводит теги рецепта с текущими тегами current_ids к tag_ids:
+    удаляет и добавляет только отличающиеся. Маску тегов рецепта
+    сохраняет вызывающий код.
+    Возвращает True, если теги изменились.
+    """
+    through = Recipe.tags.through
+    removed = current_ids - tag_ids
+    added = sorted(tag_ids - current_ids)
+    if removed:
+        through.objects.filter(recipe=recipe, tag__in=removed).delete()
+    if added:
+        through.objects.bulk_create(
+            [through(recipe=recipe, tag_id=tag_id) for tag_id in added])
+    return bool(removed or added)
 
 
+def set_recipe_ingredients(recipe, amounts, current=None):
+    """
+    Приводит ингредиенты рецепта к amounts: {ingredient_id: amount}.
+    current - текущие ингредиенты {ingredient_id: RecipeIngredient}.
+    Выполняет не более трех запросов: DELETE удаленных, UPDATE
+    изменившихся количеств (bulk_update) и INSERT новых ингредиентов.
+    Возвращает изменения количеств {ingredient_id: разница}.
+    """
+    current = current or {}
+    deltas, changed = {}, []
+    for ingredient_id, recipe_ingredient in current.items():
+        delta = amounts.get(ingredient_id, 0) - recipe_ingredient.amount
+        if delta and ingredient_id in amounts:
+            recipe_ingredient.amount = amounts[ingredient_id]
+            changed.append(recipe_ingredient)
+        if delta:
+            deltas[ingredient_id] = delta
+    removed = [recipe_ingredient.pk
+               for ingredient_id, recipe_ingredient in current.items()
+               if ingredient_id not in amounts]
+    created = [RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                amount=amount)
+               for ingredient_id, amount in amounts.items()
+               if ingredient_id not in current]
+    if removed:
+        delete_rows(RecipeIngredient.objects.filter(pk__in=removed))
+    if changed:
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+    if created:
+        RecipeIngredient.objects.bulk_create(created)
+    deltas.update((recipe_ingredient.ingredient_id, recipe_ingredient.amount)
+                  for recipe_ingredient in created)
+    return deltas
+
+
+@transaction.atomic
+def create_purchase(data):
+    """
+    Добавляет рецепт в корзину и его ингредиенты в список покупок.
+    """
+    purchase = Purchase.objects.create(**data)
+    update_shopping_lists([purchase.user_id],
+                          get_recipes_amounts([purchase.recipe_id]))
+    return purchase
+
+
+@transaction.atomic
 def delete_purchase(user, recipe):
     """
     Удаляет рецепт из списка покупок пользователя.
     """
-    return Purchase.objects.filter(user=user, recipe=recipe).delete()
+    result = Purchase.objects.filter(user=user, recipe=recipe).delete()
+    if result[0]:
+        update_shopping_lists([user.pk], get_recipes_amounts([recipe]),
+                              sign=-1)
+    return result
+
+
+@transaction.atomic
+def add_purchases(user, recipe_ids):
+    """
+    Добавляет рецепты в корзину пользователя одним INSERT,
+    а их ингредиенты - в список покупок.
+    Возвращает результаты {id рецепта: статус}.
+    """
+    recipe_ids = unique(recipe_ids)
+    results, created = add_user_relations(
+        Purchase, user.pk, 'recipe', recipe_ids,
+        existing_ids(Recipe.objects.all(), recipe_ids))
+    if created:
+        update_shopping_lists([user.pk], get_recipes_amounts(created))
+        purchases_changed(user.pk, created)
+    return results
+
+
+@transaction.atomic
+def remove_purchases(user, recipe_ids):
+    """
+    Удаляет рецепты из корзины пользователя одним DELETE,
+    а их ингредиенты - из списка покупок.
+    Возвращает результаты {id рецепта: статус}.
+    """
+    results, deleted = remove_user_relations(Purchase, user.pk, 'recipe',
+                                             unique(recipe_ids))
+    if deleted:
+        update_shopping_lists([user.pk], get_recipes_amounts(deleted),
+                              sign=-1)
+        purchases_changed(user.pk, deleted)
+    return results
+
 
+def purchases_changed(user_id, recipe_ids):
+    """
+    Обновляет после пакетного изменения корзины то, что для одной
+    покупки обновляют сервисы и сигналы Purchase.
+    """
+    invalidate_user_relations(user_id)
+    mark_stale(*recipe_ids)
+
+
+def get_expected_shopping_list(user):
+    """
+    Вычисляет список покупок пользователя по его корзине:
+    {ingredient_id: amount}.
+    """
+    return dict(get_recipes_amounts(
+        Purchase.objects.filter(user=user).values('recipe')
+    ))
 
+
+@transaction.atomic
+def rebuild_shopping_list(user):
+    """
+    Пересобирает список покупок пользователя по его корзине.
+    """
+    ShoppingListItem.objects.filter(user=user).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=getattr(user, 'pk', user),
+                         ingredient_id=ingredient_id,
+                         total_amount=amount)
+        for ingredient_id, amount in get_expected_shopping_list(user).items()
+    )
+
+
+@transaction.atomic
+def create_favorite(data):
+    """
+    Добавляет рецепт в избранное пользователя.
+    """
+    return Favorite.objects.create(**data)
+
+
+@transaction.atomic
 def delete_favorite(user, recipe):
     """
     Удаляет рецепт из избранного пользователя.
@@ -56,72 +260,221 @@ def delete_favorite(user, recipe):
     return Favorite.objects.filter(user=user, recipe=recipe).delete()
 
 
-def get_author_with_annotations(author_id, user):
+@transaction.atomic
+def add_favorites(user, recipe_ids):
     """
-    Возвращает автора с полями is_subscribed и recipes_count.
+    Добавляет рецепты в избранное пользователя одним INSERT.
+    Возвращает результаты {id рецепта: статус}.
+    """
+    recipe_ids = unique(recipe_ids)
+    results, created = add_user_relations(
+        Favorite, user.pk, 'recipe', recipe_ids,
+        existing_ids(Recipe.objects.all(), recipe_ids))
+    if created:
+        favorites_changed(user.pk, created)
+    return results
+
+
+@transaction.atomic
+def remove_favorites(user, recipe_ids):
+    """
+    Удаляет рецепты из избранного пользователя одним DELETE.
+    Возвращает результаты {id рецепта: статус}.
+    """
+    results, deleted = remove_user_relations(Favorite, user.pk, 'recipe',
+                                             unique(recipe_ids))
+    if deleted:
+        favorites_changed(user.pk, deleted)
+    return results
+
+
+def favorites_changed(user_id, recipe_ids):
+    """
+    Обновляет после пакетного изменения избранного то, что для одной
+    записи обновляют сервисы и сигналы Favorite: счетчики, рейтинги
+    и версии рецептов.
+    """
+    invalidate_user_relations(user_id)
+    set_counts(Recipe.objects.filter(pk__in=recipe_ids), 'favorites_count',
+               Favorite.objects.all(), 'recipe')
+    mark_stale(*recipe_ids)
+    bump_recipe_versions(*recipe_ids)
+
+
+def repair_counters(dry_run=False):
+    """
+    Пересчитывает хранимые счетчики рецептов автора, подписчиков
+    и добавлений в избранное, расходящиеся с данными (например, после
+    bulk_create или изменений в обход сигналов).
+    Возвращает количество исправленных объектов по счетчикам.
+    """
+    counters = (
+        (User.objects.all(), 'recipes_count', Recipe.objects, 'author'),
+        (User.objects.all(), 'subscribers_count', Subscription.objects,
+         'author'),
+        (Recipe.objects.all(), 'favorites_count', Favorite.objects,
+         'recipe'),
+    )
+    return {
+        f'{queryset.model._meta.model_name}.{field}': recount(
+            queryset, field, count_subquery(related.all(), related_field),
+            dry_run=dry_run)
+        for queryset, field, related, related_field in counters
+    }
+
+
+def get_author_with_annotations(author_id, recipes_limit=None):
+    """
+    Возвращает автора с последними рецептами.
     """
     return (User
             .objects
-            .with_is_subscribed_and_recipes_count(user=user)
+            .prefetch_related(prefetch_author_recipes(recipes_limit))
             .get(pk=author_id))
 
 
-def get_recipes_with_annotations(user):
+def get_recipes():
     """
-    Возвращает рецепты с полями is_favorited и is_in_shopping_cart.
+    Возвращает рецепты с авторами, ингредиентами и тегами.
+    Признаки is_favorited, is_in_shopping_cart и is_subscribed
+    вычисляются сериализаторами по кэшу связей пользователя.
     """
-    authors = User.objects.with_is_subscribed(user=user)
+    ingredients = (RecipeIngredient
+                   .objects
+                   .select_related('ingredient')
+                   .order_by('pk'))
     return (Recipe
             .objects
-            .with_is_favorited_and_is_in_shopping_cart(user=user)
-            .prefetch_related(Prefetch('author', queryset=authors),
-                              'ingredients_in_recipe__ingredient',
+            .select_related('author')
+            .defer('search_document')
+            .prefetch_related(Prefetch('ingredients_in_recipe',
+                                       queryset=ingredients),
                               'tags'))
 
 
-def get_author_recipes(author, recipes_limit):
+RECIPE_ROW_FIELDS = ('id', 'name', 'image', 'image_variants', 'text',
+                     'cooking_time', 'favorites_count', 'published_at',
+                     'author_id',
+                     'author__email', 'author__username',
+                     'author__first_name', 'author__last_name')
+
+
+class RecipeRowIterable(ValuesIterable):
     """
-    Возвращает рецепты автора с ограничением количества объектов.
+    Словари рецептов с ключами tags и ingredients (списки словарей).
+    Теги и ингредиенты загружаются двумя запросами на всю выборку.
+    """
+
+    def __iter__(self):
+        rows = list(super().__iter__())
+        add_tags_and_ingredients(rows)
+        return iter(rows)
+
+
+def add_tags_and_ingredients(rows):
+    """
+    Добавляет к словарям рецептов теги (в порядке Tag.Meta.ordering)
+    и ингредиенты (в порядке добавления).
+    """
+    recipes = {}
+    for row in rows:
+        row['tags'], row['ingredients'] = [], []
+        recipes[row['id']] = row
+    if not recipes:
+        return
+    tags = (Recipe.tags.through
+            .objects
+            .filter(recipe__in=recipes)
+            .values_list('recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                         'tag__slug')
+            .order_by(*[f'tag__{field}' for field in Tag._meta.ordering]))
+    for recipe_id, tag_id, name, color, slug in tags:
+        recipes[recipe_id]['tags'].append({
+            'id': tag_id,
+            'name': name,
+            'color': color,
+            'slug': slug,
+        })
+    ingredients = (RecipeIngredient
+                   .objects
+                   .filter(recipe__in=recipes)
+                   .values_list('recipe_id', 'ingredient_id',
+                                'ingredient__name',
+                                'ingredient__measurement_unit', 'amount')
+                   .order_by('pk'))
+    for recipe_id, ingredient_id, name, unit, amount in ingredients:
+        recipes[recipe_id]['ingredients'].append({
+            'id': ingredient_id,
+            'name': name,
+            'measurement_unit': unit,
+            'amount': amount,
+        })
+
+
+def get_recipe_rows():
+    """
+    Возвращает рецепты словарями для RecipeRowSerializer: поля рецепта
+    и автора, теги и ингредиенты. Запросов столько же, сколько
+    у get_recipes, но экземпляры моделей не создаются.
+    """
+    rows = Recipe.objects.values(*RECIPE_ROW_FIELDS)
+    # Как QuerySet.values(): класс итератора сохраняется
+    # при фильтрации, сортировке и срезах.
+    rows._iterable_class = RecipeRowIterable
+    return rows
+
+
+def parse_recipes_limit(recipes_limit):
+    """
+    Приводит параметр recipes_limit к положительному числу или None.
     """
-    recipes = author.recipes.all()
     try:
         recipes_limit = int(recipes_limit)
-        return recipes[:recipes_limit]
     except (ValueError, TypeError):
-        return recipes
+        return None
+    return recipes_limit if recipes_limit >= 0 else None
 
 
-def get_subscribed_authors(user):
+def prefetch_author_recipes(recipes_limit=None):
+    """
+    Возвращает Prefetch рецептов авторов.
+    При заданном recipes_limit для каждого автора выбираются только
+    recipes_limit последних рецептов - одним запросом на всю страницу
+    авторов (коррелированный подзапрос с LIMIT по автору).
+    """
+    recipes_limit = parse_recipes_limit(recipes_limit)
+    recipes = Recipe.objects.defer('text', 'search_document')
+    if recipes_limit is not None:
+        author_recipes = (Recipe
+                          .objects
+                          .filter(author=OuterRef('author'))
+                          .order_by('-published_at', '-pk')
+                          .values('pk')[:recipes_limit])
+        recipes = recipes.filter(pk__in=Subquery(author_recipes))
+    return Prefetch('recipes', queryset=recipes)
+
+
+def get_subscribed_authors(user, recipes_limit=None):
     """
     Возвращает queryset с авторами, на которых подписан пользователь.
     """
     return (User
             .objects
-            .with_is_subscribed_and_recipes_count(user=user)
-            .filter(is_subscribed=True)
-            .prefetch_related('recipes'))
+            .filter(subscribers__user=user)
+            .order_by('username')
+            .prefetch_related(prefetch_author_recipes(recipes_limit)))
 
 
 def get_shoppinglist(user: User):
     """
-    Возвращает список покупок в текстовом виде.
+    Возвращает итератор строк списка покупок пользователя:
+    словари с ключами name, measurement_unit и amount.
     """
-    recipes = Purchase.objects.filter(user=user).values('recipe')
-    ingredients = (RecipeIngredient
-                   .objects
-                   .filter(recipe__in=recipes)
-                   .values('ingredient_id')
-                   .annotate(name=F('ingredient__name'),
-                             measurement_unit=F(
-                                 'ingredient__measurement_unit'),
-                             amount=Sum('amount')))
-
-    shopping_list = ''
-    ingredient_line = '{ingredient} ({measurement_unit}) - {amount}\n'
-    for ingredient in ingredients:
-        shopping_list += ingredient_line.format(
-            ingredient=ingredient.get('name'),
-            measurement_unit=ingredient.get('measurement_unit'),
-            amount=ingredient.get('amount')
-        )
-    return shopping_list
+    return (ShoppingListItem
+            .objects
+            .filter(user=user)
+            .values(name=F('ingredient__name'),
+                    measurement_unit=F('ingredient__measurement_unit'),
+                    amount=F('total_amount'))
+            .order_by('name')
+            .iterator())
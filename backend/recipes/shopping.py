@@ -0,0 +1,70 @@
+from collections import Counter
+
+from django.db.models import Case, F, Sum, When
+from django.db.models.functions import Greatest
+
+from .models import Purchase, RecipeIngredient, ShoppingListItem
+
+
+def get_purchasers(recipe):
+    """
+    Возвращает id пользователей, добавивших рецепт в корзину.
+    """
+    return list(Purchase
+                .objects
+                .filter(recipe=recipe)
+                .values_list('user_id', flat=True))
+
+
+def get_recipes_amounts(recipes):
+    """
+    Возвращает Counter суммарного количества ингредиентов рецептов:
+    {ingredient_id: amount}.
+    """
+    return Counter(dict(RecipeIngredient
+                        .objects
+                        .filter(recipe__in=recipes)
+                        .values('ingredient_id')
+                        .annotate(total=Sum('amount'))
+                        .values_list('ingredient_id', 'total')
+                        .order_by()))
+
+
+def update_shopping_lists(user_ids, amounts, sign=1, new_ingredients=None):
+    """
+    Изменяет списки покупок пользователей на amounts:
+    {ingredient_id: изменение количества}, sign=-1 вычитает amounts.
+    new_ingredients - ингредиенты, строк которых может не быть в списках
+    (по умолчанию все с положительным изменением); для остальных
+    строки не создаются.
+    Выполняет не более трех запросов независимо от числа пользователей
+    и ингредиентов. Строки с нулевым количеством удаляются (только если
+    количества уменьшаются).
+    """
+    amounts = {ingredient_id: sign * amount
+               for ingredient_id, amount in amounts.items() if amount}
+    if not user_ids or not amounts:
+        return
+    if new_ingredients is None:
+        new_ingredients = amounts
+    ShoppingListItem.objects.bulk_create(
+        [ShoppingListItem(user_id=user_id,
+                          ingredient_id=ingredient_id,
+                          total_amount=0)
+         for user_id in user_ids
+         for ingredient_id, amount in amounts.items()
+         if amount > 0 and ingredient_id in new_ingredients],
+        ignore_conflicts=True
+    )
+    items = ShoppingListItem.objects.filter(user__in=user_ids,
+                                            ingredient__in=amounts)
+    items.update(total_amount=Greatest(
+        F('total_amount') + Case(
+            *[When(ingredient=ingredient_id, then=amount)
+              for ingredient_id, amount in amounts.items()],
+            default=0
+        ),
+        0
+    ))
+    if any(amount < 0 for amount in amounts.values()):
+        items.filter(total_amount=0).delete()
@@ -0,0 +1,139 @@
+from core.caching import bump_versions
+from core.counters import add_to_counter, deleted_with
+from core.relations import invalidate_user_relations
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from .ingredient_index import invalidate_ingredient_index
+from .models import (Favorite, Ingredient, Purchase, Recipe, RecipeIngredient,
+                     Tag)
+from .scores import create_score, mark_stale
+from .search import SEARCH_FIELDS, SEARCH_VERSION, update_search_documents
+from .shopping import (get_purchasers, get_recipes_amounts,
+                       update_shopping_lists)
+from .tags import clear_tag_bit, update_tags_masks
+
+User = get_user_model()
+
+
+def bump_recipe_versions(*recipe_ids):
+    """
+    Меняет версии списка рецептов и указанных рецептов.
+    """
+    bump_versions('recipe',
+                  *[f'recipe:{recipe_id}' for recipe_id in recipe_ids])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(**kwargs):
+    invalidate_ingredient_index()
+    bump_versions('ingredient')
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, **kwargs):
+    if not created:
+        update_search_documents(RecipeIngredient
+                                .objects
+                                .filter(ingredient=instance)
+                                .values('recipe'))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(**kwargs):
+    bump_versions('tag')
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(instance, **kwargs):
+    clear_tag_bit(instance)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    bump_recipe_versions(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or SEARCH_FIELDS & update_fields:
+        bump_versions(SEARCH_VERSION)
+    if created:
+        add_to_counter(User, instance.author_id, 'recipes_count', 1)
+        create_score(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(instance, **kwargs):
+    # Ингредиенты рецепта вычитаются из списков покупок до удаления
+    # его строк и покупок, в том числе при каскадном удалении вместе
+    # с автором.
+    update_shopping_lists(get_purchasers(instance),
+                          get_recipes_amounts([instance.pk]), sign=-1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, origin=None, **kwargs):
+    bump_versions(SEARCH_VERSION)
+    if not deleted_with(origin, User, instance.author_id):
+        add_to_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+def change_favorites_count(recipe_id, delta):
+    # Количество добавлений в избранное есть в ответах рецептов.
+    add_to_counter(Recipe, recipe_id, 'favorites_count', delta)
+    bump_recipe_versions(recipe_id)
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_saved(instance, created, **kwargs):
+    if created:
+        invalidate_user_relations(instance.user_id)
+        change_favorites_count(instance.recipe_id, 1)
+        mark_stale(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(instance, origin=None, **kwargs):
+    invalidate_user_relations(instance.user_id)
+    if not deleted_with(origin, Recipe, instance.recipe_id):
+        change_favorites_count(instance.recipe_id, -1)
+        mark_stale(instance.recipe_id)
+
+
+@receiver(post_save, sender=Purchase)
+def purchase_saved(instance, created, **kwargs):
+    if created:
+        invalidate_user_relations(instance.user_id)
+        mark_stale(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Purchase)
+def purchase_deleted(instance, origin=None, **kwargs):
+    invalidate_user_relations(instance.user_id)
+    if not deleted_with(origin, Recipe, instance.recipe_id):
+        mark_stale(instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def recipe_ingredient_changed(instance, **kwargs):
+    bump_recipe_versions(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    # Теги, измененные через менеджер связи (формы администратора,
+    # recipe.tags.set), обновляют маску тегов рецепта.
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        update_tags_masks([instance.pk])
+        bump_recipe_versions(instance.pk)
+    elif pk_set:
+        update_tags_masks(pk_set)
+        bump_recipe_versions(*pk_set)
+    else:
+        update_tags_masks()
+        bump_versions('recipe')
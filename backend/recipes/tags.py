@@ -0,0 +1,57 @@
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Recipe
+
+
+def get_tags_mask(tags):
+    """
+    Возвращает маску тегов: сумму битов Tag.bit.
+    """
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
+
+def update_tags_masks(recipe_ids=None):
+    """
+    Пересчитывает маски тегов рецептов recipe_ids (всех рецептов, если
+    не указаны) одним запросом UPDATE по таблице связей с тегами.
+    Связь рецепта с тегом уникальна, поэтому сумма битов равна
+    их побитовому ИЛИ.
+    """
+    through = Recipe.tags.through
+    # 1 << bit в PostgreSQL без приведения - integer, бит 31 и старше
+    # не поместятся.
+    tag_masks = (through
+                 .objects
+                 .filter(recipe=OuterRef('pk'))
+                 .values('recipe')
+                 .annotate(mask=Sum(Cast(Value(1), BigIntegerField())
+                                    .bitleftshift(F('tag__bit'))))
+                 .values('mask'))
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    return recipes.update(tags_mask=Coalesce(
+        Subquery(tag_masks, output_field=BigIntegerField()), 0))
+
+
+def clear_tag_bit(tag):
+    """
+    Убирает бит удаленного тега из масок рецептов: связи удаляются
+    каскадно без сигналов m2m_changed, а бит может получить новый тег.
+    """
+    return (filter_by_tags(Recipe.objects.all(), [tag])
+            .update(tags_mask=F('tags_mask').bitand(~tag.mask)))
+
+
+def filter_by_tags(queryset, tags):
+    """
+    Оставляет рецепты хотя бы с одним из тегов: проверка маски
+    тегов рецепта без соединения с таблицами тегов и без DISTINCT.
+    """
+    return (queryset
+            .alias(tags_matched=F('tags_mask').bitand(get_tags_mask(tags)))
+            .filter(tags_matched__gt=0))
@@ -0,0 +1,543 @@
+import re
+from collections import Counter
+from datetime import timedelta
+
+from core.bulk import CREATED, DELETED, EXISTS, NOT_FOUND
+from core.caching import get_versions
+from core.relations import get_user_relations, relations_version
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.models import Subscription
+
+from . import importers, services
+from .models import (TAG_BITS, Favorite, Ingredient, Purchase, Recipe,
+                     RecipeIngredient, ShoppingListItem, Tag)
+from .search import (get_recipe_search_index, search_recipes,
+                     update_search_documents)
+from .tags import get_tags_mask
+
+User = get_user_model()
+
+WRITE_RE = re.compile(r'^(INSERT|UPDATE|DELETE)\b[^"]*"(\w+)"')
+
+INGREDIENTS = 'recipes_recipeingredient'
+TAGS = 'recipes_recipe_tags'
+RECIPES = 'recipes_recipe'
+SHOPPING_LIST = 'recipes_shoppinglistitem'
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@foodgram.local',
+        first_name=username, last_name=username, password='password')
+
+
+def create_recipe(author, amounts, name='Рецепт'):
+    """
+    Создает рецепт с ингредиентами amounts: {ingredient: amount}.
+    """
+    recipe = Recipe.objects.create(
+        name=name, text='Описание', cooking_time=10,
+        image='recipes/test.png', author=author)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in amounts.items()
+    )
+    return recipe
+
+
+def get_shopping_list(user):
+    return dict(ShoppingListItem
+                .objects
+                .filter(user=user)
+                .values_list('ingredient_id', 'total_amount'))
+
+
+class RecipeDeleteShoppingListTests(TestCase):
+    """
+    Удаление рецепта вычитает его ингредиенты из списков покупок.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ingredients = list(Ingredient.objects.order_by('pk')[:3])
+        cls.author = create_user('author')
+        cls.buyer = create_user('buyer')
+        cls.recipe = create_recipe(
+            cls.author, dict(zip(cls.ingredients, (10, 1, 7))))
+        cls.other = create_recipe(
+            create_user('other'), {cls.ingredients[0]: 5}, name='Другой')
+
+    def add_purchases(self, *recipes):
+        for recipe in recipes:
+            services.create_purchase({'user': self.buyer, 'recipe': recipe})
+
+    def test_delete_recipe(self):
+        self.add_purchases(self.recipe, self.other)
+        services.delete_recipe(self.recipe)
+        self.assertEqual(get_shopping_list(self.buyer),
+                         {self.ingredients[0].pk: 5})
+
+    def test_delete_author_cascade(self):
+        self.add_purchases(self.recipe, self.other)
+        self.author.delete()
+        self.assertFalse(Purchase.objects.filter(recipe=self.recipe).exists())
+        self.assertEqual(get_shopping_list(self.buyer),
+                         {self.ingredients[0].pk: 5})
+        self.assertEqual(get_shopping_list(self.buyer),
+                         services.get_expected_shopping_list(self.buyer))
+
+    def test_delete_author_cascade_empties_list(self):
+        self.add_purchases(self.recipe)
+        self.author.delete()
+        self.assertEqual(get_shopping_list(self.buyer), {})
+
+
+class UserRelationsSignalsTests(TestCase):
+    """
+    Избранное и корзина, измененные не через сервисы, сбрасывают
+    кэш связей пользователя и меняют версию связей.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('user')
+        cls.recipe = create_recipe(cls.author, {})
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_relations_changed(self, change, **expected):
+        get_user_relations(self.user)
+        version = get_versions(relations_version(self.user.pk))
+        change()
+        self.assertNotEqual(get_versions(relations_version(self.user.pk)),
+                            version)
+        relations = get_user_relations(self.user)
+        for name, recipe_ids in expected.items():
+            self.assertEqual(getattr(relations, name), recipe_ids)
+
+    def test_create_and_delete(self):
+        for model, name in ((Favorite, 'favorites'),
+                            (Purchase, 'purchases')):
+            with self.subTest(model=model.__name__):
+                self.assert_relations_changed(
+                    lambda: model.objects.create(user=self.user,
+                                                 recipe=self.recipe),
+                    **{name: {self.recipe.pk}})
+                self.assert_relations_changed(
+                    lambda: model.objects.filter(user=self.user).delete(),
+                    **{name: frozenset()})
+
+    def test_recipe_cascade(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Purchase.objects.create(user=self.user, recipe=self.recipe)
+        self.assert_relations_changed(self.author.delete,
+                                      favorites=frozenset(),
+                                      purchases=frozenset())
+
+
+class SubscribedAuthorsTests(TestCase):
+    """
+    Последние рецепты авторов подписок загружаются одним запросом
+    при любом recipes_limit.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.recipes = {}
+        published_at = timezone.now()
+        for username, count in (('author_a', 5), ('author_b', 2),
+                                ('author_c', 0)):
+            author = create_user(username)
+            Subscription.objects.create(user=cls.user, author=author)
+            cls.recipes[author.pk] = []
+            for number in range(count):
+                recipe = create_recipe(author, {}, name=f'Рецепт {number}')
+                # Время публикации рецептов автора убывает не в порядке
+                # id, последние два рецепта опубликованы одновременно.
+                published_at -= timedelta(minutes=number % 2)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    published_at=published_at)
+                cls.recipes[author.pk].append(recipe.pk)
+        create_recipe(create_user('unsubscribed'), {})
+
+    def expected_recipes(self, author_id, limit):
+        recipe_ids = list(Recipe
+                          .objects
+                          .filter(author=author_id)
+                          .order_by('-published_at', '-pk')
+                          .values_list('pk', flat=True))
+        return recipe_ids if limit is None else recipe_ids[:limit]
+
+    def test_recipes_limit(self):
+        # При recipes_limit=0 подзапрос пуст, и Django не выполняет
+        # запрос рецептов.
+        for recipes_limit, limit, queries in ((None, None, 2),
+                                              ('abc', None, 2),
+                                              ('-1', None, 2),
+                                              ('0', 0, 1),
+                                              ('1', 1, 2),
+                                              ('3', 3, 2),
+                                              ('10', 10, 2)):
+            with self.subTest(recipes_limit=recipes_limit):
+                with self.assertNumQueries(queries):
+                    authors = list(services.get_subscribed_authors(
+                        self.user, recipes_limit))
+                self.assertEqual([author.username for author in authors],
+                                 ['author_a', 'author_b', 'author_c'])
+                for author in authors:
+                    self.assertEqual(
+                        [recipe.pk for recipe in author.recipes.all()],
+                        self.expected_recipes(author.pk, limit))
+
+
+class UpdateRecipeTests(TestCase):
+    """
+    services.update_recipe выполняет запросы на изменение только
+    для изменившихся данных и корректирует списки покупок.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag-{number}')
+                    for number in range(3)]
+        ingredients = list(Ingredient.objects.order_by('pk')[:6])
+        cls.extra = ingredients[4:]
+        author = create_user('author')
+        cls.recipe = create_recipe(
+            author, dict(zip(ingredients[:4], (10, 20, 30, 40))))
+        cls.recipe.tags.set(cls.tags[:1])
+        cls.recipe.tags_mask = get_tags_mask(cls.tags[:1])
+        cls.recipe.save(update_fields=['tags_mask'])
+        other = create_recipe(author, {ingredients[0]: 5}, name='Другой')
+        cls.users = [create_user(f'buyer_{number}') for number in range(3)]
+        for user in cls.users:
+            Purchase.objects.create(user=user, recipe=cls.recipe)
+            Purchase.objects.create(user=user, recipe=other)
+            services.rebuild_shopping_list(user)
+
+    def get_data(self):
+        recipe = services.get_recipes().get(pk=self.recipe.pk)
+        return recipe, {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'tags': {tag.pk for tag in recipe.tags.all()},
+            'ingredients': {item.ingredient_id: item.amount
+                            for item in recipe.ingredients_in_recipe.all()},
+        }
+
+    def update(self, change):
+        """
+        Изменяет данные рецепта функцией change и обновляет рецепт.
+        Возвращает запросы на изменение {(операция, таблица): количество}
+        и общее число запросов.
+        """
+        recipe, data = self.get_data()
+        change(data)
+        validated_data = {
+            'name': data['name'],
+            'text': data['text'],
+            'cooking_time': data['cooking_time'],
+            'tags': list(Tag.objects.filter(pk__in=data['tags'])),
+            'ingredients_in_recipe': [
+                {'ingredient': ingredient,
+                 'amount': data['ingredients'][ingredient.pk]}
+                for ingredient in Ingredient.objects.filter(
+                    pk__in=data['ingredients'])
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            services.update_recipe(recipe, validated_data)
+        sql = [query['sql'] for query in queries.captured_queries
+               if 'SAVEPOINT' not in query['sql']]
+        writes = Counter(match.groups() for match in map(WRITE_RE.match, sql)
+                         if match)
+        self.assert_state(data)
+        return writes, len(sql)
+
+    def assert_state(self, data):
+        recipe, actual = self.get_data()
+        self.assertEqual(actual['ingredients'], data['ingredients'])
+        self.assertEqual(actual['tags'], data['tags'])
+        self.assertEqual(recipe.tags_mask,
+                         get_tags_mask(recipe.tags.all()))
+        for user in self.users:
+            self.assertEqual(get_shopping_list(user),
+                             services.get_expected_shopping_list(user))
+
+    def change_amount(self, data):
+        data['ingredients'][min(data['ingredients'])] += 1
+
+    def add_ingredients(self, data):
+        data['ingredients'].update(
+            dict.fromkeys([ingredient.pk for ingredient in self.extra], 7))
+
+    def remove_ingredient(self, data):
+        data['ingredients'].pop(max(data['ingredients']))
+
+    def replace_tags(self, data):
+        data['tags'] = {self.tags[1].pk, self.tags[2].pk}
+
+    def test_no_changes(self):
+        writes, queries = self.update(lambda data: None)
+        self.assertEqual(writes, Counter())
+        self.assertEqual(queries, 0)
+
+    def test_change_amount(self):
+        writes, queries = self.update(self.change_amount)
+        self.assertEqual(writes, Counter({('UPDATE', INGREDIENTS): 1,
+                                          ('UPDATE', SHOPPING_LIST): 1}))
+        self.assertLessEqual(queries, 3)
+
+    def test_add_ingredients(self):
+        writes, queries = self.update(self.add_ingredients)
+        self.assertEqual(writes, Counter({('INSERT', INGREDIENTS): 1,
+                                          ('INSERT', SHOPPING_LIST): 1,
+                                          ('UPDATE', SHOPPING_LIST): 1,
+                                          ('UPDATE', RECIPES): 1}))
+        self.assertLessEqual(queries, 7)
+
+    def test_remove_ingredient(self):
+        writes, queries = self.update(self.remove_ingredient)
+        self.assertEqual(writes, Counter({('DELETE', INGREDIENTS): 1,
+                                          ('UPDATE', SHOPPING_LIST): 1,
+                                          ('DELETE', SHOPPING_LIST): 1,
+                                          ('UPDATE', RECIPES): 1}))
+        self.assertLessEqual(queries, 7)
+
+    def test_replace_tags(self):
+        writes, queries = self.update(self.replace_tags)
+        self.assertEqual(writes, Counter({('UPDATE', RECIPES): 1,
+                                          ('DELETE', TAGS): 1,
+                                          ('INSERT', TAGS): 1}))
+        self.assertLessEqual(queries, 3)
+
+    def test_change_name(self):
+        def change_name(data):
+            data['name'] += ' (изменено)'
+
+        writes, queries = self.update(change_name)
+        self.assertEqual(writes, Counter({('UPDATE', RECIPES): 1}))
+        self.assertEqual(queries, 1)
+
+    def test_change_all(self):
+        def change_all(data):
+            self.change_amount(data)
+            self.remove_ingredient(data)
+            self.add_ingredients(data)
+            self.replace_tags(data)
+            data['text'] += ' (изменено)'
+
+        writes, queries = self.update(change_all)
+        self.assertEqual(writes, Counter({('UPDATE', RECIPES): 2,
+                                          ('DELETE', INGREDIENTS): 1,
+                                          ('UPDATE', INGREDIENTS): 1,
+                                          ('INSERT', INGREDIENTS): 1,
+                                          ('DELETE', TAGS): 1,
+                                          ('INSERT', TAGS): 1,
+                                          ('INSERT', SHOPPING_LIST): 1,
+                                          ('UPDATE', SHOPPING_LIST): 1,
+                                          ('DELETE', SHOPPING_LIST): 1}))
+        self.assertLessEqual(queries, 13)
+
+
+class LoadIngredientsTests(TestCase):
+    """
+    Загрузка справочника ингредиентов пакетами.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.create(name='Flour', measurement_unit='g')
+        cls.records = [
+            {'name': 'Sugar', 'measurement_unit': 'g'},
+            {'name': ' Sugar ', 'measurement_unit': 'g'},
+            {'name': 'Flour', 'measurement_unit': 'g'},
+            {'name': 'FLOUR', 'measurement_unit': 'g'},
+            {'name': 'Salt', 'measurement_unit': 'g'},
+            {'name': 'salt', 'measurement_unit': 'G'},
+            {'name': '', 'measurement_unit': 'g'},
+            {'name': 'Sugar', 'measurement_unit': 'kg'},
+        ]
+        cls.expected = {importers.INSERTED: 3, importers.UNCHANGED: 2,
+                        importers.CONFLICTING: 2, importers.INVALID: 1}
+
+    def load(self, **kwargs):
+        statuses = []
+        counts = importers.load_ingredients(
+            iter(self.records), batch_size=2,
+            report=lambda status, *args: statuses.append(status), **kwargs)
+        self.assertEqual(dict(counts), self.expected)
+        return statuses
+
+    def get_ingredients(self):
+        return set(Ingredient
+                   .objects
+                   .filter(name__in=['Flour', 'Sugar', 'Salt', 'salt'])
+                   .values_list('name', 'measurement_unit'))
+
+    def test_load(self):
+        # На пакет - запрос существующих ингредиентов и INSERT новых,
+        # во втором пакете новых нет.
+        with self.assertNumQueries(7):
+            statuses = self.load()
+        self.assertEqual(statuses, [
+            importers.INSERTED, importers.UNCHANGED, importers.UNCHANGED,
+            importers.CONFLICTING, importers.INSERTED,
+            importers.CONFLICTING, importers.INVALID, importers.INSERTED,
+        ])
+        self.assertEqual(self.get_ingredients(),
+                         {('Flour', 'g'), ('Sugar', 'g'), ('Salt', 'g'),
+                          ('Sugar', 'kg')})
+        self.expected = {importers.INSERTED: 0, importers.UNCHANGED: 5,
+                         importers.CONFLICTING: 2, importers.INVALID: 1}
+        self.load()
+
+    def test_dry_run(self):
+        self.load(dry_run=True)
+        self.assertEqual(self.get_ingredients(), {('Flour', 'g')})
+
+
+class BulkPurchasesTests(TestCase):
+    """
+    Пакетные изменения корзины меняют списки покупок только на связи,
+    которые добавил или удалил сам запрос.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        ingredients = list(Ingredient.objects.order_by('pk')[:2])
+        author = create_user('author')
+        cls.user = create_user('user')
+        cls.recipes = [create_recipe(author, {ingredients[0]: 10}),
+                       create_recipe(author, {ingredients[0]: 1,
+                                              ingredients[1]: 2})]
+        cls.recipe_ids = [recipe.pk for recipe in cls.recipes]
+
+    def assert_shopping_list(self):
+        self.assertEqual(get_shopping_list(self.user),
+                         services.get_expected_shopping_list(self.user))
+
+    def test_add_existing(self):
+        # Связь, добавленная другим запросом между проверкой
+        # и INSERT, не учитывается в списке покупок второй раз.
+        services.create_purchase({'user': self.user,
+                                  'recipe': self.recipes[0]})
+        missing = max(self.recipe_ids) + 1
+        results = services.add_purchases(self.user,
+                                         [*self.recipe_ids, missing])
+        self.assertEqual(results, {self.recipe_ids[0]: EXISTS,
+                                   self.recipe_ids[1]: CREATED,
+                                   missing: NOT_FOUND})
+        self.assert_shopping_list()
+        results = services.add_purchases(self.user, self.recipe_ids)
+        self.assertEqual(set(results.values()), {EXISTS})
+        self.assert_shopping_list()
+
+    def test_remove_missing(self):
+        services.add_purchases(self.user, self.recipe_ids)
+        Purchase.objects.filter(user=self.user,
+                                recipe=self.recipes[0]).delete()
+        services.rebuild_shopping_list(self.user)
+        results = services.remove_purchases(self.user, self.recipe_ids)
+        self.assertEqual(results, {self.recipe_ids[0]: NOT_FOUND,
+                                   self.recipe_ids[1]: DELETED})
+        self.assertEqual(get_shopping_list(self.user), {})
+        results = services.remove_purchases(self.user, self.recipe_ids)
+        self.assertEqual(set(results.values()), {NOT_FOUND})
+        self.assertEqual(get_shopping_list(self.user), {})
+
+
+class RecipeSearchTests(TestCase):
+    """
+    Поиск рецептов по индексу в памяти: порядок по рангу и перестроение
+    индекса только после изменения содержимого рецептов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.user = create_user('user')
+        cls.ingredient = Ingredient.objects.order_by('pk').first()
+        cls.in_name = create_recipe(author, {cls.ingredient: 1},
+                                    name='Красный суп')
+        cls.in_text = create_recipe(author, {}, name='Суп')
+        Recipe.objects.filter(pk=cls.in_text.pk).update(
+            text='Суп красный и густой')
+        cls.other = create_recipe(author, {}, name='Салат')
+        update_search_documents([cls.in_name.pk, cls.in_text.pk,
+                                 cls.other.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        return list(search_recipes(Recipe.objects.all(), query)
+                    .values_list('pk', flat=True))
+
+    def test_order_by_rank(self):
+        self.assertEqual(self.search('красный'),
+                         [self.in_name.pk, self.in_text.pk])
+        self.assertEqual(self.search('суп густой'), [self.in_text.pk])
+        self.assertEqual(self.search('борщ'), [])
+        queryset = search_recipes(Recipe.objects.all(), 'суп')
+        self.assertEqual(queryset.count(), 2)
+        self.assertEqual(queryset.exclude(pk=self.in_name.pk).count(), 1)
+
+    def test_max_results(self):
+        # Запрос содержит ранги только лучших результатов.
+        with self.settings(RECIPE_SEARCH_MAX_RESULTS=1):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.search('красный'), [self.in_name.pk])
+        self.assertEqual(context.captured_queries[-1]['sql'].count('WHEN'), 1)
+
+    def test_index_version(self):
+        index = get_recipe_search_index()
+        services.add_favorites(self.user, [self.in_name.pk])
+        Purchase.objects.create(user=self.user, recipe=self.in_text)
+        self.in_name.save(update_fields=['cooking_time'])
+        self.assertIs(get_recipe_search_index(), index)
+        self.other.name = 'Борщ'
+        self.other.save(update_fields=['name'])
+        self.assertIsNot(get_recipe_search_index(), index)
+        self.assertEqual(self.search('борщ'), [self.other.pk])
+        self.ingredient.name = 'Свекла'
+        self.ingredient.save()
+        self.assertEqual(self.search('свекла'), [self.in_name.pk])
+
+
+class TagBitsTests(TestCase):
+    """
+    Тегов не больше, чем битов маски тегов рецепта.
+    """
+
+    def create_tag(self, number):
+        return Tag(name=f'Тег {number}', color=f'#{number:06X}',
+                   slug=f'tag-{number}')
+
+    def test_bits_exhausted(self):
+        for number in range(TAG_BITS):
+            self.create_tag(number).save()
+        self.assertEqual(set(Tag.objects.values_list('bit', flat=True)),
+                         set(range(TAG_BITS)))
+        tag = self.create_tag(TAG_BITS)
+        with self.assertRaises(ValidationError):
+            tag.full_clean()
+        with self.assertRaises(ValidationError):
+            tag.save()
+        self.assertEqual(Tag.objects.count(), TAG_BITS)
+        # Бит удаленного тега освобождается.
+        Tag.objects.filter(bit=5).delete()
+        tag.save()
+        self.assertEqual(tag.bit, 5)
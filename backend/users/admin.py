@@ -1,3 +1,4 @@
+from core.counters import move_counter
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
@@ -17,7 +18,9 @@ class UserAdmin(BaseUserAdmin):
                     'first_name',
                     'last_name',
                     'is_active',
-                    'is_staff')
+                    'is_staff',
+                    'recipes_count',
+                    'subscribers_count')
     list_filter = ('is_active', 'is_staff', 'is_superuser')
     inlines = [SubscriptionsInline]
     fieldsets = (
@@ -54,5 +57,14 @@ class UserAdmin(BaseUserAdmin):
         ),
     )
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        for inline_form in formset.initial_forms:
+            if ('author' in inline_form.changed_data
+                    and inline_form not in formset.deleted_forms):
+                move_counter(User, 'subscribers_count',
+                             inline_form.initial['author'],
+                             inline_form.instance.author_id)
+
 
 admin.register(Subscription)
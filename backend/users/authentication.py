@@ -0,0 +1,88 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from core.caching import (LocalTTLCache, add_version, bump_versions,
+                          peek_version)
+from django.conf import settings
+from rest_framework.authentication import (TokenAuthentication,
+                                           get_authorization_header)
+from rest_framework.authtoken.models import Token
+
+# Токен -> (версия токена, пользователь, токен).
+_tokens = LocalTTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE,
+                        timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+
+def token_version(key):
+    """
+    Возвращает имя метки версии токена. Сам токен в имя не попадает.
+    """
+    return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()[:32]}'
+
+
+def invalidate_tokens(*keys):
+    """
+    Делает недействительными закэшированные токены, в том числе
+    в других процессах, если кэш Django общий.
+    """
+    bump_versions(*[token_version(key) for key in keys])
+
+
+def invalidate_user_tokens(*user_ids):
+    """
+    Делает недействительными закэшированные токены пользователей.
+    """
+    invalidate_tokens(*Token.objects.filter(user__in=user_ids)
+                      .values_list('key', flat=True))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшем токен -> пользователь в памяти
+    процесса (LRU с временем жизни).
+    Запись действительна, пока не изменилась версия токена в кэше
+    Django: версия меняется при удалении токена (выход), изменении
+    пароля, деактивации и других изменениях пользователя.
+    При попадании в кэш запросов к базе данных нет.
+    """
+
+    def authenticate_credentials(self, key):
+        # Версия читается до загрузки пользователя, поэтому изменение,
+        # сделанное во время загрузки, сбросит запись. Метка создается
+        # только для существующих токенов.
+        version = peek_version(token_version(key))
+        credentials = self.get_cached_credentials(key, version)
+        if credentials is not None:
+            return credentials
+        user, token = super().authenticate_credentials(key)
+        if version is None:
+            version = add_version(token_version(key))
+        if version is not None:
+            _tokens.set(key, (version, user, token))
+        return user, token
+
+    @staticmethod
+    def get_cached_credentials(key, version):
+        entry = _tokens.get(key)
+        if entry is not None and version is not None and entry[0] == version:
+            return entry[1:]
+        return None
+
+    async def aauthenticate(self, request):
+        """
+        authenticate для асинхронных представлений: при попадании в кэш
+        выполняется в цикле событий, иначе (промах, ошибки заголовка) -
+        в потоке.
+        """
+        auth = get_authorization_header(request).split()
+        if len(auth) == 2 and auth[0].lower() == self.keyword.lower().encode():
+            try:
+                key = auth[1].decode()
+            except UnicodeError:
+                key = None
+            if key is not None:
+                credentials = self.get_cached_credentials(
+                    key, peek_version(token_version(key)))
+                if credentials is not None:
+                    return credentials
+        return await sync_to_async(self.authenticate)(request)
@@ -1,6 +1,6 @@
 # Generated by Django 4.1.6 on 2023-03-02 20:01
 
-import users.models
+import django.contrib.auth.models
 from django.db import migrations
 
 
@@ -18,7 +18,7 @@ class Migration(migrations.Migration):
         migrations.AlterModelManagers(
             name='user',
             managers=[
-                ('objects', users.models.CustomUserManager()),
+                ('objects', django.contrib.auth.models.UserManager()),
             ],
         ),
     ]
@@ -1,27 +1,11 @@
+from core.counters import CounterFieldsMixin
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
-from django.db.models import Count, Exists, OuterRef
 
 
-class CustomUserManager(UserManager):
-
-    def with_is_subscribed(self, user):
-        if user.is_anonymous:
-            return self.all()
-        user_subscriptions = (Subscription
-                              .objects
-                              .filter(user=user,
-                                      author=OuterRef('pk')))
-        return self.annotate(is_subscribed=Exists(user_subscriptions))
-
-    def with_is_subscribed_and_recipes_count(self, user):
-        return (self
-                .with_is_subscribed(user=user)
-                .annotate(recipes_count=Count('recipes')))
-
-
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name']
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     email = models.EmailField('Email',
                               unique=True)
@@ -29,8 +13,14 @@ class User(AbstractUser):
                                   max_length=150)
     last_name = models.CharField('Фамилия',
                                  max_length=150)
-
-    objects = CustomUserManager()
+    recipes_count = models.PositiveIntegerField('Количество рецептов',
+                                                default=0,
+                                                editable=False)
+    subscribers_count = models.PositiveIntegerField('Количество подписчиков',
+                                                    default=0,
+                                                    editable=False)
+
+    objects = UserManager()
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -1,3 +1,5 @@
+from core.profiling import ProfiledSerializerMixin
+from core.relations import get_context_relations
 from django.contrib.auth import get_user_model, password_validation
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
@@ -6,8 +8,9 @@ from rest_framework import serializers
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
-    is_subscribed = serializers.BooleanField(read_only=True, default=False)
+class UserSerializer(ProfiledSerializerMixin,
+                     serializers.ModelSerializer):
+    is_subscribed = serializers.SerializerMethodField()
     password = serializers.CharField(style={"input_type": "password"},
                                      write_only=True)
 
@@ -24,6 +27,10 @@ class UserSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'is_subscribed']
 
+    def get_is_subscribed(self, user):
+        relations = get_context_relations(self.context)
+        return user.pk in relations.subscriptions
+
     @staticmethod
     def validate_username(username):
         if username.lower() == 'me':
@@ -49,7 +56,8 @@ class UserSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
-class ChangePasswordSerializer(serializers.Serializer):
+class ChangePasswordSerializer(ProfiledSerializerMixin,
+                               serializers.Serializer):
     new_password = serializers.CharField(style={'input_type': 'password'})
     current_password = serializers.CharField()
 
@@ -1,8 +1,65 @@
+from core.bulk import (FORBIDDEN, add_user_relations, existing_ids,
+                       remove_user_relations, unique)
+from core.counters import set_counts
+from core.relations import invalidate_user_relations
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from users.models import Subscription
 
+User = get_user_model()
 
+
+@transaction.atomic
+def create_subscription(data):
+    """
+    Создает подписку на автора.
+    """
+    return Subscription.objects.create(**data)
+
+
+@transaction.atomic
 def delete_subscription(user, author):
     return (Subscription
             .objects
             .filter(user=user, author=author)
             .delete())
+
+
+@transaction.atomic
+def add_subscriptions(user, author_ids):
+    """
+    Подписывает пользователя на авторов одним INSERT.
+    Возвращает результаты {id автора: статус}.
+    """
+    author_ids = unique(author_ids)
+    results, created = add_user_relations(
+        Subscription, user.pk, 'author', author_ids,
+        existing_ids(User.objects.exclude(pk=user.pk), author_ids))
+    if user.pk in results:
+        results[user.pk] = FORBIDDEN
+    if created:
+        subscriptions_changed(user.pk, created)
+    return results
+
+
+@transaction.atomic
+def remove_subscriptions(user, author_ids):
+    """
+    Удаляет подписки пользователя на авторов одним DELETE.
+    Возвращает результаты {id автора: статус}.
+    """
+    results, deleted = remove_user_relations(Subscription, user.pk,
+                                             'author', unique(author_ids))
+    if deleted:
+        subscriptions_changed(user.pk, deleted)
+    return results
+
+
+def subscriptions_changed(user_id, author_ids):
+    """
+    Обновляет после пакетного изменения подписок то, что для одной
+    подписки обновляют сервисы и сигналы Subscription.
+    """
+    invalidate_user_relations(user_id)
+    set_counts(User.objects.filter(pk__in=author_ids), 'subscribers_count',
+               Subscription.objects.all(), 'author')
@@ -0,0 +1,43 @@
+from core.caching import bump_versions
+from core.counters import add_to_counter, deleted_with
+from core.relations import invalidate_user_relations
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens, invalidate_user_tokens
+from .models import Subscription
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(instance, created=False, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, который
+    # не попадает в ответы API.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_versions('user')
+    if not created:
+        # Пароль, активность и данные пользователя в кэше токенов.
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(instance, **kwargs):
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_saved(instance, created, **kwargs):
+    if created:
+        invalidate_user_relations(instance.user_id)
+        add_to_counter(User, instance.author_id, 'subscribers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(instance, origin=None, **kwargs):
+    invalidate_user_relations(instance.user_id)
+    if not deleted_with(origin, User, instance.author_id):
+        add_to_counter(User, instance.author_id, 'subscribers_count', -1)
@@ -0,0 +1,52 @@
+from core.caching import get_versions
+from core.relations import get_user_relations, relations_version
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from .models import Subscription
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@foodgram.local',
+        first_name=username, last_name=username, password='password')
+
+
+class SubscriptionRelationsTests(TestCase):
+    """
+    Подписки, измененные не через сервисы, сбрасывают кэш связей
+    пользователя и меняют версию связей.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.author = create_user('author')
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_subscriptions(self, change, expected):
+        get_user_relations(self.user)
+        version = get_versions(relations_version(self.user.pk))
+        change()
+        self.assertNotEqual(get_versions(relations_version(self.user.pk)),
+                            version)
+        self.assertEqual(get_user_relations(self.user).subscriptions,
+                         expected)
+
+    def test_create_and_delete(self):
+        self.assert_subscriptions(
+            lambda: Subscription.objects.create(user=self.user,
+                                                author=self.author),
+            {self.author.pk})
+        self.assert_subscriptions(
+            lambda: Subscription.objects.filter(user=self.user).delete(),
+            frozenset())
+
+    def test_author_cascade(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        self.assert_subscriptions(self.author.delete, frozenset())
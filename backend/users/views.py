@@ -15,9 +15,7 @@ class UserViewSet(mixins.CreateModelMixin,
                   viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = serializers.UserSerializer
-
-    def get_queryset(self):
-        return User.objects.with_is_subscribed(user=self.request.user)
+    read_from_replicas = True
 
     def get_permissions(self):
         if self.action in ('me', 'retrieve'):